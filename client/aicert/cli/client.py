@@ -1,21 +1,26 @@
 from cryptography.hazmat.primitives import serialization
 from cryptography.x509 import load_der_x509_certificate
 from pathlib import Path
+import os
 import pkgutil
 import requests
+import sseclient
 import tempfile
 from time import sleep
 import typer
 from rich import print
-from typing import Optional
+from typing import Dict, Iterator, List, Optional
 import urllib.parse
 import yaml
 import warnings
 import json
 import subprocess
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import TypeAdapter
 
-from aicert_common.protocol import ConfigFile, FileList, AxolotlConfigString
+from aicert_common.encoding import CBOR_MEDIA_TYPE, decode_attestation
+from aicert_common.protocol import ConfigFile, FileList, AxolotlConfigString, OutputManifest
 from aicert_common.logging import log
 from aicert_common.errors import AICertException
 from .deployment.deployer import Deployer
@@ -25,8 +30,13 @@ from .verify import (
     PCR_FOR_CERTIFICATE,
     PCR_FOR_OUTPUT_MEASUREMENT,
     check_event_log,
+    check_output_chunk,
     check_quote,
+    nonce_batch_root,
+    IncrementalEventLogVerifier,
     decode_b64_encoding,
+    check_content,
+    event_spec,
     verify_ak_cert,
     check_server_cert,
     check_container_ids,
@@ -98,6 +108,7 @@ class Client:
         self.__tf_home = Path.home() / ".aicert"
         self.__storage_account = "aicertstorage"
         self.__storage_container = "aicertcontainer"
+        self.__contents: Dict[str, dict] = {}
 
         if self.__simulation_mode:
             warnings.warn("Running in simulation mode", RuntimeWarning)
@@ -203,17 +214,25 @@ class Client:
         session.mount(
                 self.__base_url, ForcedIPHTTPSAdapter(dest_ip=server_ip, max_retries=retries)
             )
-        attestation = session.get(f"{self.__base_url}/aTLS",verify=False)
+        # A fresh nonce proves the attestation was generated for this request
+        nonce = os.urandom(32)
+        attestation = session.get(
+            f"{self.__base_url}/aTLS",
+            params={"nonce": nonce.hex()},
+            headers={"Accept": CBOR_MEDIA_TYPE},
+            verify=False,
+        )
         raise_for_status(
                 attestation, "Cannot retrieve server certificate for aTLS"
             )
 
-        attestation_json = json.loads(attestation.content)
-
-        ca_cert = attestation_json["ca_cert"]
+        try:
+            ca_cert = decode_attestation(attestation.content)["ca_cert"]
+        except Exception as e:
+            raise AICertInvalidAttestationFormatException(e)
 
         # Verify quote and CA TLS certificate
-        self.verify_attestation(attestation.content, PCR_FOR_CERTIFICATE, False, ca_cert)
+        self.verify_attestation(attestation.content, PCR_FOR_CERTIFICATE, False, ca_cert, nonce=nonce)
         return ca_cert
 
 
@@ -254,17 +273,14 @@ class Client:
         sleep(2)
         # adding time delta for the finetuning
 
-        with self.__session.get(f"{self.__base_url}/build/status", stream=True) as stream_resp:
-            event_data = ""
-            for line in stream_resp.iter_lines():
-                if line != b'':
-                    event_data = line.decode("utf-8")
-                    if "[EOF]" in event_data:
-                        break
-                    event_data = event_data[92:]
-                    if len(event_data) >= 10:
-                        event_data = event_data[:-10]
-                    print(event_data.replace("\\", ""))
+        # Each "log" message carries the JSON Lines records written since the previous one
+        messages = sseclient.SSEClient(f"{self.__base_url}/build/status", session=self.__session)
+        lines = (line for message in messages if message.event == "log" for line in message.data.splitlines())
+        for event_data in lines:
+            record = json.loads(event_data)
+            if record.get("eof"):
+                break
+            print(record["message"])
 
         ## Upload to storage account 
         expiry = datetime.now() + timedelta(hours=1)
@@ -290,15 +306,24 @@ class Client:
             return url
 
     
-    def wait_for_attestation(self) -> bytes:
+    def wait_for_attestation(self, nonce: Optional[bytes] = None, media_type: str = CBOR_MEDIA_TYPE) -> bytes:
         """Block until the attestation endpoint returns the attestation
         
         The client will repededly poll the runner. The runner anwers with
         a 204 response while the build is still running. Once it has completed,
         it simply returns the attestation.
+
+        Args:
+            nonce (bytes, optional): nonce proving the freshness of the quote,
+                to be passed to `verify_attestation` as well
+            media_type (str, default = CBOR): preferred encoding of the attestation
+                (see aicert-common's encoding), servers that predate it answer in JSON
         """
+        params = {"nonce": nonce.hex()} if nonce is not None else None
         while True:
-            res = self.__session.get(f"{self.__base_url}/attestation")
+            res = self.__session.get(
+                f"{self.__base_url}/attestation", params=params, headers={"Accept": media_type}
+            )
             if res.status_code == 204:
                 sleep(30)
                 continue
@@ -308,31 +333,149 @@ class Client:
             return res.content
 
 
-    def verify_attestation(self, build_response: bytes, pcr_index = PCR_FOR_MEASUREMENT, verbose: bool = False, server_certs = ""):
-        """Verify received attesation validity
+    def follow_event_log(self, verifier: IncrementalEventLogVerifier) -> Iterator[dict]:
+        """Stream the measured events as the server commits them
+
+        Each event is replayed by the verifier before being yielded, and the
+        stream resumes after the last verified event if the connection drops.
+        Once the build is over, the replayed PCRs must be checked against a
+        quote with `verify_event_log_stream`.
 
-        1. Parse the JSON reponse
-        2. Check simulation mode
-        3. Verify certificate chain
-        4. Verify quote signature
-        5. Verify boot PCRs (firmware, bootloader, initramfs, OS)
-        6. Verify event log (final hash in PCR_FOR_MEASUREMENT) by replaying it (works like a chain of hashes)
-        OR
-        6. Verify TLS certificate (final hash in PCR_FOR_CERTIFICATE)
-        
         Args:
-            build_response (bytes): reponse of the attestation endpoint
-            verbose (bool, default = False): whether to print verification information in stdout
+            verifier (IncrementalEventLogVerifier): replays the events, may already
+                have replayed the first ones
+
+        Yields:
+            dict: the parsed events
+        """
+        messages = sseclient.SSEClient(
+            f"{self.__base_url}/event_log/stream?since={verifier.count}",
+            session=self.__session,
+        )
+        for message in messages:
+            if message.event == "measurement":
+                yield verifier.update(json.loads(message.data))
+            elif message.event == "end":
+                end = json.loads(message.data)
+                if end["status"] != "completed":
+                    raise AICertException(f"Build failed: {end.get('detail')}")
+                return
+
+
+    def verify_event_log_stream(self, verifier: IncrementalEventLogVerifier, build_response: bytes, nonce: Optional[bytes] = None) -> None:
+        """Check the PCRs replayed from a streamed event log against an attestation
+
+        Only the quote of the attestation is used, its event log is ignored.
+
+        Args:
+            verifier (IncrementalEventLogVerifier): verifier that replayed the whole stream
+            build_response (bytes): reponse of the attestation endpoint, in JSON, CBOR or MessagePack
+            nonce (bytes, optional): nonce sent with the attestation request
         """
         try:
-            build_response = json.loads(build_response)
+            build_response = decode_attestation(build_response)
         except Exception as e:
-            AICertInvalidAttestationFormatException(e)
-        
+            raise AICertInvalidAttestationFormatException(e)
+        att_document = self.__verify_quote(build_response, nonce=nonce)
+        if att_document is not None:
+            verifier.check_quote_pcrs(att_document)
+
+
+    def fetch_content(self, digest: str, content_dir: Optional[Path] = None) -> Optional[dict]:
+        """Fetch a spec referenced by its content digest in the event log
+
+        Specs are only fetched when they are needed, and checked against their digest.
+        The event log must have been verified beforehand for them to be trusted.
+
+        Args:
+            digest (str): content digest of the spec, as measured in its event
+            content_dir (Path, optional): local copy of the content store, looked up
+                before the runner and filled with the specs fetched from it
+
+        Returns:
+            Optional[dict]: the spec, None if neither the local copy nor the runner have it
+        """
+        if digest in self.__contents:
+            return self.__contents[digest]
+        local_file = content_dir / f"{digest}.json" if content_dir is not None else None
+        if local_file is not None and local_file.exists():
+            data = local_file.read_bytes()
+        else:
+            try:
+                res = self.__session.get(f"{self.__base_url}/content/{digest}")
+            except requests.RequestException:
+                return None
+            if res.status_code == 404:
+                return None
+            raise_for_status(res, f"Cannot retrieve content {digest}")
+            data = res.content
+        content = check_content(digest, data)
+        if local_file is not None and not local_file.exists():
+            content_dir.mkdir(parents=True, exist_ok=True)
+            local_file.write_bytes(data)
+        self.__contents[digest] = content
+        return content
+
+
+    def get_output_manifests(self) -> List[OutputManifest]:
+        """Retrieve the Merkle manifests of the outputs
+
+        The manifests are not trusted by themselves: they must be passed
+        to `verify_attestation` which checks them against the roots
+        measured in the outputs event.
+        """
+        while True:
+            res = self.__session.get(f"{self.__base_url}/outputs/manifest")
+            if res.status_code == 204:
+                sleep(30)
+                continue
+            raise_for_status(
+                res, "Cannot retrieve output manifests, build likely failed"
+            )
+            return TypeAdapter(List[OutputManifest]).validate_json(res.content)
+
+
+    def download_output(self, url: str, manifest: OutputManifest, destination: Path, max_workers: int = 8) -> None:
+        """Download an output file in parallel chunks, verifying each chunk against its manifest
+
+        Each chunk is fetched with an HTTP range request and checked against
+        its Merkle leaf before being written, so a partial download only ever
+        contains verified data. The manifest must have been verified with
+        `verify_attestation` beforehand.
+
+        Args:
+            url (str): download url of the output file (e.g. storage link with SAS token)
+            manifest (OutputManifest): verified manifest of the output file
+            destination (Path): where to write the file
+            max_workers (int, default = 8): number of concurrent chunk downloads
+        """
+        def fetch_chunk(index: int, fd: int) -> None:
+            start = index * manifest.chunk_size
+            end = min(start + manifest.chunk_size, manifest.size) - 1
+            res = requests.get(url, headers={"Range": f"bytes={start}-{end}"})
+            raise_for_status(res, f"Cannot download chunk {index} of {manifest.path}")
+            check_output_chunk(manifest, index, res.content)
+            os.pwrite(fd, res.content, start)
+
+        fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, manifest.size)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(lambda index: fetch_chunk(index, fd), range(len(manifest.leaves))))
+        finally:
+            os.close(fd)
+
+
+    def __verify_quote(self, build_response: dict, verbose: bool = False, nonce: Optional[bytes] = None) -> Optional[dict]:
+        """Private method: verify the certificate chain, the quote and the boot PCRs of an attestation
+
+        Returns:
+            the attestation document with the quoted PCRs, or None for an accepted simulation mode attestation
+        """
         if "simulation_mode" in build_response["remote_attestation"]:
             if self.__simulation_mode:
                 warnings.warn(f"👀 Attestation generated in simulation mode", RuntimeWarning)
-                return
+                return None
             else:
                 raise AICertInvalidAttestationException(f"❌ Attestation generated in simulation mode")
 
@@ -356,8 +499,11 @@ class Client:
             k: decode_b64_encoding(v)
             for k, v in build_response["remote_attestation"]["quote"].items()
         }
+        qualifying_data = nonce
+        if nonce is not None and "nonce_proof" in build_response:
+            qualifying_data = nonce_batch_root(nonce, build_response["nonce_proof"])
         att_document = check_quote(
-            build_response["remote_attestation"]["quote"], ak_pub_key_pem
+            build_response["remote_attestation"]["quote"], ak_pub_key_pem, qualifying_data
         )
 
         if verbose:
@@ -372,6 +518,40 @@ class Client:
         if verbose:
             typer.secho(f"✅ Checking reported PCRs are as expected", fg=typer.colors.GREEN)
 
+        return att_document
+
+
+    def verify_attestation(self, build_response: bytes, pcr_index = PCR_FOR_MEASUREMENT, verbose: bool = False, server_certs = "", output_manifests: Optional[List[OutputManifest]] = None, nonce: Optional[bytes] = None, content_dir: Optional[Path] = None):
+        """Verify received attesation validity
+
+        1. Parse the JSON reponse
+        2. Check simulation mode
+        3. Verify certificate chain
+        4. Verify quote signature
+        5. Verify boot PCRs (firmware, bootloader, initramfs, OS)
+        6. Verify event log (final hash in PCR_FOR_MEASUREMENT) by replaying it (works like a chain of hashes)
+        OR
+        6. Verify TLS certificate (final hash in PCR_FOR_CERTIFICATE)
+        
+        Args:
+            build_response (bytes): reponse of the attestation endpoint, in JSON, CBOR or MessagePack
+            verbose (bool, default = False): whether to print verification information in stdout
+            output_manifests (List[OutputManifest], optional): Merkle manifests of the outputs,
+                checked against the roots measured in the outputs event
+            nonce (bytes, optional): nonce sent with the attestation request. The quote
+                must contain it, or the Merkle root of a batch of nonces it is included in
+            content_dir (Path, optional): local copy of the content store (see `fetch_content`),
+                the specs displayed in verbose mode are fetched lazily
+        """
+        try:
+            build_response = decode_attestation(build_response)
+        except Exception as e:
+            raise AICertInvalidAttestationFormatException(e)
+        
+        att_document = self.__verify_quote(build_response, verbose, nonce)
+        if att_document is None:
+            return
+
         if pcr_index == PCR_FOR_MEASUREMENT:
             event_log = check_event_log(
                 build_response["event_log"],
@@ -380,26 +560,34 @@ class Client:
             check_container_ids(event_log)
             output_event_log = check_event_log(
                 build_response["output_event_log"],
-                att_document["pcrs"]["sha256"][PCR_FOR_OUTPUT_MEASUREMENT]
+                att_document["pcrs"]["sha256"][PCR_FOR_OUTPUT_MEASUREMENT],
+                output_manifests=output_manifests,
             )
             if verbose:
                 typer.secho(f"✅ Valid event log", fg=typer.colors.GREEN)
                 print(yaml.safe_dump(event_log))
                 typer.secho(f"✨✨✨ ALL CHECKS PASSED", fg=typer.colors.GREEN)
-                for eventlog in build_response["event_log"]:
-                    eventlog=json.loads(eventlog)
+                for eventlog in event_log:
                     if eventlog["event_type"]=="axolotl_configuration":
                         typer.secho(f'Axolotl config Hash: {eventlog["content"]["resolved"]["hash"]} \n ✅ Verified', fg=typer.colors.GREEN)
                     elif eventlog["event_type"]=="input_image" and eventlog["content"]["spec"]["image_name"]=="@local/axolotl:latest":
                         typer.secho(f'Axolotl image: {eventlog["content"]["spec"]["image_name"]} \n Hash: {eventlog["content"]["resolved"]["id"]} \n ✅ Verified', fg=typer.colors.GREEN)
-                    elif eventlog["event_type"]=="input_resource" and eventlog["content"]["spec"]["resource_proto"]["resource_type"]=="dataset":
-                        typer.secho(f'Dataset: {eventlog["content"]["spec"]["resource_proto"]["repo"]} \n Hash: {eventlog["content"]["resolved"]["hash"]} \n ✅ Verified', fg=typer.colors.GREEN)
-                    elif eventlog["event_type"]=="input_resource" and eventlog["content"]["spec"]["resource_proto"]["resource_type"]=="model":
-                        typer.secho(f'Dataset: {eventlog["content"]["spec"]["resource_proto"]["repo"]} \n Hash: {eventlog["content"]["resolved"]["hash"]} \n ✅ Verified', fg=typer.colors.GREEN)
+                    elif eventlog["event_type"]=="input_resource":
+                        # Resource specs are served by the content store, only their digest is in the event
+                        spec = event_spec(eventlog, lambda digest: self.fetch_content(digest, content_dir))
+                        if spec is None:
+                            typer.secho(f'Resource specs not available \n Hash: {eventlog["content"]["resolved"]["hash"]} \n ✅ Verified', fg=typer.colors.GREEN)
+                        elif spec["resource_proto"]["resource_type"]=="dataset":
+                            typer.secho(f'Dataset: {spec["resource_proto"]["repo"]} \n Hash: {eventlog["content"]["resolved"]["hash"]} \n ✅ Verified', fg=typer.colors.GREEN)
+                        elif spec["resource_proto"]["resource_type"]=="model":
+                            typer.secho(f'Model: {spec["resource_proto"]["repo"]} \n Hash: {eventlog["content"]["resolved"]["hash"]} \n ✅ Verified', fg=typer.colors.GREEN)
                     elif eventlog["event_type"]=="timing":
                         typer.secho(f'Time to train: {eventlog["content"]["spec"]["finetune_time"]} \n ✅ Verified', fg=typer.colors.GREEN)
                     elif eventlog["event_type"]=="compute_consumed":
                         typer.secho(f'Total floating point operations: {eventlog["content"]["spec"]["total_flos"]} \n ✅ Verified', fg=typer.colors.GREEN)
+                    elif eventlog["event_type"]=="training_metrics":
+                        summary = eventlog["content"]["spec"]
+                        typer.secho(f'Training steps: {summary["step"]}/{summary["total_steps"]}, final loss: {summary["loss"]}, samples per second per GPU: {summary["samples_per_second_per_device"]} \n ✅ Verified', fg=typer.colors.GREEN)
 
         elif pcr_index == PCR_FOR_CERTIFICATE:
             result = check_server_cert(
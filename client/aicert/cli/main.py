@@ -1,14 +1,21 @@
 import os
 from pathlib import Path
 import typer
-from typing import Annotated, Optional
+from typing import Annotated, List, Optional
+from pydantic import TypeAdapter
 
 from .client import Client
 from aicert_common.logging import log
-from aicert_common.errors import log_errors_and_warnings
+from aicert_common.errors import AICertException, log_errors_and_warnings
+from aicert_common.encoding import FILE_EXTENSIONS, MEDIA_TYPES, detect_media_type
+from aicert_common.protocol import OutputManifest
 
 SIMULATION_MODE = os.getenv("AICERT_SIMULATION_MODE") is not None
 
+OutputManifestListAdapter = TypeAdapter(List[OutputManifest])
+# Local copy of the specs referenced by digest in the event log, for offline verification
+CONTENT_DIR = "event_contents"
+
 app = typer.Typer(rich_markup_mode="rich")
 
 
@@ -40,11 +47,15 @@ def finetune(
             attestation = client.wait_for_attestation()
             log.info(f"Received attestation")
 
-            with (dir / "attestation.json").open("wb") as f:
+            with (dir / f"attestation.{FILE_EXTENSIONS[detect_media_type(attestation)]}").open("wb") as f:
                 f.write(attestation)
+
+            output_manifests = client.get_output_manifests()
+            with (dir / "output_manifest.json").open("wb") as f:
+                f.write(OutputManifestListAdapter.dump_json(output_manifests))
         
             # Verify attestation report
-            client.verify_attestation(attestation, verbose=True)
+            client.verify_attestation(attestation, verbose=True, output_manifests=output_manifests, content_dir=dir / CONTENT_DIR)
         
         print(f'Outputs Link: {url["model link"]}')
 
@@ -64,8 +75,20 @@ def verify(
         simulation_mode=SIMULATION_MODE,
     )
 
-    with (dir / "attestation.json").open("rb") as f:
+    # The attestation may have been saved in any of the supported encodings
+    attestation_files = [
+        dir / f"attestation.{FILE_EXTENSIONS[media_type]}" for media_type in MEDIA_TYPES
+    ]
+    attestation_file = next((path for path in attestation_files if path.exists()), None)
+    if attestation_file is None:
+        raise AICertException(f"No attestation found in {dir}")
+    with attestation_file.open("rb") as f:
             attestation = f.read()
 
-    client.verify_attestation(attestation, verbose=True)
+    output_manifests = None
+    if (dir / "output_manifest.json").exists():
+        with (dir / "output_manifest.json").open("rb") as f:
+            output_manifests = OutputManifestListAdapter.validate_json(f.read())
+
+    client.verify_attestation(attestation, verbose=True, output_manifests=output_manifests, content_dir=dir / CONTENT_DIR)
 
@@ -7,7 +7,10 @@ import OpenSSL
 from OpenSSL import crypto
 import yaml
 import pkgutil
+from typing import Callable, List, Optional
 from aicert_common.logging import log
+from aicert_common.merkle import chunk_count, leaf_hash, merkle_root, root_from_proof
+from aicert_common.protocol import OutputManifest
 
 
 from cryptography.hazmat.primitives import serialization
@@ -73,12 +76,37 @@ def verify_ak_cert(cert_chain: list[bytes]) -> bytes:
     return cert_chain[0]
 
 
-def check_quote(quote, pub_key_pem):
+def nonce_batch_root(nonce: bytes, nonce_proof: dict) -> bytes:
+    """Recompute the Merkle root of a batch of nonces from one nonce and its inclusion proof
+
+    The server quotes the root of all the nonces received within a short window,
+    the quote is fresh for each of them.
+    Parameters:
+         nonce: the nonce sent with the attestation request
+         nonce_proof: dictionary with keys 'index', 'count' and 'path' (base64 encoded sibling hashes)
+    Returns:
+         the root, to be checked as the quote's qualifying data
+    Raises:
+         AttestationError: if the proof is malformed
+    """
+    try:
+        return root_from_proof(
+            leaf_hash(nonce),
+            int(nonce_proof["index"]),
+            int(nonce_proof["count"]),
+            [decode_b64_encoding(sibling) for sibling in nonce_proof["path"]],
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise AttestationError(f"Invalid nonce inclusion proof: {e}")
+
+
+def check_quote(quote, pub_key_pem, nonce=None):
     """
     Check quote using tpm2_checkquote command.
     Parameters:
          quote: dictionary with keys 'message', 'signature', and 'pcr'
          pub_key_pem: public key in PEM format (string)
+         nonce: qualifying data the quote must contain (bytes), if any
     Returns:
     Raises:
 
@@ -108,6 +136,7 @@ def check_quote(quote, pub_key_pem):
                 quote_pcr_file.name,
                 "--signature",
                 quote_sig_file.name,
+                *(["--qualification", nonce.hex()] if nonce else []),
             ],
             check=True,
             capture_output=True,
@@ -141,10 +170,17 @@ def check_server_cert(
     return True
 
 
+def replay_event(current_pcr: bytes, event: str) -> bytes:
+    """Returns the value of a PCR after the server extended it with an event"""
+    hash_event = hashlib.sha256(event.encode()).digest()
+    return hashlib.sha256(current_pcr + hash_event).digest()
+
+
 def check_event_log(
     input_event_log,
     pcr_end,
     initial_pcr="0000000000000000000000000000000000000000000000000000000000000000",
+    output_manifests: Optional[List[OutputManifest]] = None,
 ):
     # Starting from the expected initial PCR state
     # We replay the event extending the PCR
@@ -152,8 +188,7 @@ def check_event_log(
     initial_pcr = bytes.fromhex(initial_pcr)
     current_pcr = initial_pcr
     for e in input_event_log:
-        hash_event = hashlib.sha256(e.encode()).digest()
-        current_pcr = hashlib.sha256(current_pcr + hash_event).digest()
+        current_pcr = replay_event(current_pcr, e)
 
     # Both PCR MUST match, else something sketchy is going on!
     if not pcr_end == current_pcr.hex():
@@ -162,9 +197,149 @@ def check_event_log(
     # Now we can return the parsed event log
     event_log = [json.loads(e) for e in input_event_log]
 
+    if output_manifests is not None:
+        check_output_manifests(event_log, output_manifests)
+
     return event_log
 
 
+def check_content(digest: str, data: bytes):
+    """
+    Parse a spec served by the content store, checking it against the digest measured in the event log.
+    Raises:
+         AttestationError: if the content does not match the digest
+    """
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise AttestationError(f"Content does not match its measured digest {digest}")
+    return json.loads(data)
+
+
+def event_spec(event: dict, fetch_content: Callable[[str], Optional[dict]]) -> Optional[dict]:
+    """
+    Return the spec of a (verified) event.
+    Parameters:
+         event: parsed event
+         fetch_content: returns the spec with the given content digest, or None if it is not available
+    Returns:
+         the spec, fetched if the event only contains its "content_digest" (None if it is not available)
+    """
+    spec = event["content"].get("spec", {})
+    if "content_digest" not in spec:
+        return spec
+    return fetch_content(spec["content_digest"])
+
+
+class IncrementalEventLogVerifier:
+    """Replay the event log as it is streamed by the server, in constant memory
+
+    Only the running value of each measurement PCR is kept. Each streamed event
+    must come in order and match the running PCR value announced by the server;
+    once the stream is over, the running values are checked against the quote
+    with `check_quote_pcrs`. Until then, events are only as trustworthy as the server.
+
+    Parameters:
+         initial_pcr: value of the measurement PCRs at boot (hex)
+         output_manifests: Merkle manifests of the outputs, checked against the outputs events
+    """
+
+    def __init__(
+        self,
+        initial_pcr="0000000000000000000000000000000000000000000000000000000000000000",
+        output_manifests: Optional[List[OutputManifest]] = None,
+    ):
+        self.pcrs = {
+            PCR_FOR_MEASUREMENT: bytes.fromhex(initial_pcr),
+            PCR_FOR_OUTPUT_MEASUREMENT: bytes.fromhex(initial_pcr),
+        }
+        self.count = 0
+        self.__output_manifests = output_manifests
+
+    def update(self, measured_event: dict) -> dict:
+        """
+        Replay one streamed event.
+        Parameters:
+             measured_event: dictionary with keys 'index', 'pcr_index', 'event' (JSON) and 'pcr' (hex)
+        Returns:
+             the parsed event
+        Raises:
+             AttestationError: if the event is out of order or does not match its announced PCR value
+        """
+        if measured_event["index"] != self.count:
+            raise AttestationError(f"Expected event {self.count}, got event {measured_event['index']}")
+        pcr_index = measured_event["pcr_index"]
+        if pcr_index not in self.pcrs:
+            raise AttestationError(f"Event {self.count} extends unexpected PCR[{pcr_index}]")
+        self.pcrs[pcr_index] = replay_event(self.pcrs[pcr_index], measured_event["event"])
+        if self.pcrs[pcr_index].hex() != measured_event["pcr"]:
+            raise AttestationError(f"Event {self.count} does not match its PCR[{pcr_index}] value")
+        self.count += 1
+
+        event = json.loads(measured_event["event"])
+        if pcr_index == PCR_FOR_MEASUREMENT:
+            check_container_ids([event])
+        elif self.__output_manifests is not None:
+            check_output_manifests([event], self.__output_manifests)
+        return event
+
+    def check_quote_pcrs(self, att_document) -> None:
+        """
+        Check the replayed values against the PCRs of a verified quote, once all the events were received.
+        Raises:
+             AttestationError: if a replayed value differs from the quoted one
+        """
+        for pcr_index, value in self.pcrs.items():
+            if att_document["pcrs"]["sha256"][pcr_index] != value.hex():
+                raise AttestationError(f"Streamed event log does not match PCR[{pcr_index}] in attestation report")
+
+
+def check_output_manifests(event_log, output_manifests: List[OutputManifest]) -> None:
+    """
+    Check the Merkle manifests of the outputs against the roots of the (verified) outputs event.
+    Parameters:
+        event_log: parsed and verified output event log
+        output_manifests: manifests returned by the outputs manifest endpoint
+    Raises:
+        AttestationError: if a manifest is missing or does not match its measured root
+    """
+    manifests = {manifest.path: manifest for manifest in output_manifests}
+    for e in event_log:
+        if e["event_type"] != "outputs":
+            continue
+        for output in e["content"]:
+            merkle = output["resolved"].get("merkle")
+            if merkle is None:
+                continue
+            path = output["spec"]["path"]
+            if path not in manifests:
+                raise AttestationError(f"Missing Merkle manifest for output [{path}]")
+            manifest = manifests[path]
+            if (
+                manifest.root != merkle["root"]
+                or manifest.chunk_size != merkle["chunk_size"]
+                or manifest.size != merkle["size"]
+                or len(manifest.leaves) != chunk_count(manifest.size, manifest.chunk_size)
+                or merkle_root([bytes.fromhex(leaf) for leaf in manifest.leaves]).hex() != merkle["root"]
+            ):
+                raise AttestationError(f"Merkle manifest of output [{path}] does not match the event log")
+
+
+def check_output_chunk(manifest: OutputManifest, index: int, chunk: bytes) -> None:
+    """
+    Check a single chunk of an output file against its (verified) Merkle manifest.
+    Parameters:
+        manifest: manifest of the output file
+        index: index of the chunk in the file
+        chunk: chunk data
+    Raises:
+        AttestationError: if the chunk does not match the manifest
+    """
+    if index < 0 or index >= len(manifest.leaves):
+        raise AttestationError(f"Chunk {index} of output [{manifest.path}] is out of range of its manifest")
+    expected_size = min(manifest.chunk_size, manifest.size - index * manifest.chunk_size)
+    if len(chunk) != expected_size or leaf_hash(chunk).hex() != manifest.leaves[index]:
+        raise AttestationError(f"Chunk {index} of output [{manifest.path}] does not match its manifest")
+
+
 def check_container_ids(event_log):
     from .security_config import CONTAINER_MEASUREMENTS
 
@@ -201,6 +376,9 @@ def check_os_pcrs(attestation_doc, simulation_mode):
 
 
 def decode_b64_encoding(x):
+    # CBOR and MessagePack attestations carry raw bytes, JSON ones base64 objects
+    if isinstance(x, bytes):
+        return x
     return base64.b64decode(x["base64"])
 
 
@@ -0,0 +1,133 @@
+"""Encodings of attestation documents
+
+An attestation is a dictionary of strings, integers, lists and raw bytes
+(quote and certificates). It can be sent in three encodings, with the same
+layout in all of them:
+
+- JSON (the default), where bytes are replaced by {"base64": "..."} objects
+- CBOR (RFC 8949, canonical form), where bytes are native byte strings
+- MessagePack, where bytes are native bin values
+
+Decoders can tell the encodings apart from their first byte, as an
+attestation is always a map: "{" in JSON, 0xa0-0xbf in CBOR and
+0x80-0x8f, 0xde or 0xdf in MessagePack.
+"""
+
+import base64
+import json
+from typing import Any, Dict, Optional
+
+import cbor2
+import msgpack
+
+JSON_MEDIA_TYPE = "application/json"
+CBOR_MEDIA_TYPE = "application/cbor"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+_MEDIA_TYPE_ALIASES = {
+    "application/x-msgpack": MSGPACK_MEDIA_TYPE,
+    "application/vnd.msgpack": MSGPACK_MEDIA_TYPE,
+}
+MEDIA_TYPES = (JSON_MEDIA_TYPE, CBOR_MEDIA_TYPE, MSGPACK_MEDIA_TYPE)
+
+# File extension used when saving an attestation in each encoding
+FILE_EXTENSIONS = {JSON_MEDIA_TYPE: "json", CBOR_MEDIA_TYPE: "cbor", MSGPACK_MEDIA_TYPE: "msgpack"}
+
+
+def _to_json(value: Any) -> Any:
+    """Replace the bytes of a document by base64 objects"""
+    if isinstance(value, (bytes, bytearray)):
+        return {"base64": base64.b64encode(value).decode("utf-8")}
+    if isinstance(value, dict):
+        return {key: _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    return value
+
+
+def negotiate_media_type(accept: Optional[str]) -> Optional[str]:
+    """Returns the preferred attestation media type of an Accept header
+
+    Args:
+        accept (Optional[str]): value of the Accept header
+
+    Returns:
+        Optional[str]: one of MEDIA_TYPES, or None if none of them is acceptable
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+    candidates = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        media_type = _MEDIA_TYPE_ALIASES.get(media_type.lower(), media_type.lower())
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality <= 0:
+            continue
+        if media_type in ("*/*", "application/*"):
+            media_type = JSON_MEDIA_TYPE
+        if media_type in MEDIA_TYPES:
+            candidates.append((-quality, position, media_type))
+    return min(candidates)[2] if candidates else None
+
+
+def encode_attestation(attestation: Dict[str, Any], media_type: str = JSON_MEDIA_TYPE) -> bytes:
+    """Encode an attestation document
+
+    Args:
+        attestation (Dict[str, Any]): the document, bytes values are kept raw
+        media_type (str): one of MEDIA_TYPES
+
+    Returns:
+        bytes: the encoded document
+    """
+    if media_type == CBOR_MEDIA_TYPE:
+        return cbor2.dumps(attestation, canonical=True)
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(attestation, use_bin_type=True)
+    if media_type == JSON_MEDIA_TYPE:
+        return json.dumps(_to_json(attestation)).encode("utf-8")
+    raise ValueError(f"Unsupported attestation media type: {media_type}")
+
+
+def detect_media_type(payload: bytes) -> str:
+    """Returns the encoding of an attestation document, from its first byte"""
+    stripped = payload.lstrip()
+    if not stripped:
+        raise ValueError("Empty attestation document")
+    first = stripped[0]
+    if first == ord("{"):
+        return JSON_MEDIA_TYPE
+    if 0xA0 <= first <= 0xBF:
+        return CBOR_MEDIA_TYPE
+    if 0x80 <= first <= 0x8F or first in (0xDE, 0xDF):
+        return MSGPACK_MEDIA_TYPE
+    raise ValueError("Unknown attestation document encoding")
+
+
+def decode_attestation(payload: bytes, media_type: Optional[str] = None) -> Dict[str, Any]:
+    """Decode an attestation document
+
+    Bytes values are raw bytes with CBOR and MessagePack, and
+    {"base64": "..."} objects with JSON.
+
+    Args:
+        payload (bytes): the encoded document
+        media_type (Optional[str]): its encoding, detected if not given
+    """
+    if media_type is None:
+        media_type = detect_media_type(payload)
+    media_type = _MEDIA_TYPE_ALIASES.get(media_type, media_type)
+    if media_type == CBOR_MEDIA_TYPE:
+        return cbor2.loads(payload)
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+    if media_type == JSON_MEDIA_TYPE:
+        return json.loads(payload)
+    raise ValueError(f"Unsupported attestation media type: {media_type}")
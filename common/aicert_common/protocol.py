@@ -172,6 +172,48 @@ class FileList(BaseModel):
     file_list: List[str]
 
 
+class OutputCompression(BaseModel):
+    """Output archive compression
+
+    Optional `aicert_output_compression` section of the axolotl
+    configuration. It is removed from the configuration before
+    it is passed to axolotl.
+
+    Attributes:
+        codec (Literal["store", "deflate", "zstd"]): compression codec
+        level (Optional[int]): compression level (codec default if not set)
+        threads (int): number of members compressed concurrently
+            (one per CPU if 0)
+        min_ratio (float): members whose sampled compression ratio is
+            below this value are stored without compression
+    """
+    codec: Literal["store", "deflate", "zstd"] = "deflate"
+    level: Optional[int] = None
+    threads: int = Field(default=0, ge=0)
+    min_ratio: float = 1.05
+
+
+class OutputManifest(BaseModel):
+    """Merkle manifest of an output file
+
+    Returned by the outputs manifest endpoint. The root is recorded
+    in the outputs event, the leaves (one per chunk) let a client
+    verify any chunk of the file independently.
+
+    Attributes:
+        path (str): output file path, as recorded in the outputs event
+        size (int): file size in bytes
+        chunk_size (int): size of each chunk (the last one may be shorter)
+        root (str): hex encoded Merkle root
+        leaves (List[str]): hex encoded leaf hashes
+    """
+    path: str
+    size: int
+    chunk_size: int
+    root: str
+    leaves: List[str]
+
+
 class AxolotlConfigString(BaseModel):
     """A string representation of an axolotl configuration
     """
@@ -0,0 +1,321 @@
+import hashlib
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from aicert_common.merkle import ChunkHasher
+from aicert_common.protocol import OutputCompression, OutputManifest
+from aicert_server.hashing import CHUNK_SIZE, output_manifest
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression method 93 of the zip specification (APPNOTE 4.4.5)
+ZIP_ZSTANDARD = 93
+ZSTANDARD_VERSION = 63
+
+# Incompressibility probe: a few windows of each member are compressed with
+# a fast setting and the member is stored if they do not shrink enough
+SAMPLE_SIZE = 256 * 1024
+SAMPLE_COUNT = 3
+
+# Compressed members are staged in memory up to this size before spilling to disk
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+_DATA_DESCRIPTOR_SIGNATURE = 0x08074B50
+_MASK_USE_DATA_DESCRIPTOR = 0x08
+
+
+class _HashingWriter:
+    """Write-only file wrapper that hashes every byte written to the underlying file
+
+    The wrapper is deliberately not seekable: `zipfile` then streams members
+    with data descriptors instead of seeking back to patch local headers,
+    which guarantees the bytes are hashed in their final order.
+    The Merkle leaves of the written bytes are computed along the way.
+    """
+
+    def __init__(self, file: BinaryIO) -> None:
+        self.__file = file
+        self.__position = 0
+        self.sha256 = hashlib.sha256()
+        self.chunks = ChunkHasher()
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        self.chunks.update(data)
+        self.__position += len(data)
+        return self.__file.write(data)
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, *args) -> int:
+        raise io.UnsupportedOperation("seek")
+
+    def flush(self) -> None:
+        self.__file.flush()
+
+
+class _Passthrough:
+    """Compressor interface for stored members"""
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _CompressedMember(NamedTuple):
+    """Member compressed ahead of time by a worker thread"""
+    data: BinaryIO
+    crc: int
+    file_size: int
+    compress_size: int
+    sha256: str
+
+
+def _is_compressible(file_path: Union[str, Path], file_size: int, min_ratio: float) -> bool:
+    """Estimate whether a file is worth compressing by sampling it
+
+    Samples are taken at the start, middle and end of the file, so that
+    a small textual header (e.g. safetensors metadata) does not hide
+    incompressible weights.
+    """
+    if file_size == 0:
+        return False
+    offsets = sorted({
+        max(0, min(file_size - SAMPLE_SIZE, i * file_size // SAMPLE_COUNT))
+        for i in range(SAMPLE_COUNT)
+    })
+    sampled = compressed = 0
+    with open(file_path, "rb") as file:
+        for offset in offsets:
+            file.seek(offset)
+            sample = file.read(SAMPLE_SIZE)
+            sampled += len(sample)
+            compressed += len(zlib.compress(sample, 1))
+    return sampled >= compressed * min_ratio
+
+
+class HashingArchiveWriter:
+    """Zip archive writer that measures the archive while it is written
+
+    Each member is read once: the same chunks feed the member's SHA256 hash
+    and the compressor, and the compressed bytes feed the archive's SHA256
+    hash on their way to disk. Once the archive is closed, the hashes are
+    available without reading anything back, along with the archive's
+    Merkle manifest.
+
+    Members are written by this class (local header, data and data descriptor);
+    `zipfile` only produces the central directory, which lets members be
+    compressed with zstd or compressed by several threads at once.
+
+    Args:
+        path (Union[str, Path]): location of the archive to create
+        compression (OutputCompression): codec settings (see aicert-common's protocol)
+
+    Example usage:
+        ```py
+        with HashingArchiveWriter(workspace / "outputs.zip") as archive:
+            archive.write(workspace / "lora-out/adapter_model.bin", "lora-out/adapter_model.bin")
+        archive.sha256      # hash of outputs.zip
+        archive.manifest    # Merkle manifest of outputs.zip
+        archive.members     # [("lora-out/adapter_model.bin", "<hash>")]
+        ```
+    """
+
+    def __init__(self, path: Union[str, Path], compression: OutputCompression = OutputCompression()) -> None:
+        if compression.codec == "zstd" and zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        self.path = Path(path)
+        self.compression = compression
+        self.members: List[Tuple[str, str]] = []
+        self.sha256: Optional[str] = None
+        self.manifest: Optional[OutputManifest] = None
+        self.__file = open(self.path, "wb")
+        self.__writer = _HashingWriter(self.__file)
+        self.__zipfile = zipfile.ZipFile(self.__writer, "w")
+
+    def __compress_type(self, file_path: Union[str, Path], file_size: int) -> int:
+        """Private method: zip compression method to use for a member"""
+        if self.compression.codec == "store":
+            return zipfile.ZIP_STORED
+        if not _is_compressible(file_path, file_size, self.compression.min_ratio):
+            return zipfile.ZIP_STORED
+        return ZIP_ZSTANDARD if self.compression.codec == "zstd" else zipfile.ZIP_DEFLATED
+
+    def __compressor(self, compress_type: int):
+        """Private method: new compressor object for the given method"""
+        if compress_type == zipfile.ZIP_DEFLATED:
+            level = self.compression.level if self.compression.level is not None else zlib.Z_DEFAULT_COMPRESSION
+            return zlib.compressobj(level, zlib.DEFLATED, -15)
+        if compress_type == ZIP_ZSTANDARD:
+            level = self.compression.level if self.compression.level is not None else 3
+            return zstandard.ZstdCompressor(level=level).compressobj()
+        return _Passthrough()
+
+    def __compress_member(self, file_path: Union[str, Path], compress_type: int) -> _CompressedMember:
+        """Private method: read, hash and compress a member into a spooled temporary file
+
+        Runs in worker threads; zlib and zstandard release the GIL while compressing.
+        """
+        staged = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=self.path.parent)
+        compressor = self.__compressor(compress_type)
+        member_hash = hashlib.sha256()
+        crc = file_size = compress_size = 0
+        with open(file_path, "rb", buffering=0) as src:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                member_hash.update(chunk)
+                crc = zlib.crc32(chunk, crc)
+                file_size += len(chunk)
+                data = compressor.compress(chunk)
+                compress_size += len(data)
+                staged.write(data)
+        data = compressor.flush()
+        compress_size += len(data)
+        staged.write(data)
+        staged.seek(0)
+        return _CompressedMember(staged, crc, file_size, compress_size, member_hash.hexdigest())
+
+    def __write_header(self, zinfo: zipfile.ZipInfo) -> bool:
+        """Private method: write a member's local header, returns whether zip64 is used"""
+        zinfo.flag_bits = _MASK_USE_DATA_DESCRIPTOR
+        zinfo.CRC = zinfo.compress_size = 0
+        if not zinfo.external_attr:
+            zinfo.external_attr = 0o600 << 16
+        zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        zinfo.header_offset = self.__writer.tell()
+        self.__writer.write(zinfo.FileHeader(zip64))
+        return zip64
+
+    def __write_descriptor(self, zinfo: zipfile.ZipInfo, zip64: bool) -> None:
+        """Private method: write a member's data descriptor and register it in the central directory"""
+        fmt = "<LLQQ" if zip64 else "<LLLL"
+        self.__writer.write(struct.pack(
+            fmt, _DATA_DESCRIPTOR_SIGNATURE, zinfo.CRC, zinfo.compress_size, zinfo.file_size
+        ))
+        self.__zipfile.start_dir = self.__writer.tell()
+        self.__zipfile.filelist.append(zinfo)
+        self.__zipfile.NameToInfo[zinfo.filename] = zinfo
+
+    def __stream_member(self, file_path: Union[str, Path], zinfo: zipfile.ZipInfo) -> str:
+        """Private method: read, hash, compress and write a member in a single pass"""
+        zip64 = self.__write_header(zinfo)
+        compressor = self.__compressor(zinfo.compress_type)
+        member_hash = hashlib.sha256()
+        crc = file_size = compress_size = 0
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        with open(file_path, "rb", buffering=0) as src:
+            while True:
+                size = src.readinto(buffer)
+                if not size:
+                    break
+                chunk = view[:size]
+                member_hash.update(chunk)
+                crc = zlib.crc32(chunk, crc)
+                file_size += size
+                data = compressor.compress(chunk)
+                compress_size += len(data)
+                self.__writer.write(data)
+        data = compressor.flush()
+        compress_size += len(data)
+        self.__writer.write(data)
+        zinfo.CRC, zinfo.file_size, zinfo.compress_size = crc, file_size, compress_size
+        self.__write_descriptor(zinfo, zip64)
+        return member_hash.hexdigest()
+
+    def __write_compressed(self, member: _CompressedMember, zinfo: zipfile.ZipInfo) -> str:
+        """Private method: write a member compressed by a worker thread"""
+        zip64 = self.__write_header(zinfo)
+        with member.data:
+            shutil.copyfileobj(member.data, self.__writer, CHUNK_SIZE)
+        zinfo.CRC, zinfo.file_size, zinfo.compress_size = member.crc, member.file_size, member.compress_size
+        self.__write_descriptor(zinfo, zip64)
+        return member.sha256
+
+    def __zinfo(self, file_path: Union[str, Path], arcname: str) -> zipfile.ZipInfo:
+        """Private method: prepare the zip entry of a member"""
+        zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+        zinfo.compress_type = self.__compress_type(file_path, zinfo.file_size)
+        if zinfo.compress_type == ZIP_ZSTANDARD:
+            zinfo.extract_version = max(zinfo.extract_version, ZSTANDARD_VERSION)
+        return zinfo
+
+    def write(self, file_path: Union[str, Path], arcname: str) -> str:
+        """Add a file to the archive and return its SHA256 hash
+
+        Args:
+            file_path (Union[str, Path]): file to add
+            arcname (str): name of the file in the archive
+        """
+        digest = self.__stream_member(file_path, self.__zinfo(file_path, arcname))
+        self.members.append((arcname, digest))
+        return digest
+
+    def write_all(self, files: Sequence[Tuple[Union[str, Path], str]]) -> None:
+        """Add several files to the archive, compressing them concurrently
+
+        Members are compressed by `compression.threads` worker threads (one per CPU
+        if 0), at most that many ahead of the member being written, and written to
+        the archive in the given order as soon as they are ready.
+        Stored members are not staged: they are streamed by the calling thread.
+
+        Args:
+            files (Sequence[Tuple[Union[str, Path], str]]): files to add and their names
+                in the archive
+        """
+        zinfos = [self.__zinfo(file_path, arcname) for file_path, arcname in files]
+        threads = self.compression.threads or os.cpu_count() or 1
+        if threads == 1:
+            for (file_path, arcname), zinfo in zip(files, zinfos):
+                self.members.append((arcname, self.__stream_member(file_path, zinfo)))
+            return
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            # At most `threads` members are compressed or staged at a time, each
+            # staged member is released as soon as it is written
+            futures: Dict[int, Future] = {}
+            ahead = 0
+            for index, ((file_path, arcname), zinfo) in enumerate(zip(files, zinfos)):
+                while ahead < len(files) and len(futures) < threads:
+                    if zinfos[ahead].compress_type != zipfile.ZIP_STORED:
+                        futures[ahead] = executor.submit(
+                            self.__compress_member, files[ahead][0], zinfos[ahead].compress_type
+                        )
+                    ahead += 1
+                future = futures.pop(index, None)
+                digest = (
+                    self.__stream_member(file_path, zinfo)
+                    if future is None else
+                    self.__write_compressed(future.result(), zinfo)
+                )
+                self.members.append((arcname, digest))
+
+    def close(self) -> None:
+        """Write the central directory and finalize the archive hash"""
+        if self.sha256 is not None:
+            return
+        self.__zipfile.close()
+        self.__writer.flush()
+        self.__file.close()
+        self.sha256 = self.__writer.sha256.hexdigest()
+        self.__writer.chunks.finalize()
+        self.manifest = output_manifest(self.path.name, self.__writer.chunks)
+
+    def __enter__(self) -> "HashingArchiveWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -1,36 +1,47 @@
 from fastapi import HTTPException
-import hashlib
 import docker
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from threading import Lock, Thread
-from typing import Union, Dict, Any, Optional
+from threading import Event, Lock, Thread
+from typing import Union, Dict, Any, List, Optional
+import json
 import logging
+import time
 import yaml
-import zipfile
 
-from aicert_common.protocol import Resource
+from aicert_common.protocol import Resource, OutputManifest
 from aicert_server.cmd_line import CmdLine
-from aicert_server.event_log import EventLog
+from aicert_server.event_log import EventLog, MeasuredEvent
+from aicert_server.journal import event_journal
 from aicert_server.config_parser import AxolotlConfig
 from aicert_server.log_streamer import LogStreamer
+from aicert_server.hashing import hashing_engine, output_manifest
+from aicert_server.archive import HashingArchiveWriter
+from aicert_server.resource_cache import resource_cache
+from aicert_server.git_fetch import fetch_cmd, verify_checkout_cmd
+from aicert_server.phase_timer import phase_timer, disk_usage, MEASURE_PHASE_TIMINGS
+from aicert_server.metrics import DOCKER_RUN_DURATION
+from aicert_server.training_metrics import training_metrics, throughput_factors
 
 docker_client = docker.from_env()
 BASE_IMAGE = "@local/aicert-base:latest"
 AXOLOTL_IMAGE = "@local/axolotl:latest"
 SIMULATION_MODE = os.getenv("AICERT_SIMULATION_MODE") is not None
+MAX_CONCURRENT_FETCHES = int(os.getenv("AICERT_MAX_CONCURRENT_FETCHES", "4"))
 
 # Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def sha256_file(file_path) -> str:
-    """Returns the SHA256 hash of a file"""
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as file:
-        for chunk in iter(lambda: file.read(4096), b""):
-            sha256_hash.update(chunk)
-    return sha256_hash.hexdigest()
+def get_image(image: str) -> docker.models.images.Image:
+    """Return a local image (`@local/` prefix) or pull it from its registry"""
+    return (
+        docker_client.images.get(image.split("/")[-1])
+        if image.startswith("@local/") else
+        docker_client.images.pull(image)
+    )
 
 
 class Builder:
@@ -42,13 +53,22 @@ class Builder:
     Class attributes:
         __docker_output_stream (str): Docker output container stream
 
-        __event_log_lock (Lock): Lock that controls shared access to the
-            `__event_log`, `__exception` and `__resolved_images` attributes
-        __event_log (EventLog): Event log that contains all measurements
+        __event_log_lock (Lock): Lock held by the build thread that controls shared
+            access to the `__exception` attribute and writes to the `__event_log`
+        __event_log (EventLog): Event log that contains all measurements,
+            readers get snapshots of it without taking `__event_log_lock`
         __exception (Optional[HTTPException]): May contain an exception
             originating from the build thrad if it failed
         __resolved_images (Dict[str, Any]): Maps image names with already
             downloaded and measured images
+        __resolved_images_lock (Lock): Lock that controls shared access to the
+            `__resolved_images`, `__prewarmed_images` and `__prewarm_thread` attributes
+            between concurrent resource fetches and the pre-warm thread
+        __prewarmed_images (Dict[str, Any]): Maps image names with images that
+            were downloaded ahead of the build but are not measured yet
+        __prewarm_thread (Optional[Thread]): Thread that pre-warms the images
+        __prewarm_done (Event): Set once all the images have been pre-warmed
+        __prewarm_error (Optional[str]): Error of the last pre-warm attempt, if any
 
         __finetune_thread_lock (Lock): Lock that controls shared access to the 
             `__finetune_thread_in_use`, `__finetune_framework` and `__finetune_thread` attributes
@@ -57,22 +77,31 @@ class Builder:
         __finetune_framework (Optional[str]): resolved image to use to launch the server
             (same as the one used for build)
         __finetune_thread (Optional[Thread]): Thread that runs the server
+        __recovered_build (bool): whether a build started before a server restart
+            was recovered from the event log journal
         
 
     """
     __docker_output_stream : str = ""
 
     __event_log_lock = Lock()
-    __event_log = EventLog(simulation_mode=SIMULATION_MODE)
+    __event_log = EventLog(simulation_mode=SIMULATION_MODE, journal=event_journal)
     __exception: Optional[HTTPException] = None
     __resolved_images: Dict[str, Any] = {}
+    __resolved_images_lock = Lock()
+    __prewarmed_images: Dict[str, Any] = {}
+    __prewarm_thread: Optional[Thread] = None
+    __prewarm_done = Event()
+    __prewarm_error: Optional[str] = None
 
     __fineture_thread_lock = Lock()
     __fineture_thread_in_use = False
     __finetune_thread: Optional[Thread] = None 
     __finetune_framework : str = "axolotl"
+    __recovered_build = False
 
     __output_filename: str = ""
+    __output_manifests: List[OutputManifest] = []
 
     
     @classmethod
@@ -82,11 +111,72 @@ class Builder:
         Args: 
             axolotl_config (AxolotlConfig): Axolotl configuration to measure
         """
-        with open(workspace / axolotl_config.filename, 'rb') as config:
-            configuration_content = yaml.safe_load(config)
-        cls.__event_log.configuration_event(configuration_file=configuration_content, configuration_file_hash=sha256_file(workspace / axolotl_config.filename))
+        with phase_timer.phase("config_measurement", axolotl_config.filename) as phase:
+            with open(workspace / axolotl_config.filename, 'rb') as config:
+                configuration_content = yaml.safe_load(config)
+            cls.__event_log.configuration_event(configuration_file=configuration_content, configuration_file_hash=hashing_engine.hash_file(workspace / axolotl_config.filename))
+            phase.bytes = disk_usage(workspace / axolotl_config.filename)
 
 
+    @classmethod
+    def __resolve_image(cls, image: str) -> docker.models.images.Image:
+        """Private method: download and measure an image the first time it is used
+
+        Args:
+            image (str): name of the image
+
+        Returns:
+            docker.models.images.Image
+        """
+        with cls.__resolved_images_lock:
+            if not image in cls.__resolved_images:
+                with phase_timer.phase("image_resolution", image):
+                    resolved_image = cls.__prewarmed_images.pop(image, None) or get_image(image)
+                    cls.__event_log.input_image_event(image, resolved_image.id)
+                cls.__resolved_images[image] = resolved_image
+            return cls.__resolved_images[image]
+
+    @classmethod
+    def __prewarm_fn(cls, images: List[str]) -> None:
+        """Private method: download and inspect images ahead of the build"""
+        try:
+            for image in images:
+                with cls.__resolved_images_lock:
+                    if image in cls.__resolved_images or image in cls.__prewarmed_images:
+                        continue
+                resolved_image = get_image(image)
+                with cls.__resolved_images_lock:
+                    if image not in cls.__resolved_images:
+                        cls.__prewarmed_images[image] = resolved_image
+                logger.info(f"Pre-warmed image {image} ({resolved_image.id})")
+            cls.__prewarm_error = None
+            cls.__prewarm_done.set()
+        except Exception as e:
+            logger.exception(f"Image pre-warm failed")
+            cls.__prewarm_error = str(e)
+
+    @classmethod
+    def start_prewarm(cls, images: List[str] = [BASE_IMAGE, AXOLOTL_IMAGE]) -> None:
+        """Download and inspect the images used by the build in a background thread
+
+        The images are not measured here: their input_image events are still added
+        when they are first used by the build, so the event log order does not depend
+        on the pre-warm. Does nothing if a pre-warm is running or has succeeded.
+
+        Args:
+            images (List[str]): names of the images to pre-warm
+        """
+        with cls.__resolved_images_lock:
+            if cls.__prewarm_done.is_set() or (cls.__prewarm_thread is not None and cls.__prewarm_thread.is_alive()):
+                return
+            cls.__prewarm_thread = Thread(target=cls.__prewarm_fn, args=(images,), daemon=True)
+            cls.__prewarm_thread.start()
+
+    @classmethod
+    def prewarm_status(cls) -> Dict[str, Any]:
+        """Return whether the images have been pre-warmed and the pre-warm error, if any"""
+        return {"ready": cls.__prewarm_done.is_set(), "error": cls.__prewarm_error}
+
     @classmethod
     def __docker_run(
         cls,
@@ -115,19 +205,11 @@ class Builder:
         Returns:
             str
         """
-        if not image in cls.__resolved_images:
-            resolved_image = (
-                docker_client.images.get(image.split("/")[-1])
-                if image.startswith("@local/") else
-                docker_client.images.pull(image)
-            )
-            cls.__event_log.input_image_event(image, resolved_image.id)
-            cls.__resolved_images[image] = resolved_image
-        else:
-            resolved_image = cls.__resolved_images[image]
+        resolved_image = cls.__resolve_image(image)
+        start = time.perf_counter()
 
         if gpus == "":
-            return (
+            result = (
                 docker_client.containers.run(
                     resolved_image,
                     str(cmd),
@@ -149,7 +231,7 @@ class Builder:
                     logger.exception("ValueError: gpu option not All and not integer" + verr)
             except Exception as e: 
                 logger.exception(e)
-            return (
+            result = (
                 docker_client.containers.run(
                     resolved_image,
                     str(cmd),
@@ -165,26 +247,59 @@ class Builder:
                     remove=remove
                 )
             )
+        # Detached containers are timed while their logs are streamed (see log_streamer)
+        if not detach:
+            DOCKER_RUN_DURATION.labels(image).observe(time.perf_counter() - start)
+        return result
         
 
 
     @classmethod
-    def __fetch_resource(cls, spec: Resource, workspace: Path) -> None:
+    def __checkout_is_intact(cls, checkout: Path, commit: str) -> bool:
+        """Private method: whether a model or dataset checkout's HEAD and content match a commit
+
+        Args:
+            checkout (Path): location of the checkout
+            commit (str): pinned commit hash
+
+        Returns:
+            bool
+        """
+        try:
+            head = cls.__docker_run(cmd=CmdLine(["git", "rev-parse", "--verify", "HEAD"]), workspace=checkout)
+            cls.__docker_run(cmd=verify_checkout_cmd(), workspace=checkout)
+        except docker.errors.ContainerError as e:
+            logger.warning(f"Checkout {checkout} failed verification: {e}")
+            return False
+        return head.decode().strip() == commit
+
+    @classmethod
+    def __fetch_resource(cls, spec: Resource, workspace: Path) -> str:
         """Private method: download a build resource and install it in the host's workspace
 
         Git repositories are cloned and checked out (to use the right branch) to the host's
         workspace using a docker run. If a package manager is specified, its lock file is
         generated/checked and measured.
 
+        Models and datasets are fetched according to `AICERT_FETCH_MODE` (see git_fetch).
+        Those pinned to a commit hash are materialised from the resource cache when
+        possible, and saved into it after a fresh fetch otherwise.
+
         Files and archives are downloaded, uncompressed and extracted to the host's
         workspace using a docker run.
 
         All docker run commands use the AICert base image that is built upon alpine
         and that contains a minimal set of tools (git, curl, gzip, tar, etc.)
         
+        The resource is not added to the event log here as fetches may run
+        concurrently, see `__fetch_resources`.
+        
         Args:
             spec (Resource): specification of the resource (see aicert-common's protocol)
             workspace (Union[str, Path]): host's working directory
+
+        Returns:
+            str: the resource hash
         """
 
         path = Path(spec.path)
@@ -225,26 +340,37 @@ class Builder:
             )
             resource_hash = f"sha1:{resource_hash}"
         elif spec.resource_type == "model" or spec.resource_type == "dataset":
-            container_hash = cls.__docker_run(
-                cmd=CmdLine(
-                    ["git", "lfs", "install"],
-                    ["git", "clone", spec.repo, path],
-                    ["cd", path], 
-                    ["git", "fetch", "origin", spec.hash], 
-                    ["git", "reset", "--hard", "FETCH_HEAD"]
-                ),
-                workspace=workspace,
-                detach=True, 
-            )
-            
-            log_streamer_dataset = LogStreamer(workspace / "log_model_dataset.log")
-            log_streamer_dataset.write_stream(container_hash, False)
+            cached = resource_cache is not None and resource_cache.materialize(spec.repo, spec.hash, workspace / path)
+            if cached and not cls.__checkout_is_intact(workspace / path, spec.hash):
+                logger.warning(f"Cached checkout of {spec.repo}@{spec.hash} is corrupted, fetching it again")
+                resource_cache.evict(spec.repo, spec.hash)
+                shutil.rmtree(workspace / path)
+                cached = False
+            if not cached:
+                cmd, env = fetch_cmd(spec.repo, spec.hash, path)
+                container_hash = cls.__docker_run(
+                    cmd=cmd,
+                    workspace=workspace,
+                    env=env,
+                    detach=True, 
+                )
+                
+                log_streamer_dataset = LogStreamer(workspace / "log_resource_fetch.log", "resource_fetch", image=BASE_IMAGE)
+                log_streamer_dataset.write_stream(container_hash, False)
 
+            # Cached or not, the measurement comes from the checkout in the workspace
             resource_hash = cls.__docker_run(
                 cmd=CmdLine(["git", "rev-parse", "--verify", "HEAD"]),
                 workspace=workspace / path,
                 detach=False, 
             )
+            if (
+                not cached
+                and resource_cache is not None
+                and resource_cache.is_cacheable(spec.hash)
+                and cls.__checkout_is_intact(workspace / path, spec.hash)
+            ):
+                resource_cache.store(spec.repo, spec.hash, workspace / path)
             resource_hash = f"sha1:{resource_hash}"
 
         else:
@@ -269,30 +395,58 @@ class Builder:
             )
             resource_hash = f"sha256:{resource_hash}"
         
-        cls.__event_log.input_resource_event(spec, resource_hash)
+        return resource_hash
 
     @classmethod
-    def __register_outputs(cls, ouput_pattern: str, workspace: Path) -> None:
-        """Private method: add hashes of output files to the event log
-        
+    def __timed_fetch_resource(cls, spec: Resource, workspace: Path) -> str:
+        """Private method: fetch a resource (see `__fetch_resource`) as a timed build phase"""
+        with phase_timer.phase("resource_fetch", spec.path) as phase:
+            resource_hash = cls.__fetch_resource(spec, workspace)
+            phase.bytes = disk_usage(workspace / spec.path)
+        return resource_hash
+
+    @classmethod
+    def __fetch_resources(cls, resources: List[Resource], workspace: Path) -> None:
+        """Private method: download build resources concurrently and measure them
+
+        Up to `MAX_CONCURRENT_FETCHES` resources are fetched at the same time,
+        each in its own container. Resource events are added to the event log
+        in declaration order, whatever the order in which the fetches complete,
+        so the event log replay remains deterministic.
+
+        The base image is resolved beforehand so that its event is added
+        before any resource event, as when resources were fetched sequentially.
+
+        Args:
+            resources (List[Resource]): resources to fetch
+            workspace (Path): host's working directory
+        """
+        if not resources:
+            return
+        cls.__resolve_image(BASE_IMAGE)
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FETCHES) as executor:
+            futures = [executor.submit(cls.__timed_fetch_resource, spec, workspace) for spec in resources]
+            for spec, future in zip(resources, futures):
+                logger.info(spec)
+                cls.__event_log.input_resource_event(spec, future.result())
+
+    @classmethod
+    def __register_archive(cls, archive: HashingArchiveWriter) -> None:
+        """Private method: add the hashes of an output archive and of its members to the event log
+
+        The hashes and the archive's Merkle manifest are computed by the archive writer
+        while the archive is written, so no output file is read again.
+
         Args:
-            output_pattern (str): glob pattern to select output files from
-                the workspace
-            workspace (Path)
+            archive (HashingArchiveWriter): closed output archive
         """
-        matches = list(workspace.glob(ouput_pattern))
-        outputs = [
-            (str(path.relative_to(workspace)), sha256_file(path))
-            for path in matches
-            if path.is_file()
-        ]
-        if not outputs:
+        if not archive.members:
             raise HTTPException(
                 status_code=404,
-                detail=f"No files matching output pattern: '{ouput_pattern}'",
+                detail=f"No output files to archive in '{archive.path.name}'",
             )
-        cls.__event_log.outputs_event(outputs)
-
+        cls.__output_manifests = [archive.manifest]
+        cls.__event_log.outputs_event([(archive.path.name, archive.sha256), *archive.members], cls.__output_manifests)
 
 
     @classmethod
@@ -322,9 +476,16 @@ class Builder:
                 detach=True,
             )
 
-            # Log streamer registers the stdout for the docker into the log file log_axolotl.log
-            log_streamer_finetune = LogStreamer(workspace / "log_model_dataset.log")
+            # Log streamer registers the stdout and stderr of the docker into the log file log_training.log
+            # and extracts the training metrics from them
+            training_metrics.reset(*throughput_factors(axolotl_config.config))
+            log_streamer_finetune = LogStreamer(
+                workspace / "log_training.log", "training", training_metrics.feed, image=axolotl_image
+            )
             log_streamer_finetune.write_stream(container_hash, True)
+            status_code = container_hash.wait()["StatusCode"]
+            if status_code != 0:
+                raise HTTPException(status_code=500, detail=f"The training failed with exit code {status_code}")
 
         except HTTPException as e:
             cls.__exception = e
@@ -351,35 +512,45 @@ class Builder:
                 cls.__register_axolotl_config(workspace=workspace, axolotl_config=axolotl_config)
 
                 # install inputs
-                for input in axolotl_config.resources:
-                    logger.info(input)
-                    cls.__fetch_resource(input, workspace)
-                    logger.info(cls.__docker_output_stream)
+                cls.__fetch_resources(axolotl_config.resources, workspace)
 
                 if cls.__finetune_framework == "axolotl":
                     import time
                     start_time = time.time()
-                    cls.__axolotl_run(axolotl_config=axolotl_config, axolotl_image=finetune_image, workspace=workspace)
+                    with phase_timer.phase("training"):
+                        cls.__axolotl_run(axolotl_config=axolotl_config, axolotl_image=finetune_image, workspace=workspace)
                     training_time = time.time() - start_time
                     cls.__event_log.finetune_timing(training_time)
+                    # The metrics of a failed run are not measured
+                    if cls.__exception is None:
+                        cls.__event_log.training_metrics_event(training_metrics.summary())
 
                 # Registering output and compression
                 import uuid
                 random_string = str(uuid.uuid4())
                 cls.__output_filename = 'finetuned-model-' + random_string + '.zip'
-                with zipfile.ZipFile(workspace / cls.__output_filename,'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for root, dirs, files in os.walk(workspace / "lora-out"):
-                        for file in files:
-                            zipf.write(os.path.join(root, file),
-                                    os.path.relpath(os.path.join(root,file), os.path.join(workspace /"lora-out", '..'))
-                            )
-                            if file == "trainer_state.json":
-                                path = os.path.join(root, file)
-                                with open(path) as file:
-                                    trainer_state = json.load(file)
-                                    cls.__event_log.finetune_flos(trainer_state["total_flos"])
+                archive_files = []
+                for root, dirs, files in os.walk(workspace / "lora-out"):
+                    for file in files:
+                        archive_files.append((
+                            os.path.join(root, file),
+                            os.path.relpath(os.path.join(root,file), os.path.join(workspace /"lora-out", '..'))
+                        ))
+                        if file == "trainer_state.json":
+                            path = os.path.join(root, file)
+                            with open(path) as file:
+                                trainer_state = json.load(file)
+                                cls.__event_log.finetune_flos(trainer_state["total_flos"])
+
+                # Outputs are hashed while they are archived
+                with phase_timer.phase("output_archive", cls.__output_filename) as phase:
+                    with HashingArchiveWriter(workspace / cls.__output_filename, axolotl_config.output_compression) as archive:
+                        archive.write_all(archive_files)
+                    phase.bytes = disk_usage(workspace / cls.__output_filename)
         
-                cls.__register_outputs(cls.__output_filename, workspace)
+                cls.__register_archive(archive)
+                if MEASURE_PHASE_TIMINGS:
+                    cls.__event_log.phase_timings_event(phase_timer.report()["phases"])
         
         except HTTPException as e:
             cls.__exception = e
@@ -394,19 +565,95 @@ class Builder:
 
     
     @classmethod
-    def get_attestation(cls, ca_cert = "") -> Dict[str, Any]:
+    def get_attestation(cls, ca_cert = "", nonce: Optional[bytes] = None) -> Dict[str, Any]:
         """Return the event log and the corresponding TPM measurement
         
-        Blocks until the event log lock is released (i.e. when the build is over).
+        Does not wait for a running build: the attestation covers the events
+        committed so far, which is all of them once the build is over.
+
+        Args:
+            ca_cert (str): certificate of the aTLS CA, measured in PCR 15
+            nonce (Optional[bytes]): verifier's nonce, included in the quote
         """
-        with cls.__event_log_lock:
-            return cls.__event_log.attest(ca_cert)
+        return cls.__event_log.attest(ca_cert, nonce)
 
     
+    @classmethod
+    def get_content(cls, digest: str) -> Optional[bytes]:
+        """Return a spec referenced by its content digest in the event log, None if it is unknown"""
+        return cls.__event_log.content(digest)
+
+    @classmethod
+    def wait_for_events(cls, since: int, timeout: Optional[float] = None) -> List[MeasuredEvent]:
+        """Return the events committed from index since, waiting up to timeout for a new one
+
+        Does not wait for the build lock: events are returned as soon as they are measured.
+        """
+        return cls.__event_log.events_since(since, timeout)
+
     @classmethod
     def get_output_file(cls) -> str:
         return cls.__output_filename
 
+    @classmethod
+    def get_output_manifests(cls) -> List[OutputManifest]:
+        """Return the Merkle manifests of the measured outputs"""
+        return cls.__output_manifests
+
+    @classmethod
+    def recover(cls, workspace: Path) -> None:
+        """Restore the event log from its journal after a server restart
+
+        The runner is then used: no new build can be started, as its events would
+        be measured after those of the recovered build. If the build had completed,
+        it is served again as is: the output archive measured in the outputs event is
+        hashed again to rebuild its Merkle manifest. Otherwise, or if the archive does
+        not match its measurement, the recovered build is reported as failed.
+
+        Args:
+            workspace (Path): workspace of the build
+        """
+        # Locks taken in the same order as poll_finetune
+        with cls.__fineture_thread_lock, cls.__event_log_lock:
+            recovered = cls.__event_log.recover()
+            if recovered == 0:
+                return
+            logger.info(f"Recovered {recovered} event(s) from the event log journal")
+            snapshot = cls.__event_log.snapshot()
+            outputs_events = [
+                event for event in map(json.loads, snapshot.event_log + snapshot.output_event_log)
+                if event["event_type"] == "outputs"
+            ]
+            cls.__fineture_thread_in_use = True
+            cls.__recovered_build = True
+            if not outputs_events:
+                cls.__exception = HTTPException(
+                    status_code=500, detail="The build was interrupted by a server restart"
+                )
+                return
+
+            # The archive is the first output, followed by its members
+            archive = outputs_events[-1]["content"][0]
+            archive_path = workspace / archive["spec"]["path"]
+            if archive_path.is_file():
+                result = hashing_engine.hash_files([archive_path], manifests=True)
+                [(_, archive_hash)], [chunks] = result.hashes, result.manifests
+                manifest = output_manifest(archive["spec"]["path"], chunks)
+                merkle = archive["resolved"].get("merkle")
+                if archive_hash == archive["resolved"]["hash"] and (merkle is None or merkle["root"] == manifest.root):
+                    cls.__output_manifests = [manifest]
+                else:
+                    logger.error(f"Output archive {archive_path} does not match its measurement")
+                    cls.__exception = HTTPException(
+                        status_code=500, detail="The output archive of the recovered build does not match its measurement"
+                    )
+            else:
+                logger.error(f"Output archive {archive_path} is missing")
+                cls.__exception = HTTPException(
+                    status_code=500, detail="The output archive of the recovered build is missing"
+                )
+            cls.__output_filename = archive["spec"]["path"]
+
     @classmethod
     def start_finetune(cls, workspace: Path, axolotl_config: AxolotlConfig) -> None:
         """Starts the finetuning with axolotl 
@@ -436,6 +683,11 @@ class Builder:
         completed successfully and (re)raises an error if one occured in the thread.
         """
         with cls.__fineture_thread_lock:
+            if cls.__recovered_build:
+                with cls.__event_log_lock:
+                    if cls.__exception is not None:
+                        raise cls.__exception
+                return True
             if cls.__finetune_thread is not None and not cls.__finetune_thread.is_alive():
                 with cls.__event_log_lock:
                     if cls.__exception is not None:
@@ -1,9 +1,11 @@
 import yaml 
-from aicert_common.protocol import Resource
+from aicert_common.protocol import Resource, OutputCompression
 from typing import List
-from pydantic import TypeAdapter
+from pydantic import TypeAdapter, ValidationError
 from fastapi import HTTPException
 
+from aicert_server import archive
+
 
 class AxolotlConfig:
     """Axolotl yaml config file
@@ -25,6 +27,7 @@ class AxolotlConfig:
     model_resource : Resource
     dataset_resource : Resource
     resources: List[Resource]
+    output_compression: OutputCompression = OutputCompression()
 
     config: dict
 
@@ -63,11 +66,31 @@ class AxolotlConfig:
             cls.config['datasets'][0].pop('name')
         cls.__datasethash = cls.__datasethash.split(":")[1]
     
+    @classmethod
+    def __extract_output_compression(cls) -> None:
+        """Extracts the output archive compression settings
+
+        The section is specific to AICert and is removed from the axolotl configuration.
+        """
+        try:
+            cls.output_compression = OutputCompression.model_validate(
+                cls.config.pop('aicert_output_compression', None) or {}
+            )
+        except ValidationError as e:
+            raise HTTPException(
+                status_code=400, detail=f"Invalid output compression settings: {e}"
+            )
+        if cls.output_compression.codec == "zstd" and archive.zstandard is None:
+            raise HTTPException(
+                status_code=400, detail="zstd output compression is not available on this runner"
+            )
+
     @classmethod 
     def initialize(cls, config_file: str):
         cls.__verify_config_file(config_file)
         AxolotlConfig.__extract_model()
         AxolotlConfig.__extract_dataset()
+        AxolotlConfig.__extract_output_compression()
 
     @classmethod
     def parse(cls) -> None:
@@ -0,0 +1,52 @@
+import hashlib
+import json
+import re
+from threading import Lock
+from typing import Any, Dict, Optional
+
+DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def canonical_json(payload: Any) -> bytes:
+    """Serialize a payload so that equal payloads always have the same bytes (and digest)"""
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+
+
+class ContentStore:
+    """Side-car store of event payloads, addressed by their SHA256 digest
+
+    Large event payloads (configurations, resource specs) are kept here and only
+    their digest is measured in the event log, so that the attestation stays small
+    however large the payloads are. As the digest is measured, a payload served from
+    the store can be checked by the verifier without trusting the server.
+
+    Entries are never removed: the store lives as long as the event log referencing them.
+    """
+
+    def __init__(self) -> None:
+        self.__lock = Lock()
+        self.__contents: Dict[str, bytes] = {}
+
+    def put(self, payload: Any) -> str:
+        """Store a payload
+
+        Args:
+            payload (Any): JSON serializable payload
+
+        Returns:
+            str: hex SHA256 digest of the payload's canonical JSON serialization
+        """
+        data = canonical_json(payload)
+        digest = hashlib.sha256(data).hexdigest()
+        with self.__lock:
+            self.__contents.setdefault(digest, data)
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        """Return the serialized payload with this digest, None if it is unknown"""
+        with self.__lock:
+            return self.__contents.get(digest)
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__contents)
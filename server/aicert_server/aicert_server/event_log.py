@@ -1,9 +1,70 @@
 import hashlib
 import json
-from typing import Dict, Any, List, Tuple
+import logging
+from threading import Condition
+from typing import Dict, Any, List, NamedTuple, Tuple, Optional
 
-from aicert_common.protocol import Resource, Build
-from aicert_server.tpm import quote, cert_chain, tpm_extend_pcr, PCR_FOR_MEASUREMENT, PCR_FOR_OUTPUT_MEASUREMENT
+from aicert_common.protocol import Resource, Build, OutputManifest
+from aicert_server.content_store import ContentStore
+from aicert_server.journal import EventJournal, JournalError
+from aicert_server.phase_timer import phase_timer
+from aicert_server.tpm import (
+    attested_snapshot,
+    cert_chain,
+    pcr_generation,
+    pcr_update,
+    tpm_extend_pcr,
+    tpm_read_pcr,
+    PCR_FOR_MEASUREMENT,
+    PCR_FOR_OUTPUT_MEASUREMENT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Value of the measurement PCRs at boot
+INITIAL_PCR = "00" * 32
+
+
+def _extended(pcr_value: str, event_json: str) -> str:
+    """Value of a PCR after it is extended with an event (hex)"""
+    hash_event = hashlib.sha256(event_json.encode()).hexdigest()
+    return hashlib.sha256(bytes.fromhex(pcr_value + hash_event)).hexdigest()
+
+
+def _replay(events: List[Dict[str, Any]]) -> Dict[int, str]:
+    """Values of the measurement PCRs after they are extended with the journaled events"""
+    pcr_values = {PCR_FOR_MEASUREMENT: INITIAL_PCR, PCR_FOR_OUTPUT_MEASUREMENT: INITIAL_PCR}
+    for record in events:
+        pcr_values[record["pcr_index"]] = _extended(pcr_values[record["pcr_index"]], record["event"])
+    return pcr_values
+
+
+class EventLogSnapshot(NamedTuple):
+    """Immutable view of the event log
+
+    Attributes:
+        event_log (List[str]): committed events measured in PCR_FOR_MEASUREMENT
+        output_event_log (List[str]): committed events measured in PCR_FOR_OUTPUT_MEASUREMENT
+        generation (int): PCR generation the snapshot was taken in
+    """
+    event_log: List[str]
+    output_event_log: List[str]
+    generation: int
+
+
+class MeasuredEvent(NamedTuple):
+    """Event of the event log, in commit order across the measurement PCRs
+
+    Attributes:
+        index (int): position of the event among all the committed events
+        pcr_index (int): PCR the event was extended into
+        event (str): the event, as measured (JSON)
+        pcr (str): value of the PCR after the event was extended (hex)
+    """
+    index: int
+    pcr_index: int
+    event: str
+    pcr: str
 
 
 class EventLog:
@@ -13,41 +74,158 @@ class EventLog:
     Every time an event is added, the backing PCR is "extended"
     with the new event. In practice this means that the TPM stores
     the hash of the previous PCR value and of new event data in the PCR.
+
+    Large specs (build requests, resources, configurations) are not embedded
+    in their events: the event only contains their "content_digest" and the
+    specs themselves are served from a side-car content store (see `content`).
+
+    With a journal, events and specs are journaled before they are measured,
+    and the event log can be rebuilt after a restart (see `recover`).
     
     Args:
         simulation_mode (bool): if set to True, the TPM is not used at all
+        journal (Optional[EventJournal]): write-ahead journal of the event log
     """
 
-    def __init__(self, simulation_mode: bool = False):
+    def __init__(self, simulation_mode: bool = False, journal: Optional[EventJournal] = None):
+        # Append-only lists, of which only the first committed entries are visible to readers
         self.__event_log = []
         self.__output_event_log = []
+        self.__measured_events: List[MeasuredEvent] = []
+        self.__committed = (0, 0)
+        self.__pcr_values = {PCR_FOR_MEASUREMENT: INITIAL_PCR, PCR_FOR_OUTPUT_MEASUREMENT: INITIAL_PCR}
+        self.__new_events = Condition()
         self.__simulation_mode = simulation_mode
+        self.__contents = ContentStore()
+        self.__journal = journal
 
     def __append(self, event: Dict[str, Any], outputs = False):
         """Private method: add an event to the event log, properly handling PCR extension
+
+        The PCR extension and the commit of the event form a single PCR update,
+        so snapshots never see one without the other. The event is journaled
+        before the PCR is extended.
         
         Args:
             event (Dict[str, Any]): the structured event data
         """
         event_json = json.dumps(event)
-        if self.__simulation_mode:
-            print(f"SIMULATION MODE: {event}")
+        hash_event = hashlib.sha256(event_json.encode()).hexdigest()
+        pcr_index = PCR_FOR_OUTPUT_MEASUREMENT if outputs and not self.__simulation_mode else PCR_FOR_MEASUREMENT
+        with pcr_update():
+            if self.__journal is not None:
+                self.__journal.append({"pcr_index": pcr_index, "event": event_json, "boot_id": self.__journal.boot_id})
+            if self.__simulation_mode:
+                print(f"SIMULATION MODE: {event}")
+            else:
+                with phase_timer.phase("pcr_extend", event["event_type"]):
+                    tpm_extend_pcr(pcr_index, hash_event)
+            self.__commit(pcr_index, event_json)
+
+    def __commit(self, pcr_index: int, event_json: str) -> None:
+        """Private method: make a measured event visible to readers
+
+        Args:
+            pcr_index (int): PCR the event was extended into
+            event_json (str): the event, as measured
+        """
+        if pcr_index == PCR_FOR_OUTPUT_MEASUREMENT:
+            self.__output_event_log.append(event_json)
+        else:
             self.__event_log.append(event_json)
+        # Software replay of the extend, streamed along with the event
+        pcr_value = _extended(self.__pcr_values[pcr_index], event_json)
+        self.__pcr_values[pcr_index] = pcr_value
+        self.__measured_events.append(
+            MeasuredEvent(len(self.__measured_events), pcr_index, event_json, pcr_value)
+        )
+        with self.__new_events:
+            self.__committed = (len(self.__event_log), len(self.__output_event_log))
+            self.__new_events.notify_all()
+
+    def __put_content(self, payload: Dict[str, Any]) -> str:
+        """Private method: store (and journal) a spec in the content store, returns its digest"""
+        digest = self.__contents.put(payload)
+        if self.__journal is not None:
+            self.__journal.append({"content": self.__contents.get(digest).decode()})
+        return digest
+
+    def recover(self) -> int:
+        """Rebuild the event log from its journal, after a server restart
+
+        Must be called before any event is added. The journaled events are replayed
+        in software and checked against the measurement PCRs; an event that was
+        journaled but whose PCR extend did not happen is dropped from the journal.
+        A journal left by a previous boot (measurement PCRs back to their initial
+        value, or another boot id in simulation mode) is discarded.
+
+        Returns:
+            int: number of recovered events
+
+        Raises:
+            JournalError: if the journal does not match the PCRs
+        """
+        if self.__journal is None:
+            return 0
+        records = self.__journal.read()
+        events = [i for i, record in enumerate(records) if "event" in record]
+        if not events:
+            return 0
+
+        if self.__simulation_mode:
+            if records[events[0]].get("boot_id") != self.__journal.boot_id:
+                logger.warning("The server rebooted, discarding the event log journal of a previous boot")
+                self.__journal.truncate(0)
+                return 0
         else:
-            if outputs:
-                hash_event = hashlib.sha256(event_json.encode()).hexdigest()
-                tpm_extend_pcr(PCR_FOR_OUTPUT_MEASUREMENT, hash_event)
-                self.__output_event_log.append(event_json)
-            else:
-                hash_event = hashlib.sha256(event_json.encode()).hexdigest()
-                tpm_extend_pcr(PCR_FOR_MEASUREMENT, hash_event)
-                self.__event_log.append(event_json)
+            tpm_pcrs = {pcr_index: tpm_read_pcr(pcr_index) for pcr_index in _replay([])}
+            if all(value == INITIAL_PCR for value in tpm_pcrs.values()):
+                logger.warning("Measurement PCRs were reset, discarding the event log journal of a previous boot")
+                self.__journal.truncate(0)
+                return 0
+            if _replay([records[i] for i in events]) != tpm_pcrs:
+                if _replay([records[i] for i in events[:-1]]) != tpm_pcrs:
+                    raise JournalError("The event log journal does not match the measurement PCRs")
+                logger.warning("Dropping the last journaled event, its PCR was not extended")
+                self.__journal.truncate(events[-1])
+                records = records[:events[-1]]
+
+        with pcr_update():
+            for record in records:
+                if "event" in record:
+                    self.__commit(record["pcr_index"], record["event"])
+                else:
+                    self.__contents.put(json.loads(record["content"]))
+        return len(self.__measured_events)
+
+    def content(self, digest: str) -> Optional[bytes]:
+        """Return the spec with this content digest (canonical JSON), None if it is unknown"""
+        return self.__contents.get(digest)
+
+    def events_since(self, since: int, timeout: Optional[float] = None) -> List[MeasuredEvent]:
+        """Return the committed events from index since, waiting for one if there is none yet
+
+        Args:
+            since (int): index of the first event to return
+            timeout (Optional[float]): maximum wait in seconds, None to wait forever
+
+        Returns:
+            List[MeasuredEvent]: events in commit order, empty if the wait timed out
+        """
+        with self.__new_events:
+            self.__new_events.wait_for(lambda: sum(self.__committed) > since, timeout=timeout)
+            return self.__measured_events[since:sum(self.__committed)]
+
+    def snapshot(self) -> EventLogSnapshot:
+        """Return the committed events, without waiting for an ongoing build"""
+        events, output_events = self.__committed
+        return EventLogSnapshot(self.__event_log[:events], self.__output_event_log[:output_events], pcr_generation())
 
     def build_request_event(self, build_request: Build) -> None:
         """Add a build request event to the event log
         
         This event is used when the server receives a request.
-        The content of the request is included in the event log.
+        The digest of the content of the request is included in the event log.
 
         Args:
             build_requets (Build): build request (see aicert-common's protocol)
@@ -56,7 +234,7 @@ class EventLog:
             {
                 "event_type": "build_request",
                 "content": {
-                    "spec": {"build_request_proto": build_request.dict()},
+                    "spec": {"content_digest": self.__put_content({"build_request_proto": build_request.dict()})},
                 },
             }
         )
@@ -65,7 +243,7 @@ class EventLog:
         """Add an input resource event to the event log
         
         This event is used when the server has downloaded data that should be measured.
-        The hash of the downloaded data is included in the event log.
+        The digest of the resource specs and the hash of the downloaded data are included in the event log.
 
         Args:
             resource (Resource): resource specs (see aicert-common's protocol)
@@ -75,7 +253,7 @@ class EventLog:
             {
                 "event_type": "input_resource",
                 "content": {
-                    "spec": {"resource_proto": resource.dict()},
+                    "spec": {"content_digest": self.__put_content({"resource_proto": resource.dict()})},
                     "resolved": {"hash": resource_hash},
                 },
             }
@@ -104,7 +282,7 @@ class EventLog:
     def configuration_event(self, configuration_file, configuration_file_hash) -> None: 
         """Add a configuration event to the event log
         
-        This event is used to register the configuration file and its content. 
+        This event is used to register the configuration file and the digest of its content.
         We take into account the measurement of the configuration file so that it will serve
         as proof that axolotl was ran with the configuration file stated. 
 
@@ -116,25 +294,34 @@ class EventLog:
             {
                 "event_type": "axolotl_configuration", 
                 "content": {
-                    "spec":  {"config_file": configuration_file},
+                    "spec": {"content_digest": self.__put_content({"config_file": configuration_file})},
                     "resolved": {"hash": configuration_file_hash},
                 }
             }
         )
 
-    def outputs_event(self, outputs: List[Tuple[str, str]]) -> None:
+    def outputs_event(self, outputs: List[Tuple[str, str]], manifests: Optional[List[OutputManifest]] = None) -> None:
         """Add an outputs event to the event log
         
         This event is used after the build has completed, when the outputs must be measured.
         The hash of the outputs are included in the event log.
+        For outputs that have a Merkle manifest, the Merkle root, chunk size and file size
+        are included as well, so that the manifest (served separately) can be verified.
 
         Args:
             outputs (List[Tuple[str, str]]): list of output file names and corresponding hashes
+            manifests (Optional[List[OutputManifest]]): Merkle manifests of some of the outputs
         """
+        merkle = {
+            manifest.path: {"root": manifest.root, "chunk_size": manifest.chunk_size, "size": manifest.size}
+            for manifest in manifests or []
+        }
         self.__append(
             {
                 "event_type": "outputs",
                 "content": [
+                    {"spec": {"path": path}, "resolved": {"hash": hash, "merkle": merkle[path]}}
+                    if path in merkle else
                     {"spec": {"path": path}, "resolved": {"hash": hash}}
                     for path, hash in outputs
                 ],
@@ -172,20 +359,60 @@ class EventLog:
             }
         )
 
+    def training_metrics_event(self, summary: Dict[str, Any]) -> None:
+        """Adds the summary of the training metrics to the event log
 
-    def attest(self, ca_cert="") -> Dict[str, Any]:
+        Args:
+            summary: summary of the metrics extracted from the training output (see training_metrics)
+        """
+        self.__append(
+            {
+                "event_type": "training_metrics",
+                "content": {
+                    "spec": summary,
+                }
+            }
+        )
+
+    def phase_timings_event(self, phases: List[Dict[str, Any]]) -> None:
+        """Adds the timings of the build phases to the event log
+
+        The timings are served by the content store, only their digest is measured.
+
+        Args:
+            phases: build phases recorded by the phase timer (see phase_timer)
+        """
+        self.__append(
+            {
+                "event_type": "phase_timings",
+                "content": {
+                    "spec": {"content_digest": self.__put_content({"phases": phases})},
+                }
+            }
+        )
+
+
+    def attest(self, ca_cert="", nonce: Optional[bytes] = None) -> Dict[str, Any]:
         """Return the full event log, the TPM quote and the certificate chain in the same dict
 
         The TPM quote contains all the PCR values (including the one backing the event log).
         It is signed by the TPM key which can be verified through the cloud-provider certificate chain.
+        If a nonce is given, it is included in the quote as qualifying data.
 
         In simulation mode, only the event log is return along with a special simulation_mode key.
+
+        The events and the quote are taken from the same snapshot: the quoted PCRs
+        are the result of replaying exactly the returned events.
         """
+        if self.__simulation_mode:
+            snapshot = self.snapshot()
+            remote_attestation = {"simulation_mode": True}
+        else:
+            snapshot, signed_quote = attested_snapshot(self.snapshot, nonce)
+            remote_attestation = {"quote": signed_quote, "cert_chain": cert_chain()}
         return {
             "ca_cert": ca_cert,
-            "event_log": self.__event_log,
-            "output_event_log": self.__output_event_log,
-            "remote_attestation": {"quote": quote(), "cert_chain": cert_chain()}
-            if not self.__simulation_mode
-            else {"simulation_mode": True},
+            "event_log": snapshot.event_log,
+            "output_event_log": snapshot.output_event_log,
+            "remote_attestation": remote_attestation,
         }
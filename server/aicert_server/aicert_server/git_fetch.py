@@ -0,0 +1,79 @@
+import os
+from pathlib import Path
+from typing import List, Tuple, Union
+
+from aicert_server.cmd_line import CmdLine
+
+# "fast" fetches only the pinned commit's tree and its LFS objects,
+# "full" clones the whole repository before checking out the pinned commit
+FETCH_MODE = os.getenv("AICERT_FETCH_MODE", "fast")
+LFS_CONCURRENT_TRANSFERS = int(os.getenv("AICERT_LFS_CONCURRENT_TRANSFERS", "16"))
+
+
+def full_fetch_cmd(repo: str, commit: str, path: Union[str, Path]) -> Tuple[CmdLine, List[str]]:
+    """Command line (and environment) that clones a repository then checks out a commit
+
+    The clone downloads the full history and the LFS objects of the default branch.
+    """
+    return CmdLine(
+        ["git", "lfs", "install"],
+        ["git", "clone", repo, path],
+        ["cd", path],
+        ["git", "fetch", "origin", commit],
+        ["git", "reset", "--hard", "FETCH_HEAD"],
+    ), []
+
+
+def fast_fetch_cmd(
+    repo: str,
+    commit: str,
+    path: Union[str, Path],
+    concurrent_transfers: int = LFS_CONCURRENT_TRANSFERS,
+) -> Tuple[CmdLine, List[str]]:
+    """Command line (and environment) that fetches a single commit and its LFS objects
+
+    Only the commit's tree is fetched (shallow fetch), LFS files are checked out as
+    pointers and the LFS objects they reference are then downloaded in parallel.
+    LFS transfer progress is written to stdout.
+    """
+    return CmdLine(
+        ["git", "lfs", "install", "--skip-smudge"],
+        ["git", "init", "--quiet", path],
+        ["cd", path],
+        ["git", "remote", "add", "origin", repo],
+        ["git", "fetch", "--depth", "1", "origin", commit],
+        ["git", "reset", "--hard", "FETCH_HEAD"],
+        ["git", "-c", f"lfs.concurrenttransfers={concurrent_transfers}", "lfs", "pull"],
+    ), ["GIT_LFS_PROGRESS=/dev/stdout"]
+
+
+def fetch_cmd(repo: str, commit: str, path: Union[str, Path], mode: str = FETCH_MODE) -> Tuple[CmdLine, List[str]]:
+    """Command line (and environment) that fetches a model or dataset repository at a commit
+
+    Args:
+        repo (str): repository url
+        commit (str): commit to check out
+        path (Union[str, Path]): checkout location
+        mode (str): "fast" or "full"
+    """
+    if mode == "full":
+        return full_fetch_cmd(repo, commit, path)
+    if mode == "fast":
+        return fast_fetch_cmd(repo, commit, path)
+    raise ValueError(f"Unknown fetch mode: {mode}")
+
+
+def verify_checkout_cmd() -> CmdLine:
+    """Command line that fails unless a checkout's content matches its HEAD commit
+
+    The git objects are checked (fsck), then the LFS objects against their ids,
+    then the working tree, LFS files included (through the clean filter),
+    against HEAD. No file may be added, removed or modified.
+    """
+    return CmdLine(
+        ["git", "lfs", "install", "--skip-smudge"],
+        ["git", "fsck", "--full", "--no-dangling"],
+        ["git", "lfs", "fsck"],
+        ["git", "diff", "--quiet", "HEAD"],
+        'test -z "$(git status --porcelain --untracked-files=all)"',
+    )
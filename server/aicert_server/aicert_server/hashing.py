@@ -0,0 +1,273 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from aicert_common.merkle import MERKLE_CHUNK_SIZE, ChunkHasher
+from aicert_common.protocol import OutputManifest
+from aicert_server.metrics import HASHED_BYTES
+
+logger = logging.getLogger(__name__)
+
+# hashlib releases the GIL while hashing buffers larger than 2 KiB,
+# so large reads let several threads hash files truly in parallel
+CHUNK_SIZE = 1024 * 1024
+
+# The hash cache lives outside of the workspace: the workspace is mounted
+# read-write in the build containers, which must not be able to tamper with it
+HASH_CACHE_FILE = os.getenv("AICERT_HASH_CACHE_FILE")
+HASH_CACHE_MAX_ENTRIES = 4096
+
+
+def sha256_file(file_path: Union[str, Path], chunk_size: int = CHUNK_SIZE) -> str:
+    """Returns the SHA256 hash of a file
+
+    The file is read in large chunks into a single reusable buffer
+    to avoid allocating a new bytes object for every read.
+    """
+    sha256_hash = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    total = 0
+    with open(file_path, "rb", buffering=0) as file:
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                break
+            sha256_hash.update(view[:size])
+            total += size
+    HASHED_BYTES.inc(total)
+    return sha256_hash.hexdigest()
+
+
+def sha256_file_with_manifest(file_path: Union[str, Path], chunk_size: int = MERKLE_CHUNK_SIZE) -> Tuple[str, ChunkHasher]:
+    """Returns the SHA256 hash of a file and its Merkle leaves, reading the file once"""
+    sha256_hash = hashlib.sha256()
+    chunks = ChunkHasher(chunk_size)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as file:
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                break
+            sha256_hash.update(view[:size])
+            chunks.update(view[:size])
+    chunks.finalize()
+    HASHED_BYTES.inc(chunks.size)
+    return sha256_hash.hexdigest(), chunks
+
+
+class HashingResult(NamedTuple):
+    """Result of a batch of file hashes
+
+    Attributes:
+        hashes (List[Tuple[Path, str]]): hashed paths and their hex digests,
+            in the same order as the requested paths
+        bytes_hashed (int): total number of bytes read
+        elapsed (float): wall time of the batch in seconds
+        manifests (List[ChunkHasher]): Merkle leaves of each file, in the same order,
+            if they were requested
+    """
+    hashes: List[Tuple[Path, str]]
+    bytes_hashed: int
+    elapsed: float
+    manifests: List[ChunkHasher] = []
+
+    @property
+    def throughput(self) -> float:
+        """Hashing throughput of the batch in bytes per second"""
+        return self.bytes_hashed / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def _stat_key(path: Union[str, Path]) -> str:
+    """Identity of a file's content as far as the kernel can tell
+
+    Any write to the file changes its mtime and ctime, and ctime cannot
+    be set from userspace, so an unchanged key means unchanged content.
+    """
+    st = os.stat(path)
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}:{st.st_ctime_ns}"
+
+
+class FileHashCache:
+    """Bounded LRU cache of file hashes keyed by (device, inode, size, mtime_ns, ctime_ns)
+
+    The cache can optionally be persisted to a JSON file so that it
+    survives server restarts. New entries are only written to it by save().
+
+    Args:
+        max_entries (int): maximum number of cached hashes, the least recently
+            used ones are evicted first
+        path (Union[str, Path], optional): file where the cache is persisted
+    """
+
+    def __init__(self, max_entries: int = HASH_CACHE_MAX_ENTRIES, path: Optional[Union[str, Path]] = None) -> None:
+        self.max_entries = max_entries
+        self.path = Path(path) if path is not None else None
+        self.__entries: OrderedDict[str, str] = OrderedDict()
+        self.__lock = Lock()
+        self.__save_lock = Lock()
+        self.__dirty = False
+        if self.path is not None and self.path.exists():
+            try:
+                self.__entries.update(json.loads(self.path.read_text()))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable hash cache {self.path}: {e}")
+            self.__evict()
+
+    def __evict(self) -> None:
+        """Private method: drop the least recently used entries beyond the size limit"""
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    def save(self) -> None:
+        """Atomically write the cache to disk, if it is persisted and changed since the last save
+
+        The entries are only locked while they are serialized, not while they are written.
+        """
+        if self.path is None:
+            return
+        with self.__save_lock:
+            with self.__lock:
+                if not self.__dirty:
+                    return
+                data = json.dumps(self.__entries)
+                self.__dirty = False
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(data)
+            os.replace(tmp_path, self.path)
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached hash for a stat key, if any"""
+        with self.__lock:
+            digest = self.__entries.get(key)
+            if digest is not None:
+                self.__entries.move_to_end(key)
+            return digest
+
+    def put(self, key: str, digest: str) -> None:
+        """Cache the hash for a stat key"""
+        with self.__lock:
+            self.__entries[key] = digest
+            self.__entries.move_to_end(key)
+            self.__evict()
+            self.__dirty = True
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+
+class HashingEngine:
+    """Hash many files concurrently using a thread pool
+
+    Args:
+        max_workers (int, optional): number of hashing threads,
+            defaults to the number of CPUs
+        chunk_size (int): size of each read
+        cache (FileHashCache, optional): cache of already computed hashes
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, chunk_size: int = CHUNK_SIZE, cache: Optional[FileHashCache] = None) -> None:
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.cache = cache
+
+    def hash_file(self, path: Union[str, Path]) -> str:
+        """Returns the SHA256 hash of a single file
+
+        If the engine has a cache, the file is only hashed if its stat key
+        is unknown. The hash is cached only if the stat key did not change
+        while the file was read.
+        """
+        digest, _ = self.__hash_file(path)
+        if self.cache is not None:
+            self.cache.save()
+        return digest
+
+    def __hash_file(self, path: Union[str, Path]) -> Tuple[str, int]:
+        """Private method: hash a file through the cache, without saving it
+
+        Returns:
+            Tuple[str, int]: hex digest and number of bytes read, 0 on a cache hit
+        """
+        if self.cache is None:
+            return sha256_file(path, self.chunk_size), os.path.getsize(path)
+
+        key = _stat_key(path)
+        digest = self.cache.get(key)
+        if digest is not None:
+            return digest, 0
+        digest = sha256_file(path, self.chunk_size)
+        if _stat_key(path) == key:
+            self.cache.put(key, digest)
+        return digest, os.path.getsize(path)
+
+    def __hash_file_with_manifest(self, path: Path) -> Tuple[str, ChunkHasher]:
+        """Private method: hash a file and compute its Merkle leaves, caching the hash
+
+        The leaves are not cached, so the file is always read: only later hashes
+        without manifest benefit from the cache.
+        """
+        key = _stat_key(path) if self.cache is not None else None
+        digest, chunks = sha256_file_with_manifest(path)
+        if key is not None and _stat_key(path) == key:
+            self.cache.put(key, digest)
+        return digest, chunks
+
+    def hash_files(self, paths: Sequence[Union[str, Path]], manifests: bool = False) -> HashingResult:
+        """Hash all the given files, preserving their order in the result
+
+        Args:
+            paths (Sequence[Union[str, Path]]): files to hash
+            manifests (bool): whether to also compute the Merkle leaves of each file
+                (in the same pass over the data)
+
+        Returns:
+            HashingResult
+        """
+        paths = [Path(path) for path in paths]
+        start = time.perf_counter()
+        workers = max(1, min(self.max_workers, len(paths)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            digests, chunks, bytes_hashed = [], [], 0
+            if manifests:
+                for digest, chunk_hasher in executor.map(self.__hash_file_with_manifest, paths):
+                    digests.append(digest)
+                    chunks.append(chunk_hasher)
+                    bytes_hashed += chunk_hasher.size
+            else:
+                for digest, bytes_read in executor.map(self.__hash_file, paths):
+                    digests.append(digest)
+                    bytes_hashed += bytes_read
+        if self.cache is not None:
+            self.cache.save()
+        elapsed = time.perf_counter() - start
+
+        result = HashingResult(list(zip(paths, digests)), bytes_hashed, elapsed, chunks)
+        logger.info(
+            f"Hashed {len(paths)} file(s), {bytes_hashed} bytes read in {elapsed:.2f}s "
+            f"({result.throughput / 1e6:.1f} MB/s)"
+        )
+        return result
+
+
+def output_manifest(path: str, chunks: ChunkHasher) -> OutputManifest:
+    """Build the manifest of an output file from its Merkle leaves"""
+    return OutputManifest(
+        path=path,
+        size=chunks.size,
+        chunk_size=chunks.chunk_size,
+        root=chunks.root().hex(),
+        leaves=[leaf.hex() for leaf in chunks.leaves],
+    )
+
+
+hashing_engine = HashingEngine(cache=FileHashCache(path=HASH_CACHE_FILE))
@@ -0,0 +1,102 @@
+import json
+import logging
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Any, BinaryIO, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# The journal must live outside of the workspace: the workspace is mounted
+# read-write in the build containers, which must not be able to tamper with it
+EVENT_LOG_JOURNAL = os.getenv("AICERT_EVENT_LOG_JOURNAL")
+# Random id of the running kernel, shared by the host and its containers
+BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
+
+
+def current_boot_id() -> Optional[str]:
+    """Return the id of the current boot, None if it is unknown"""
+    try:
+        with open(BOOT_ID_FILE) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+class JournalError(Exception):
+    """The journal cannot be replayed into an event log matching the PCRs"""
+    pass
+
+
+class EventJournal:
+    """Append-only, write-ahead journal of the event log
+
+    Each record is a JSON line, written and synced to disk before the
+    corresponding PCR extend, so that a restarted server can rebuild the
+    event log of the PCRs it finds. The server may stop after journaling
+    a record but before extending the PCR: the replay drops such a record.
+    A record cut short by a crash is dropped when the journal is read.
+
+    Args:
+        path (Union[str, Path]): journal file
+
+    Attributes:
+        boot_id (Optional[str]): id of the current boot, recorded along with the
+            events to recognize the journal of a previous boot without a TPM
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.boot_id = current_boot_id()
+        self.__lock = Lock()
+        self.__file: Optional[BinaryIO] = None
+        self.__offsets: List[int] = []
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def read(self) -> List[Dict[str, Any]]:
+        """Return the records of the journal, truncating a partially written last record"""
+        with self.__lock:
+            try:
+                data = self.path.read_bytes()
+            except FileNotFoundError:
+                data = b""
+            records = []
+            self.__offsets = [0]
+            for line in data.splitlines(keepends=True):
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated record")
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"Dropping a partially written record at the end of {self.path}")
+                    break
+                self.__offsets.append(self.__offsets[-1] + len(line))
+            if self.__offsets[-1] < len(data):
+                self.__truncate(len(records))
+            return records
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Write a record and wait until it is on disk"""
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        with self.__lock:
+            if self.__file is None:
+                self.__file = open(self.path, "ab", buffering=0)
+            self.__file.write(line)
+            os.fsync(self.__file.fileno())
+
+    def truncate(self, count: int) -> None:
+        """Keep only the first count records, as returned by the last `read`"""
+        with self.__lock:
+            self.__truncate(count)
+
+    def __truncate(self, count: int) -> None:
+        """Private method: truncate the journal after count records, the lock must be held"""
+        with open(self.path, "ab") as file:
+            file.truncate(self.__offsets[count])
+            os.fsync(file.fileno())
+        del self.__offsets[count + 1:]
+
+
+event_journal: Optional[EventJournal] = (
+    EventJournal(EVENT_LOG_JOURNAL) if EVENT_LOG_JOURNAL is not None else None
+)
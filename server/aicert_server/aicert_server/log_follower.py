@@ -0,0 +1,193 @@
+import asyncio
+import os
+import tempfile
+from collections import deque
+from itertools import islice
+from threading import Lock
+from typing import AsyncIterator, BinaryIO, Deque, List, Optional, Set, Tuple
+
+from aicert_server.metrics import STATUS_SUBSCRIBERS
+
+# Number of lines kept in memory, older lines are read back from the spill file
+RING_SIZE = int(os.getenv("AICERT_BUILD_LOG_RING_SIZE", "10000"))
+# Lines sent to new subscribers before the live ones, as `tail` would
+TAIL_LINES = 10
+# Largest number of lines batched into a single message
+MAX_BATCH_LINES = 1000
+# The spill file offset of one line out of CHECKPOINT_INTERVAL is kept, to seek close to any line
+CHECKPOINT_INTERVAL = 1024
+# Size from which the spill file is started over, the lines it held are then only in the ring buffer
+SPILL_MAX_BYTES = int(os.getenv("AICERT_BUILD_LOG_SPILL_MAX_BYTES", str(256 * 1024**2)))
+_READ_SIZE = 64 * 1024
+
+
+class LogFollower:
+    """Fans out the lines written by the log streamers to the /build/status subscribers
+
+    Lines are numbered in publication order and kept in a ring buffer shared
+    by all the subscribers. Each subscriber only has a cursor in it: it is
+    woken up when lines are published and reads them at its own pace, in
+    batches, so a slow subscriber delays no one and costs no extra memory.
+    A subscriber that falls behind the ring buffer, or resumes from an old
+    line, reads the missing lines back from the spill file where the lines
+    are also written. The spill file is buffered: it is flushed by flush(),
+    which the log writers call periodically, or when lines are read back.
+    It is started over once it exceeds spill_max_bytes.
+
+    Args:
+        ring_size (int): number of lines kept in memory
+        tail_lines (int): number of past lines sent to new subscribers
+        spill (bool): whether to keep the lines on disk, lines that leave
+            the ring buffer are lost otherwise
+        spill_max_bytes (int): size from which the spill file is started over
+        subscribers: gauge counting the subscribers
+    """
+
+    def __init__(
+        self,
+        ring_size: int = RING_SIZE,
+        tail_lines: int = TAIL_LINES,
+        spill: bool = True,
+        spill_max_bytes: int = SPILL_MAX_BYTES,
+        subscribers=STATUS_SUBSCRIBERS,
+    ) -> None:
+        self.__lock = Lock()
+        self.__subscribers = subscribers
+        self.__ring: Deque[str] = deque(maxlen=ring_size)
+        self.__next_line = 0
+        self.__tail_lines = tail_lines
+        self.__waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self.__spill_max_bytes = spill_max_bytes
+        # Anonymous file, outside of the workspace mounted in the build containers
+        self.__spill = tempfile.TemporaryFile() if spill else None
+        self.__spill_first_line = 0
+        self.__spill_size = 0
+        self.__spill_dirty = False
+        self.__checkpoints: List[int] = []
+
+    @property
+    def next_line(self) -> int:
+        """Number of the next line to be published"""
+        with self.__lock:
+            return self.__next_line
+
+    def publish(self, line: str) -> None:
+        """Number and store a line (several if it contains newlines) and wake the subscribers up
+
+        May be called from any thread.
+        """
+        with self.__lock:
+            for part in line.split("\n"):
+                if self.__spill is not None:
+                    self.__spill_line(part)
+                self.__ring.append(part)
+                self.__next_line += 1
+            waiters = list(self.__waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                pass
+
+    def __spill_line(self, line: str) -> None:
+        """Private method: write a line to the spill file, the lock must be held"""
+        if self.__spill_size >= self.__spill_max_bytes:
+            # The previous file is closed once no reader uses it anymore
+            self.__spill = tempfile.TemporaryFile()
+            self.__spill_first_line = self.__next_line
+            self.__spill_size = 0
+            self.__checkpoints = []
+        if (self.__next_line - self.__spill_first_line) % CHECKPOINT_INTERVAL == 0:
+            self.__checkpoints.append(self.__spill_size)
+        data = (line + "\n").encode()
+        self.__spill.write(data)
+        self.__spill_size += len(data)
+        self.__spill_dirty = True
+
+    def flush(self) -> None:
+        """Write the buffered lines to the spill file"""
+        with self.__lock:
+            self.__flush()
+
+    def __flush(self) -> None:
+        """Private method: write the buffered lines to the spill file, the lock must be held"""
+        if self.__spill_dirty:
+            self.__spill.flush()
+            self.__spill_dirty = False
+
+    def read(self, since: int, max_lines: int = MAX_BATCH_LINES) -> Tuple[int, List[str]]:
+        """Return up to max_lines lines from line number since
+
+        Args:
+            since (int): number of the first line to read
+            max_lines (int): maximum number of lines to return
+
+        Returns:
+            Tuple[int, List[str]]: number of the first returned line (later than since
+                if the lines were lost) and the lines, empty if none was published yet
+        """
+        with self.__lock:
+            first_in_ring = self.__next_line - len(self.__ring)
+            # Lines dropped with a previous spill file, or without spill file, are skipped
+            since = max(since, first_in_ring if self.__spill is None else min(self.__spill_first_line, first_in_ring))
+            if since >= first_in_ring:
+                return since, list(islice(self.__ring, since - first_in_ring, since - first_in_ring + max_lines))
+            # The spill file is append-only: its first lines can be read without the lock
+            self.__flush()
+            spill = self.__spill
+            offset = self.__checkpoints[(since - self.__spill_first_line) // CHECKPOINT_INTERVAL]
+            skip = (since - self.__spill_first_line) % CHECKPOINT_INTERVAL
+            count = min(max_lines, first_in_ring - since)
+        return since, self.__replay(spill, offset, skip, count)
+
+    def __replay(self, spill: BinaryIO, offset: int, skip: int, count: int) -> List[str]:
+        """Private method: read count lines from a spill file, after skipping skip lines from offset"""
+        lines: List[str] = []
+        pending = b""
+        while len(lines) < skip + count:
+            data = os.pread(spill.fileno(), _READ_SIZE, offset)
+            if not data:
+                break
+            offset += len(data)
+            *complete, pending = (pending + data).split(b"\n")
+            lines.extend(line.decode() for line in complete)
+        return lines[skip:skip + count]
+
+    async def follow(self, since: Optional[int] = None) -> AsyncIterator[Tuple[int, List[str]]]:
+        """Yield batches of lines as they are published
+
+        Args:
+            since (Optional[int]): number of the first line to yield, the last
+                tail_lines lines are yielded first if None. Numbers beyond the last
+                published line (from a previous server run) restart from the first line.
+
+        Yields:
+            Tuple[int, List[str]]: number of the last line of the batch and the lines
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        event = waiter[1]
+        with self.__lock:
+            self.__waiters.add(waiter)
+            if since is None:
+                since = max(0, self.__next_line - min(self.__tail_lines, len(self.__ring)))
+            elif since > self.__next_line:
+                since = 0
+        self.__subscribers.inc()
+        try:
+            while True:
+                # Cleared before reading, so that lines published meanwhile wake us up
+                event.clear()
+                start, lines = self.read(since)
+                if lines:
+                    since = start + len(lines)
+                    yield since - 1, lines
+                else:
+                    await event.wait()
+        finally:
+            self.__subscribers.dec()
+            with self.__lock:
+                self.__waiters.discard(waiter)
+
+
+build_log = LogFollower()
@@ -1,37 +1,269 @@
-import docker 
-import os
-import logging
+import codecs
+import docker
+import gzip
 import json
+import logging
+import os
+import re
+import shutil
 import time
+from datetime import datetime, timezone
+from pathlib import Path
+from queue import Queue
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from aicert_server.metrics import DOCKER_RUN_DURATION
+from aicert_server.log_follower import LogFollower, build_log
+
+logger = logging.getLogger(__name__)
+
+# Buffered lines are written to disk at least this often (in seconds)
+LOG_FLUSH_INTERVAL = float(os.getenv("AICERT_LOG_FLUSH_INTERVAL", "1.0"))
+# Size from which the log file is rotated, and number of compressed segments kept
+LOG_MAX_BYTES = int(os.getenv("AICERT_LOG_MAX_BYTES", str(64 * 1024**2)))
+LOG_BACKUP_COUNT = int(os.getenv("AICERT_LOG_BACKUP_COUNT", "5"))
+_BUFFER_SIZE = 256 * 1024
+
+# Output streams of the containers, captured separately
+LOG_STREAMS = ("stdout", "stderr")
+
+# Line terminators of container output, "\r" included for progress bars
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+class LogLineSplitter:
+    """Splits a stream of raw log chunks into lines
+
+    Chunks may end in the middle of a line or of a UTF-8 character, the
+    rest is kept until the next chunk. Invalid UTF-8 is replaced.
+    """
+
+    def __init__(self) -> None:
+        self.__decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.__pending = ""
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """Return the lines completed by a chunk"""
+        text = self.__pending + self.__decoder.decode(chunk)
+        # A "\r" at the end of a chunk may be followed by a "\n" in the next one
+        held = "\r" if text.endswith("\r") else ""
+        *lines, pending = _LINE_BREAK.split(text[:len(text) - len(held)])
+        self.__pending = pending + held
+        return lines
+
+    def close(self) -> List[str]:
+        """Return the last, unterminated, line if any"""
+        rest = (self.__pending + self.__decoder.decode(b"", final=True)).rstrip("\r")
+        self.__pending = ""
+        return [rest] if rest else []
+
+
+class JsonLinesLogWriter:
+    """Writes container logs as JSON Lines, with monotonic sequence numbers
+
+    Each record is a JSON object on its own line: {"seq", "time", "phase",
+    "container", "stream", "message"} for a log line and {"seq", "time", "eof": true} once the
+    build logs are over. Records are buffered and written to disk at least every
+    flush_interval seconds. They are also published to a log follower.
+
+    When the log file exceeds max_bytes, it is renamed to a numbered segment
+    (`<log file>.<n>.gz`) which is compressed in the background; only the last
+    backup_count segments are kept.
+
+    Args:
+        path (Union[str, Path]): log file
+        follower (Optional[LogFollower]): follower the records are published to
+        flush_interval (float): longest time a record stays in the buffer, in seconds
+        max_bytes (int): size from which the log file is rotated
+        backup_count (int): number of compressed segments kept
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        follower: Optional[LogFollower] = build_log,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        max_bytes: int = LOG_MAX_BYTES,
+        backup_count: int = LOG_BACKUP_COUNT,
+    ) -> None:
+        self.path = Path(path)
+        self.follower = follower
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.__lock = Lock()
+        self.__seq = 0
+        # Segments of a previous server run are kept
+        self.__segment = max(
+            (
+                int(segment.name.split(".")[-2])
+                for segment in self.path.parent.glob(f"{self.path.name}.*.gz")
+                if segment.name.split(".")[-2].isdigit()
+            ),
+            default=0,
+        )
+        self.__dirty = False
+        self.__file = open(self.path, "a", buffering=_BUFFER_SIZE, encoding="utf-8")
+        self.__size = self.__file.tell()
+        self.__flusher = Thread(target=self.__flush_periodically, daemon=True)
+        self.__flusher.start()
+        # Segments are compressed in order, so that expired segments are always compressed already
+        self.__segments: "Queue[Path]" = Queue()
+        self.__compressor = Thread(target=self.__compress_segments, daemon=True)
+        self.__compressor.start()
+
+    def write(self, lines: Iterable[str], container: str = "", stream: str = "stdout", phase: str = "") -> None:
+        """Write log lines of a container"""
+        with self.__lock:
+            for line in lines:
+                self.__write({"phase": phase, "container": container, "stream": stream, "message": line})
+
+    def write_eof(self) -> None:
+        """Mark the end of the build logs"""
+        with self.__lock:
+            self.__write({"eof": True})
+            self.__flush()
+
+    def __write(self, fields: Dict[str, Any]) -> None:
+        """Private method: write a record, the lock must be held"""
+        record = json.dumps(
+            {"seq": self.__seq, "time": datetime.now(timezone.utc).isoformat(), **fields},
+            ensure_ascii=False,
+        )
+        self.__seq += 1
+        self.__file.write(record + "\n")
+        self.__size += len(record) + 1
+        self.__dirty = True
+        if self.follower is not None:
+            self.follower.publish(record)
+        if self.__size >= self.max_bytes:
+            self.__rotate()
+
+    def flush(self) -> None:
+        """Write the buffered records to disk"""
+        with self.__lock:
+            self.__flush()
+
+    def __flush(self) -> None:
+        """Private method: write the buffered records to disk, the lock must be held"""
+        if self.__dirty:
+            self.__file.flush()
+            if self.follower is not None:
+                self.follower.flush()
+            self.__dirty = False
+
+    def __flush_periodically(self) -> None:
+        """Private method: flush loop of the background thread"""
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def __rotate(self) -> None:
+        """Private method: move the log file to a new segment and compress it, the lock must be held"""
+        self.__file.close()
+        self.__segment += 1
+        segment = self.path.with_name(f"{self.path.name}.{self.__segment}")
+        os.rename(self.path, segment)
+        self.__file = open(self.path, "a", buffering=_BUFFER_SIZE, encoding="utf-8")
+        self.__size = 0
+        self.__dirty = False
+        self.__segments.put(segment)
+
+    def __compress_segments(self) -> None:
+        """Private method: compression loop of the background thread, removes the expired segments"""
+        while True:
+            segment = self.__segments.get()
+            try:
+                with open(segment, "rb") as source, gzip.open(f"{segment}.gz", "wb") as destination:
+                    shutil.copyfileobj(source, destination)
+                segment.unlink()
+                expired = int(segment.name.split(".")[-1]) - self.backup_count
+                if expired > 0:
+                    self.path.with_name(f"{self.path.name}.{expired}.gz").unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"Could not compress log segment {segment}: {e}")
+            finally:
+                self.__segments.task_done()
+
+
+def record_matches(record: str, phase: Optional[str] = None, stream: Optional[str] = None) -> bool:
+    """Whether a JSON Lines record is a log line of the given phase and stream (any if None)
+
+    The end of the build logs matches any phase and stream.
+    """
+    if phase is None and stream is None:
+        return True
+    fields = json.loads(record)
+    if fields.get("eof"):
+        return True
+    return (phase is None or fields.get("phase") == phase) and (stream is None or fields.get("stream") == stream)
+
+
+_writers: Dict[str, JsonLinesLogWriter] = {}
+_writers_lock = Lock()
+
+
+def log_writer(log_file: Union[str, Path]) -> JsonLinesLogWriter:
+    """Return the writer of a log file, shared by all the streams written to it"""
+    path = os.path.realpath(log_file)
+    with _writers_lock:
+        if path not in _writers:
+            _writers[path] = JsonLinesLogWriter(path)
+        return _writers[path]
+
 
 class LogStreamer:
-    """LogStreamer, register the stream outputed by a container
+    """LogStreamer, register the streams outputed by a container
 
-    
+    The stdout and stderr of the container are captured separately and written
+    as JSON Lines (see JsonLinesLogWriter), each record tagged with its phase,
+    container and stream. Several containers may be streamed to the same log
+    file at the same time.
+
+    Args:
+        log_file (str): log file, shared with the other streamers writing to it
+        phase (str): build phase the container runs in (e.g. "resource_fetch")
+        observer (Optional[Callable[[str], None]]): called with each line of
+            output (of either stream), e.g. to extract metrics from it
+        image (str): name of the image the container was run from, as passed
+            to the builder's docker runs, which label their duration with it
     """
-    log_file: str = ""
-    logger: logging.Logger
-    filehandler: logging.FileHandler
 
-    def __init__(self, log_file: str) -> None:
+    def __init__(
+        self,
+        log_file: Union[str, Path],
+        phase: str = "",
+        observer: Optional[Callable[[str], None]] = None,
+        image: str = "unknown",
+    ) -> None:
         self.log_file = os.path.realpath(log_file)
-        self.filehandler = logging.FileHandler(log_file)
-
-    def __setup_logger(self):
-        self.logger = logging.getLogger("log_outputs")
-        self.logger.setLevel(logging.DEBUG)
-        formatter=logging.Formatter('{"time":"%(asctime)s", "name": "%(name)s", "level": "%(levelname)s", "message": "%(message)s"}')
-        # formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        self.filehandler.setFormatter(formatter)
-        self.logger.addHandler(self.filehandler)
+        self.phase = phase
+        self.observer = observer
+        self.image = image
+        self.writer = log_writer(self.log_file)
 
     def write_stream(self, container: docker.models.containers.Container, last_stream: bool):
-        self.__setup_logger()
-        for log in container.logs(stdout=True, stderr=False, stream=True):
-            self.logger.info(f"{log}")
+        # The stream ends when the (detached) container exits, and includes what
+        # was output before attaching
+        start = time.perf_counter()
+        splitters = {stream: LogLineSplitter() for stream in LOG_STREAMS}
+        container_id = container.short_id
+        for stdout, stderr in container.attach(stdout=True, stderr=True, stream=True, logs=True, demux=True):
+            for stream, chunk in zip(LOG_STREAMS, (stdout, stderr)):
+                if chunk:
+                    self.__write(splitters[stream].feed(chunk), container_id, stream)
+        for stream, splitter in splitters.items():
+            self.__write(splitter.close(), container_id, stream)
+        DOCKER_RUN_DURATION.labels(self.image).observe(time.perf_counter() - start)
         if last_stream:
-            self.logger.info(f"[EOF]")
-        self.logger.removeHandler(self.filehandler)
-        self.filehandler.close()
+            self.writer.write_eof()
+        else:
+            self.writer.flush()
 
-    
+    def __write(self, lines: List[str], container_id: str, stream: str) -> None:
+        """Private method: write lines of a stream and pass them to the observer"""
+        self.writer.write(lines, container_id, stream, self.phase)
+        if self.observer is not None:
+            for line in lines:
+                self.observer(line)
@@ -9,32 +9,65 @@ Endpoints:
     POST /submit_server [body: Serve]: start serving according to given specs (see aicert-common's protocol for the request specs)
         Available only if the build has completed.
     GET /attestation: returns 204 if the build has not completed and the attesation (event log, quote and certificate chain) otherwise
+        With a hex encoded nonce (?nonce=...), the quote's qualifying data is the Merkle root of
+        the nonces received within a short window, and the nonce's inclusion proof is returned too.
+        The attestation is encoded in JSON, CBOR or MessagePack according to the Accept header
+    GET /content/digest: returns a spec referenced by its "content_digest" in the event log (canonical JSON)
+    GET /outputs/manifest: returns 204 if the build has not completed and the Merkle manifests of the outputs otherwise
+    GET /event_log/stream?since=N: server-sent events, one per measured event (from index N) with
+        its index, PCR and the running value of that PCR, then an "end" event once the build is over
+    GET /build/status?since=N&phase=...&stream=...: server-sent events with the lines of the build logs
+        as they are written, resumable with Last-Event-ID. Lines can be restricted to a build phase
+        ("resource_fetch" or "training") and to the stdout or stderr of the containers
+    GET /build/training_metrics?since=N: server-sent events with the training metrics (step, epoch, loss,
+        learning rate, samples and tokens per second) extracted from the training output as it is
+        written, resumable with Last-Event-ID
+    GET /build/timings: start, end, duration and bytes processed of each build phase (fetches, training,
+        archive, PCR extends, upload...) and totals per kind of phase
+    GET /ready: returns 200 once the server is ready to build (images pre-warmed) and to attest
+        (AIK certificate chain loaded), and 503 otherwise
+
+Prometheus metrics are not served by this app, which Caddy exposes publicly, but on
+AICERT_METRICS_ADDR, on the constrained network (see metrics)
 """
 
-import base64
-from fastapi import FastAPI, HTTPException
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import Response, JSONResponse, StreamingResponse
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import Response, JSONResponse
 from pathlib import Path
 import uvicorn
 import hashlib
 import yaml
 import logging
-from sh import tail
 import json
 import asyncio
-import subprocess
-import select
+import time
 from pydantic import BaseModel
 
-from aicert_common.protocol import AxolotlConfigString
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from sse_starlette.sse import EventSourceResponse
+
+from aicert_common.encoding import MEDIA_TYPES, encode_attestation, negotiate_media_type
+from aicert_common.protocol import AxolotlConfigString, OutputManifest
 from aicert_server.config_parser import AxolotlConfig
 from aicert_server.builder import Builder, SIMULATION_MODE
-from aicert_server.tpm import tpm_extend_pcr, tpm_read_pcr
+from aicert_server.tpm import tpm_extend_pcr, tpm_read_pcr, load_cert_chain, cert_chain_status, MAX_QUALIFYING_DATA_SIZE
+from aicert_server.nonce_batch import NonceBatcher
+from aicert_server.content_store import DIGEST
+from aicert_server.phase_timer import phase_timer, disk_usage
+from aicert_server.metrics import REQUEST_LATENCY, start_metrics_server
+from aicert_server.log_follower import build_log
+from aicert_server.log_streamer import LOG_STREAMS, record_matches
+from aicert_server.training_metrics import training_metrics
 from aicert_server.deploy_storage import *
 
 
 PCR_FOR_CERTIFICATE = 15
+# Longest wait for a new event before the event log stream checks whether the build is over
+EVENT_STREAM_WAIT = 5.0
+# Interval between two heartbeats of an idle /build/status stream, in seconds
+STATUS_HEARTBEAT_INTERVAL = 15
 WORKSPACE = Path("/workspace")
 WORKSPACE.mkdir(exist_ok=True)
 
@@ -44,24 +77,116 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 axolotl_config = AxolotlConfig()
+nonce_batcher = NonceBatcher(lambda root: Builder.get_attestation(nonce=root))
+# Serializes the check-then-extend of the certificate PCR
+certificate_pcr_lock = Lock()
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label with the route template, not the path, to bound the number of series
+    route = request.scope.get("route")
+    REQUEST_LATENCY.labels(
+        request.method, route.path if route is not None else "unmatched", response.status_code
+    ).observe(time.perf_counter() - start)
+    return response
+
+
+@app.on_event("startup")
+def serve_metrics() -> None:
+    # On a separate listener, reachable from the constrained network only (see metrics)
+    start_metrics_server()
+
+
+@app.on_event("startup")
+def recover_event_log() -> None:
+    # Serve the event log of the measurements made before a restart,
+    # a journal that does not match the PCRs stops the server
+    Builder.recover(WORKSPACE)
+
 
-async def logGenerator():
-    f = subprocess.Popen(['tail','-F', WORKSPACE / "log_model_dataset.log"], stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    p = select.poll()
-    p.register(f.stdout)
+@app.on_event("startup")
+def prewarm() -> None:
+    Builder.start_prewarm()
 
-    while True:
-        data = ""
-        if p.poll(1):
-            data = f.stdout.readline()
-        yield f'{data}' + '\n'
-        await asyncio.sleep(0.5)
+
+@app.on_event("startup")
+def load_attestation_cert_chain() -> None:
+    # Failures are reported by /ready, the chain is loaded again on the next attestation
+    if not SIMULATION_MODE:
+        try:
+            load_cert_chain()
+        except Exception:
+            pass
+
+
+@app.get("/ready")
+def ready() -> JSONResponse:
+    images = Builder.prewarm_status()
+    content = {"images": images}
+    is_ready = images["ready"]
+    if not SIMULATION_MODE:
+        content["cert_chain"] = cert_chain_status()
+        is_ready = is_ready and content["cert_chain"]["ready"]
+    return JSONResponse(content=content, status_code=200 if is_ready else 503)
 
 
 @app.get("/build/status")
-async def build_status():
-    log_generator = logGenerator()
-    return StreamingResponse(log_generator, media_type='text/event-stream')
+async def build_status(
+    request: Request,
+    since: Optional[int] = None,
+    phase: Optional[str] = None,
+    stream: Optional[str] = None,
+) -> EventSourceResponse:
+    # Streams the lines of the build containers' logs as they are written, one "log"
+    # message (one data line per log line) per burst of lines, whose id is the number
+    # of its last line. Reconnecting clients resume after the last line they received
+    # (Last-Event-ID) or from ?since=N; others get the last few lines first.
+    # With ?phase= and/or ?stream=, the other lines are skipped (but still numbered).
+    # A comment is sent every STATUS_HEARTBEAT_INTERVAL seconds to keep the connection alive.
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id is not None:
+        try:
+            since = max(since or 0, int(last_event_id) + 1)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    if since is not None and since < 0:
+        raise HTTPException(status_code=400, detail="since must be positive")
+    if stream is not None and stream not in LOG_STREAMS:
+        raise HTTPException(status_code=400, detail=f"stream must be one of {', '.join(LOG_STREAMS)}")
+
+    async def messages():
+        async for last_line, lines in build_log.follow(since):
+            lines = [line for line in lines if record_matches(line, phase, stream)]
+            if lines:
+                yield {"event": "log", "id": str(last_line), "data": "\n".join(lines)}
+
+    return EventSourceResponse(messages(), ping=STATUS_HEARTBEAT_INTERVAL)
+
+@app.get("/build/training_metrics")
+async def build_training_metrics(request: Request, since: Optional[int] = None) -> EventSourceResponse:
+    # Streams one "metrics" message per point of the training metrics, whose id is the
+    # number of the point. New clients get the latest point first.
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id is not None:
+        try:
+            since = max(since or 0, int(last_event_id) + 1)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    if since is not None and since < 0:
+        raise HTTPException(status_code=400, detail="since must be positive")
+
+    async def messages():
+        async for last_point, points in training_metrics.follower.follow(since):
+            for number, point in enumerate(points, last_point - len(points) + 1):
+                yield {"event": "metrics", "id": str(number), "data": point}
+
+    return EventSourceResponse(messages(), ping=STATUS_HEARTBEAT_INTERVAL)
+
+@app.get("/build/timings")
+def build_timings() -> JSONResponse:
+    return JSONResponse(content=phase_timer.report())
 
 @app.post("/finetune", status_code=202)
 def start_finetune() -> None:
@@ -89,29 +214,91 @@ async def storage_upload(sastoken: SASToken):
     storage_container = sastoken.storage_container
     url = "https://" + storage_account + ".blob.core.windows.net/" + storage_container + "/" + output_filename
     url_token = url + "?" + token
-    model_uploader = ModelUploader(url_token, WORKSPACE / output_filename)
-    model_uploader.upload_model()
+    with phase_timer.phase("upload", output_filename) as phase:
+        model_uploader = ModelUploader(url_token, WORKSPACE / output_filename)
+        model_uploader.upload_model()
+        phase.bytes = disk_usage(WORKSPACE / output_filename)
 
     return JSONResponse(content={"model link": url}, status_code=202)
 
 
 
+def parse_nonce(nonce: Optional[str]) -> Optional[bytes]:
+    """Decode a verifier's hex encoded nonce, to be included in the quote"""
+    if nonce is None:
+        return None
+    try:
+        nonce_bytes = bytes.fromhex(nonce)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="The nonce must be hex encoded")
+    if not 0 < len(nonce_bytes) <= MAX_QUALIFYING_DATA_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"The nonce must be between 1 and {MAX_QUALIFYING_DATA_SIZE} bytes long"
+        )
+    return nonce_bytes
+
+
+def attestation_media_type(accept: Optional[str]) -> str:
+    """Negotiate the encoding of an attestation from the Accept header"""
+    media_type = negotiate_media_type(accept)
+    if media_type is None:
+        raise HTTPException(
+            status_code=406, detail=f"Attestations are available as {', '.join(MEDIA_TYPES)}"
+        )
+    return media_type
+
+
+def attestation_response(attestation: Dict[str, Any], media_type: str) -> Response:
+    # The quote and the certificates are raw bytes: CBOR and MessagePack carry them
+    # as such, JSON as {"base64": ...} objects (see aicert-common's encoding)
+    return Response(
+        content=encode_attestation(attestation, media_type),
+        media_type=media_type,
+        headers={"Vary": "Accept"},
+    )
+
+
 @app.get("/attestation")
-def attestation() -> Response:
+def attestation(nonce: Optional[str] = None, accept: Optional[str] = Header(default=None)) -> Response:
+    # Without a nonce, the quote is reused until the PCRs change.
+    # Nonces received together are batched under a Merkle root, which is quoted once:
+    # each requester gets the shared quote and the inclusion proof of its nonce
+    nonce_bytes = parse_nonce(nonce)
+    media_type = attestation_media_type(accept)
     if not Builder.poll_finetune():
         return Response(status_code=204)
-    # FastAPI encodes the response as json, but the quote contains raw bytes...
-    # so we have to base64 encode them, this is ugly.
-    # Ideally we'd like another serialization format like CBOR or messagepack
-    # but FastAPI does not support those :(
-    return jsonable_encoder(
-        Builder.get_attestation(),
-        custom_encoder={
-            bytes: lambda v: {"base64": base64.b64encode(v).decode("utf-8")}
-        },
+    if nonce_bytes is None:
+        attestation = Builder.get_attestation()
+    else:
+        batched = nonce_batcher.submit(nonce_bytes)
+        attestation = {**batched["attestation"], "nonce_proof": batched["nonce_proof"]}
+    return attestation_response(attestation, media_type)
+
+
+@app.get("/content/{digest}")
+def content(digest: str) -> Response:
+    # Content is immutable and checked against the measured digest by the client
+    if DIGEST.match(digest) is None:
+        raise HTTPException(status_code=400, detail="Content digests are hex encoded SHA256 hashes")
+    data = Builder.get_content(digest)
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"No content with digest {digest}")
+    return Response(
+        content=data,
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
     )
 
 
+@app.get("/outputs/manifest", response_model=List[OutputManifest])
+def outputs_manifest():
+    # The manifests are not part of the event log to keep attestations small,
+    # their roots are measured in the outputs event
+    if not Builder.poll_finetune():
+        return Response(status_code=204)
+    return Builder.get_output_manifests()
+
+
 def get_caddy_rootca():
     import requests
     from requests.adapters import HTTPAdapter
@@ -132,23 +319,64 @@ def get_caddy_rootca():
 
 
 @app.get("/aTLS")
-def aTLS() -> Response:
+def aTLS(nonce: Optional[str] = None, accept: Optional[str] = Header(default=None)) -> Response:
     # Extends PCR 15 with the CA certificate and generates and returns the attestation
-    
+    nonce_bytes = parse_nonce(nonce)
+    media_type = attestation_media_type(accept)
+
     ca_cert = get_caddy_rootca()
 
     cert_hash = hashlib.sha256(ca_cert.encode("utf-8")).hexdigest()
     
-    tpm_value = tpm_read_pcr(PCR_FOR_CERTIFICATE)
-    if tpm_value == "0000000000000000000000000000000000000000000000000000000000000000":
-        tpm_extend_pcr(PCR_FOR_CERTIFICATE, cert_hash)
-
-    return jsonable_encoder(
-        Builder.get_attestation(ca_cert),
-        custom_encoder={
-            bytes: lambda v: {"base64": base64.b64encode(v).decode("utf-8")}
-        },
-    )
+    # Concurrent handshakes must not both extend the PCR, only an actual extend
+    # invalidates the cached quote (see tpm_extend_pcr)
+    with certificate_pcr_lock:
+        tpm_value = tpm_read_pcr(PCR_FOR_CERTIFICATE)
+        if tpm_value == "0000000000000000000000000000000000000000000000000000000000000000":
+            tpm_extend_pcr(PCR_FOR_CERTIFICATE, cert_hash)
+
+    return attestation_response(Builder.get_attestation(ca_cert, nonce_bytes), media_type)
+
+
+def build_outcome() -> Optional[Dict[str, Any]]:
+    """Returns the outcome of the build once it is over, None while it runs"""
+    try:
+        if not Builder.poll_finetune():
+            return None
+    except HTTPException as e:
+        return {"status": "failed", "detail": e.detail}
+    return {"status": "completed"}
+
+
+@app.get("/event_log/stream")
+async def event_log_stream(request: Request, since: int = 0) -> EventSourceResponse:
+    # Streams the measured events as they are committed, with the running value
+    # of the PCR they were extended into. Reconnecting clients resume after the
+    # last event they received (Last-Event-ID) or from ?since=N.
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id is not None:
+        try:
+            since = max(since, int(last_event_id) + 1)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    if since < 0:
+        raise HTTPException(status_code=400, detail="since must be positive")
+
+    async def events():
+        next_index = since
+        while True:
+            # Checked before reading the events, so that none committed at the very end is missed
+            outcome = build_outcome()
+            timeout = 0 if outcome is not None else EVENT_STREAM_WAIT
+            measured = await asyncio.to_thread(Builder.wait_for_events, next_index, timeout)
+            for event in measured:
+                yield {"id": str(event.index), "event": "measurement", "data": json.dumps(event._asdict())}
+            next_index += len(measured)
+            if outcome is not None and not measured:
+                yield {"event": "end", "data": json.dumps({**outcome, "count": next_index})}
+                return
+
+    return EventSourceResponse(events())
 
 
 ### Axolotl endpoints
@@ -158,6 +386,9 @@ def config_axolotl(axolotl_conf_string: AxolotlConfigString) -> JSONResponse:
     if axolotl_config.valid:
         return JSONResponse(content={"Error":"Cannot upload more than one configuration to the server"}, status_code=406)
 
+    # Retry the pre-warm if it failed at startup
+    Builder.start_prewarm()
+
     print("Setting up axolotl configuration.")
     axolotl_config.initialize(axolotl_conf_string.axolotl_config)
     axolotl_config.parse()
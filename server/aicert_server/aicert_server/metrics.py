@@ -0,0 +1,117 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram, start_http_server
+except ImportError:
+    Counter = Gauge = Histogram = start_http_server = None
+
+logger = logging.getLogger(__name__)
+
+# Address ("host:port") of the Prometheus metrics server, disabled if unset.
+# The metrics are not served by the app: Caddy proxies all of its routes to the
+# internet, so the metrics server must listen on the constrained network only.
+METRICS_ADDR = os.getenv("AICERT_METRICS_ADDR")
+
+# Builds phases and container runs last from seconds to hours
+LONG_BUCKETS = (1, 5, 15, 60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400, float("inf"))
+
+
+class _NoopMetric:
+    """Stands for a metric when prometheus_client is not installed"""
+
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+
+def _metric(kind, name: str, documentation: str, labelnames=(), **kwargs):
+    if kind is None:
+        return _NoopMetric()
+    return kind(name, documentation, labelnames, **kwargs)
+
+
+REQUEST_LATENCY = _metric(
+    Histogram, "aicert_http_request_duration_seconds",
+    "Latency of the HTTP requests, until the response headers are sent", ["method", "route", "status"],
+)
+TPM_OPERATIONS = _metric(
+    Counter, "aicert_tpm_operations_total", "TPM operations", ["operation", "backend", "outcome"],
+)
+TPM_LATENCY = _metric(
+    Histogram, "aicert_tpm_operation_duration_seconds", "Latency of the TPM operations", ["operation", "backend"],
+)
+DOCKER_RUN_DURATION = _metric(
+    Histogram, "aicert_docker_run_duration_seconds", "Duration of the container runs", ["image"],
+    buckets=LONG_BUCKETS,
+)
+BUILD_PHASE_DURATION = _metric(
+    Histogram, "aicert_build_phase_duration_seconds", "Duration of the build phases (see phase_timer)", ["phase"],
+    buckets=LONG_BUCKETS,
+)
+# Bytes fetched are those of the "resource_fetch" phase, bytes uploaded those of the "upload" phase
+BUILD_PHASE_BYTES = _metric(
+    Counter, "aicert_build_phase_bytes_total", "Bytes processed by the build phases", ["phase"],
+)
+HASHED_BYTES = _metric(Counter, "aicert_hashed_bytes_total", "Bytes of the files hashed by the hashing engine")
+STATUS_SUBSCRIBERS = _metric(Gauge, "aicert_build_status_subscribers", "Clients following /build/status")
+TRAINING_METRICS_SUBSCRIBERS = _metric(
+    Gauge, "aicert_training_metrics_subscribers", "Clients following /build/training_metrics"
+)
+# Latest values extracted from the output of the training container (see training_metrics)
+TRAINING_STEP = _metric(Gauge, "aicert_training_step", "Current step of the training")
+TRAINING_LOSS = _metric(Gauge, "aicert_training_loss", "Last training loss logged")
+TRAINING_LEARNING_RATE = _metric(Gauge, "aicert_training_learning_rate", "Last learning rate logged")
+TRAINING_SAMPLES_PER_SECOND_PER_DEVICE = _metric(
+    Gauge, "aicert_training_samples_per_second_per_device", "Training throughput of each GPU in samples per second"
+)
+TRAINING_TOKENS_PER_SECOND_PER_DEVICE = _metric(
+    Gauge, "aicert_training_tokens_per_second_per_device", "Training throughput of each GPU in tokens per second"
+)
+
+
+@contextmanager
+def tpm_operation(operation: str, backend: str) -> Iterator[None]:
+    """Count and time a TPM operation"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        TPM_LATENCY.labels(operation, backend).observe(time.perf_counter() - start)
+        TPM_OPERATIONS.labels(operation, backend, outcome).inc()
+
+
+def start_metrics_server(addr: Optional[str] = METRICS_ADDR) -> bool:
+    """Serve the metrics in the Prometheus format, from a background thread
+
+    Args:
+        addr (Optional[str]): "host:port" to listen on, the metrics are not served if None
+
+    Returns:
+        bool: whether the metrics server was started
+    """
+    if addr is None:
+        return False
+    if start_http_server is None:
+        logger.warning("prometheus_client is not installed, metrics are not served")
+        return False
+    host, _, port = addr.rpartition(":")
+    start_http_server(int(port), addr=host or "0.0.0.0")
+    logger.info(f"Serving metrics on {addr}")
+    return True
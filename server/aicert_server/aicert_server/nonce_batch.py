@@ -0,0 +1,103 @@
+import logging
+import os
+from threading import Condition, Event
+from typing import Any, Callable, Dict, List, Optional
+
+from aicert_common.merkle import inclusion_proof, leaf_hash, merkle_levels
+
+logger = logging.getLogger(__name__)
+
+# Nonces received within this window (in seconds) share a single quote
+NONCE_BATCH_WINDOW = float(os.getenv("AICERT_NONCE_BATCH_WINDOW", "0.05"))
+NONCE_BATCH_MAX_SIZE = int(os.getenv("AICERT_NONCE_BATCH_MAX_SIZE", "1024"))
+
+class _Batch:
+    """Nonces collected during one window and the attestation produced for them"""
+
+    def __init__(self) -> None:
+        self.leaves: List[bytes] = []
+        self.levels: List[List[bytes]] = []
+        self.done = Event()
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+
+
+class NonceBatcher:
+    """Serve many fresh attestation requests with a single TPM quote
+
+    The first nonce to arrive opens a batch and waits for the batch window
+    (or until the batch is full); the nonces received meanwhile join it.
+    The Merkle root of the batch's nonces is then quoted as qualifying data,
+    and each requester receives the shared attestation along with the
+    inclusion proof of its nonce in the root.
+
+    Args:
+        attest (Callable[[bytes], Any]): produces an attestation with the given qualifying data
+        window (float): how long a batch collects nonces, in seconds
+        max_size (int): maximum number of nonces in a batch
+    """
+
+    def __init__(
+        self,
+        attest: Callable[[bytes], Any],
+        window: float = NONCE_BATCH_WINDOW,
+        max_size: int = NONCE_BATCH_MAX_SIZE,
+    ) -> None:
+        self.attest = attest
+        self.window = window
+        self.max_size = max_size
+        self.__condition = Condition()
+        self.__batch: Optional[_Batch] = None
+
+    def __run(self, batch: _Batch) -> None:
+        """Private method: close the batch at the end of its window and attest it"""
+        with self.__condition:
+            self.__condition.wait_for(lambda: len(batch.leaves) >= self.max_size, timeout=self.window)
+            if self.__batch is batch:
+                self.__batch = None
+        try:
+            batch.levels = merkle_levels(batch.leaves)
+            batch.result = self.attest(batch.levels[-1][0])
+            logger.info(f"Attested a batch of {len(batch.leaves)} nonce(s)")
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    def submit(self, nonce: bytes) -> Dict[str, Any]:
+        """Attest with a nonce, blocking until its batch has been quoted
+
+        Args:
+            nonce (bytes): the verifier's nonce
+
+        Returns:
+            Dict[str, Any]: "attestation" (shared by the batch) and "nonce_proof",
+                with the "index" of the nonce's leaf, the "count" of leaves and
+                the sibling hashes ("path") leading to the quoted root
+        """
+        with self.__condition:
+            batch = self.__batch
+            is_leader = batch is None
+            if is_leader:
+                batch = self.__batch = _Batch()
+            index = len(batch.leaves)
+            batch.leaves.append(leaf_hash(nonce))
+            if len(batch.leaves) >= self.max_size:
+                self.__batch = None
+                self.__condition.notify_all()
+
+        if is_leader:
+            self.__run(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+
+        return {
+            "attestation": batch.result,
+            "nonce_proof": {
+                "index": index,
+                "count": len(batch.leaves),
+                "path": inclusion_proof(batch.leaves, index, batch.levels),
+            },
+        }
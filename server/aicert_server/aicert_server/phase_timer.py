@@ -0,0 +1,117 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional
+
+from aicert_server.metrics import BUILD_PHASE_BYTES, BUILD_PHASE_DURATION
+
+logger = logging.getLogger(__name__)
+
+# Whether the phase timings are added to the event log at the end of the build
+MEASURE_PHASE_TIMINGS = os.getenv("AICERT_MEASURE_PHASE_TIMINGS") is not None
+
+
+def disk_usage(path: Path) -> int:
+    """Size of a file, or total size of the files of a directory tree (0 if it does not exist)"""
+    if path.is_file():
+        return path.stat().st_size
+    return sum(
+        (Path(root) / file).lstat().st_size
+        for root, _, files in os.walk(path)
+        for file in files
+    )
+
+
+class Phase:
+    """A running or completed phase of the build
+
+    Attributes:
+        name (str): kind of phase (e.g. "resource_fetch")
+        detail (Optional[str]): what the phase worked on (e.g. the resource path)
+        start (float): wall clock time the phase started at (UNIX timestamp)
+        end (Optional[float]): wall clock time the phase ended at, None while it runs
+        duration (Optional[float]): duration of the phase in seconds, None while it runs
+        bytes (Optional[int]): amount of data processed by the phase, if known
+        error (Optional[str]): error that ended the phase, if any
+    """
+
+    def __init__(self, name: str, detail: Optional[str] = None) -> None:
+        self.name = name
+        self.detail = detail
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.duration: Optional[float] = None
+        self.bytes: Optional[int] = None
+        self.error: Optional[str] = None
+        self.__start_counter = time.perf_counter()
+
+    def finish(self, error: Optional[str] = None) -> None:
+        """Record the end of the phase"""
+        self.duration = time.perf_counter() - self.__start_counter
+        self.end = self.start + self.duration
+        self.error = error
+
+    def dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "detail": self.detail,
+            "start": self.start,
+            "end": self.end,
+            "duration": self.duration,
+            "bytes": self.bytes,
+            "error": self.error,
+        }
+
+
+class PhaseTimer:
+    """Records the phases of a build: start, end, duration and bytes processed
+
+    Phases may run concurrently (e.g. resource fetches) and be nested
+    (e.g. PCR extends within a resource measurement).
+    """
+
+    def __init__(self) -> None:
+        self.__lock = Lock()
+        self.__phases: List[Phase] = []
+
+    @contextmanager
+    def phase(self, name: str, detail: Optional[str] = None) -> Iterator[Phase]:
+        """Time the enclosed block as a phase
+
+        The yielded phase's `bytes` attribute may be set by the block.
+
+        Args:
+            name (str): kind of phase
+            detail (Optional[str]): what the phase works on
+        """
+        phase = Phase(name, detail)
+        with self.__lock:
+            self.__phases.append(phase)
+        try:
+            yield phase
+        except BaseException as e:
+            phase.finish(error=str(e) or type(e).__name__)
+            raise
+        phase.finish()
+        BUILD_PHASE_DURATION.labels(name).observe(phase.duration)
+        if phase.bytes:
+            BUILD_PHASE_BYTES.labels(name).inc(phase.bytes)
+        logger.debug(f"Phase {name} ({detail}) took {phase.duration:.3f}s")
+
+    def report(self) -> Dict[str, Any]:
+        """Return the recorded phases, in start order, and the total duration and bytes of each kind of phase"""
+        with self.__lock:
+            phases = [phase.dict() for phase in self.__phases]
+        totals: Dict[str, Dict[str, Any]] = {}
+        for phase in phases:
+            total = totals.setdefault(phase["name"], {"count": 0, "duration": 0.0, "bytes": 0})
+            total["count"] += 1
+            total["duration"] += phase["duration"] or 0.0
+            total["bytes"] += phase["bytes"] or 0
+        return {"phases": phases, "totals": totals}
+
+
+phase_timer = PhaseTimer()
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import uuid
+from pathlib import Path
+from threading import Lock
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# The cache must live outside of the workspace: the workspace is mounted
+# read-write in the build containers, which must not be able to tamper with it
+RESOURCE_CACHE_DIR = os.getenv("AICERT_RESOURCE_CACHE_DIR")
+RESOURCE_CACHE_MAX_BYTES = int(os.getenv("AICERT_RESOURCE_CACHE_MAX_BYTES", str(200 * 1024**3)))
+
+COMMIT_HASH = re.compile(r"^[0-9a-f]{40}$")
+METADATA_FILE = "aicert_cache_entry.json"
+
+
+def _copy_tree(src: Path, dst: Path) -> None:
+    """Copy a directory tree, sharing data blocks (reflink) when the filesystem supports it
+
+    Hardlinks are deliberately not used: the workspace copy is writable by the
+    build containers and a hardlink would let them modify the cached copy.
+    """
+    subprocess.run(["cp", "-a", "--reflink=auto", str(src), str(dst)], check=True)
+
+
+def _tree_size(path: Path) -> int:
+    return sum(
+        (Path(root) / file).lstat().st_size
+        for root, _, files in os.walk(path)
+        for file in files
+    )
+
+
+class ResourceCache:
+    """On-runner cache of model and dataset clones, addressed by repository and commit
+
+    Each entry is a full checkout (including the git objects and the LFS blobs)
+    of a repository at a pinned commit. Only exact commit hashes are cached, as
+    branch or tag names may move. Entries are evicted, least recently used first,
+    when the total size of the cache exceeds its limit.
+
+    The cache only ever saves the result of a fresh fetch, before any build
+    code has had access to it. Materialised checkouts are measured as usual,
+    once their content has been checked against their commit (see
+    git_fetch.verify_checkout_cmd): entries live on the host and could be
+    tampered with or half-written.
+
+    Args:
+        path (Union[str, Path]): cache directory
+        max_bytes (int): maximum total size of the cached entries
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = RESOURCE_CACHE_MAX_BYTES) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.__lock = Lock()
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def is_cacheable(commit: str) -> bool:
+        """Whether a resource pinned to this revision may be cached"""
+        return COMMIT_HASH.match(commit) is not None
+
+    def __entry(self, repo: str, commit: str) -> Path:
+        """Private method: cache directory of an entry"""
+        return self.path / f"{hashlib.sha256(repo.encode()).hexdigest()[:16]}-{commit}"
+
+    def materialize(self, repo: str, commit: str, destination: Path) -> bool:
+        """Copy a cached checkout to the destination
+
+        Args:
+            repo (str): repository url
+            commit (str): pinned commit hash
+            destination (Path): checkout location, must not exist yet
+
+        Returns:
+            bool: whether the checkout was in the cache
+        """
+        if not self.is_cacheable(commit):
+            return False
+        entry = self.__entry(repo, commit)
+        with self.__lock:
+            if not (entry / METADATA_FILE).exists():
+                return False
+            os.utime(entry / METADATA_FILE)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            _copy_tree(entry / "checkout", destination)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(f"Could not materialise {repo}@{commit} from the resource cache: {e}")
+            shutil.rmtree(destination, ignore_errors=True)
+            return False
+        logger.info(f"Materialised {repo}@{commit} from the resource cache")
+        return True
+
+    def store(self, repo: str, commit: str, checkout: Path) -> None:
+        """Save a freshly fetched checkout in the cache
+
+        Args:
+            repo (str): repository url
+            commit (str): pinned commit hash, which must be the checkout's HEAD
+            checkout (Path): location of the checkout
+        """
+        if not self.is_cacheable(commit):
+            return
+        entry = self.__entry(repo, commit)
+        if (entry / METADATA_FILE).exists():
+            return
+        size = _tree_size(checkout)
+        if size > self.max_bytes:
+            logger.info(f"Not caching {repo}@{commit}: {size} bytes exceed the cache size")
+            return
+
+        staging = self.path / f".staging-{uuid.uuid4()}"
+        try:
+            staging.mkdir()
+            _copy_tree(checkout, staging / "checkout")
+            (staging / METADATA_FILE).write_text(json.dumps({"repo": repo, "commit": commit, "size": size}))
+            with self.__lock:
+                self.__evict(self.max_bytes - size)
+                os.rename(staging, entry)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(f"Could not cache {repo}@{commit}: {e}")
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def evict(self, repo: str, commit: str) -> None:
+        """Remove an entry from the cache, e.g. if its checkout is corrupted
+
+        Args:
+            repo (str): repository url
+            commit (str): pinned commit hash
+        """
+        if not self.is_cacheable(commit):
+            return
+        entry = self.__entry(repo, commit)
+        # Renamed first so that the entry disappears at once
+        trash = self.path / f".staging-{uuid.uuid4()}"
+        with self.__lock:
+            if not entry.exists():
+                return
+            logger.info(f"Evicting {entry.name} from the resource cache")
+            os.rename(entry, trash)
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def __evict(self, max_bytes: int) -> None:
+        """Private method: remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for metadata_file in self.path.glob(f"*/{METADATA_FILE}"):
+            if metadata_file.parent.name.startswith(".staging-"):
+                continue
+            try:
+                metadata = json.loads(metadata_file.read_text())
+                entries.append((metadata_file.stat().st_mtime, metadata["size"], metadata_file.parent))
+            except (OSError, ValueError, KeyError):
+                shutil.rmtree(metadata_file.parent, ignore_errors=True)
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= max_bytes:
+                break
+            logger.info(f"Evicting {entry.name} from the resource cache")
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+resource_cache: Optional[ResourceCache] = (
+    ResourceCache(RESOURCE_CACHE_DIR) if RESOURCE_CACHE_DIR is not None else None
+)
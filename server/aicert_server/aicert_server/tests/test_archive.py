@@ -0,0 +1,106 @@
+import hashlib
+import os
+import pytest
+import zipfile
+
+from aicert_common.merkle import MERKLE_CHUNK_SIZE, leaf_hash, merkle_root
+from aicert_common.protocol import OutputCompression
+from aicert_server.archive import HashingArchiveWriter, ZIP_ZSTANDARD
+
+
+def test_archive_hashes_match_written_data(tmp_path):
+    members = {
+        "lora-out/adapter_model.bin": os.urandom(9 * 1024 * 1024),
+        "lora-out/adapter_config.json": b'{"r": 32}',
+    }
+    for name, data in members.items():
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(data)
+
+    with HashingArchiveWriter(tmp_path / "outputs.zip") as archive:
+        for name in members:
+            archive.write(tmp_path / name, name)
+
+    archive_data = (tmp_path / "outputs.zip").read_bytes()
+    assert archive.sha256 == hashlib.sha256(archive_data).hexdigest()
+    assert archive.members == [
+        (name, hashlib.sha256(data).hexdigest()) for name, data in members.items()
+    ]
+    leaves = [
+        leaf_hash(archive_data[i:i + MERKLE_CHUNK_SIZE])
+        for i in range(0, len(archive_data), MERKLE_CHUNK_SIZE)
+    ]
+    assert archive.manifest.size == len(archive_data)
+    assert archive.manifest.leaves == [leaf.hex() for leaf in leaves]
+    assert archive.manifest.root == merkle_root(leaves).hex()
+    with zipfile.ZipFile(tmp_path / "outputs.zip") as zipf:
+        assert zipf.testzip() is None
+        assert {name: zipf.read(name) for name in zipf.namelist()} == members
+
+
+def _lora_out(tmp_path):
+    files = {
+        "lora-out/adapter_model.safetensors": os.urandom(2 * 1024 * 1024),
+        "lora-out/trainer_state.json": b'{"total_flos": 1.0, "log_history": []}' * 10_000,
+        "lora-out/README.md": b"",
+    }
+    for name, data in files.items():
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(data)
+    return files
+
+
+@pytest.mark.parametrize("codec,threads", [("store", 1), ("deflate", 1), ("deflate", 4), ("zstd", 4)])
+def test_archive_codecs(tmp_path, codec, threads):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    files = _lora_out(tmp_path)
+
+    with HashingArchiveWriter(tmp_path / "outputs.zip", OutputCompression(codec=codec, threads=threads)) as archive:
+        archive.write_all([(tmp_path / name, name) for name in files])
+
+    assert archive.sha256 == hashlib.sha256((tmp_path / "outputs.zip").read_bytes()).hexdigest()
+    assert archive.members == [
+        (name, hashlib.sha256(data).hexdigest()) for name, data in files.items()
+    ]
+    with zipfile.ZipFile(tmp_path / "outputs.zip") as zipf:
+        infos = {info.filename: info for info in zipf.infolist()}
+    # Random weights are always stored, compressible files use the requested codec
+    assert infos["lora-out/adapter_model.safetensors"].compress_type == zipfile.ZIP_STORED
+    assert infos["lora-out/trainer_state.json"].compress_type == {
+        "store": zipfile.ZIP_STORED, "deflate": zipfile.ZIP_DEFLATED, "zstd": ZIP_ZSTANDARD,
+    }[codec]
+    if codec != "zstd":
+        with zipfile.ZipFile(tmp_path / "outputs.zip") as zipf:
+            assert zipf.testzip() is None
+            assert {name: zipf.read(name) for name in zipf.namelist()} == files
+
+
+def test_staged_members_are_bounded_by_threads(tmp_path, monkeypatch):
+    files = {f"lora-out/checkpoint-{i}/config.json": b'{"r": 16}' * 1000 for i in range(20)}
+    for name, data in files.items():
+        (tmp_path / name).parent.mkdir(parents=True)
+        (tmp_path / name).write_bytes(data)
+
+    staged, max_staged = [0], [0]
+    compress = HashingArchiveWriter._HashingArchiveWriter__compress_member
+    write = HashingArchiveWriter._HashingArchiveWriter__write_compressed
+
+    def counting_compress(self, *args):
+        member = compress(self, *args)
+        staged[0] += 1
+        max_staged[0] = max(max_staged[0], staged[0])
+        return member
+
+    def counting_write(self, *args):
+        staged[0] -= 1
+        return write(self, *args)
+
+    monkeypatch.setattr(HashingArchiveWriter, "_HashingArchiveWriter__compress_member", counting_compress)
+    monkeypatch.setattr(HashingArchiveWriter, "_HashingArchiveWriter__write_compressed", counting_write)
+    with HashingArchiveWriter(tmp_path / "outputs.zip", OutputCompression(codec="deflate", threads=3)) as archive:
+        archive.write_all([(tmp_path / name, name) for name in files])
+
+    assert 0 < max_staged[0] <= 3
+    with zipfile.ZipFile(tmp_path / "outputs.zip") as zipf:
+        assert {name: zipf.read(name) for name in zipf.namelist()} == files
@@ -0,0 +1,86 @@
+import hashlib
+import json
+
+from aicert_server import event_log, tpm
+from aicert_server.event_log import EventLog
+from aicert_server.tpm import QuoteCache
+
+
+class FakeBackend:
+    """Records the number of extends each quote covers"""
+    name = "fake"
+
+    def __init__(self):
+        self.extends = 0
+        self.on_quote = None
+
+    def extend_pcr(self, pcr_index, hex_hash_value):
+        self.extends += 1
+
+    def quote(self, qualifying_data=b""):
+        signed = {"message": str(self.extends).encode(), "signature": b"", "pcr": b""}
+        if self.on_quote is not None:
+            on_quote, self.on_quote = self.on_quote, None
+            on_quote()
+        return signed
+
+
+def test_attestation_snapshot_matches_quote(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(tpm, "_tpm_backend", backend)
+    monkeypatch.setattr(tpm, "quote_cache", QuoteCache())
+    monkeypatch.setattr(event_log, "cert_chain", lambda: [])
+    log = EventLog()
+    log.finetune_timing(1.0)
+
+    # An event is committed while the quote is being signed: the first
+    # snapshot is stale and must be taken again
+    backend.on_quote = lambda: log.finetune_flos(2.0)
+    attestation = log.attest()
+
+    quoted_extends = int(attestation["remote_attestation"]["quote"]["message"])
+    assert quoted_extends == len(attestation["event_log"]) == 2
+    assert json.loads(attestation["event_log"][1])["event_type"] == "compute_consumed"
+
+
+def test_snapshots_are_immutable():
+    log = EventLog(simulation_mode=True)
+    log.finetune_timing(1.0)
+    snapshot = log.snapshot()
+    log.finetune_flos(2.0)
+
+    assert len(snapshot.event_log) == 1
+    assert len(log.snapshot().event_log) == 2
+    assert log.snapshot().generation > snapshot.generation
+
+
+def test_events_since_streams_running_pcr_values():
+    log = EventLog(simulation_mode=True)
+    log.finetune_timing(1.0)
+    log.finetune_flos(2.0)
+
+    events = log.events_since(0, timeout=0)
+    assert [event.index for event in events] == [0, 1]
+    pcr = bytes(32)
+    for event in events:
+        pcr = hashlib.sha256(pcr + hashlib.sha256(event.event.encode()).digest()).digest()
+        assert event.pcr == pcr.hex()
+
+    assert log.events_since(1, timeout=0) == events[1:]
+    # Nothing new: the wait times out
+    assert log.events_since(2, timeout=0.01) == []
+
+
+def test_configuration_event_only_measures_the_content_digest():
+    small, large = EventLog(simulation_mode=True), EventLog(simulation_mode=True)
+    small.configuration_event({"base_model": "gpt2"}, "00" * 32)
+    large.configuration_event({"base_model": "gpt2", "datasets": [{"path": f"d{i}"} for i in range(1000)]}, "00" * 32)
+
+    [small_event], [large_event] = small.snapshot().event_log, large.snapshot().event_log
+    assert len(small_event) == len(large_event)
+
+    digest = json.loads(large_event)["content"]["spec"]["content_digest"]
+    content = large.content(digest)
+    assert hashlib.sha256(content).hexdigest() == digest
+    assert len(json.loads(content)["config_file"]["datasets"]) == 1000
+    assert large.content("00" * 32) is None
@@ -0,0 +1,82 @@
+import hashlib
+import os
+
+from aicert_server import hashing
+from aicert_server.hashing import FileHashCache, HashingEngine, sha256_file
+
+
+def test_sha256_file(tmp_path):
+    data = b"aicert" * 500_000
+    path = tmp_path / "weights.bin"
+    path.write_bytes(data)
+
+    assert sha256_file(path, chunk_size=4096) == hashlib.sha256(data).hexdigest()
+    assert sha256_file(path) == hashlib.sha256(data).hexdigest()
+
+
+def test_hash_files_preserves_order(tmp_path):
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"file_{i}"
+        path.write_bytes(bytes([i]) * (i * 1000))
+        paths.append(path)
+
+    result = HashingEngine(max_workers=4).hash_files(paths)
+
+    assert [path for path, _ in result.hashes] == paths
+    assert [hash for _, hash in result.hashes] == [
+        hashlib.sha256(path.read_bytes()).hexdigest() for path in paths
+    ]
+    assert result.bytes_hashed == sum(i * 1000 for i in range(8))
+
+
+def test_cached_hash_is_invalidated_by_changes(tmp_path, monkeypatch):
+    path = tmp_path / "config.yaml"
+    path.write_bytes(b"base_model: llama")
+    engine = HashingEngine(cache=FileHashCache())
+    calls = []
+    monkeypatch.setattr(hashing, "sha256_file", lambda *args: calls.append(args) or sha256_file(*args))
+
+    first = engine.hash_file(path)
+    assert engine.hash_file(path) == first
+    assert len(calls) == 1
+
+    path.write_bytes(b"base_model: falcon")
+    assert engine.hash_file(path) == hashlib.sha256(b"base_model: falcon").hexdigest()
+    assert len(calls) == 2
+
+
+def test_cache_eviction_and_persistence(tmp_path):
+    cache = FileHashCache(max_entries=2, path=tmp_path / "cache.json")
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+
+    # "b" was the least recently used entry
+    assert cache.get("b") is None
+    # Entries are persisted by save() only
+    assert not (tmp_path / "cache.json").exists()
+    cache.save()
+    reloaded = FileHashCache(max_entries=2, path=tmp_path / "cache.json")
+    assert (reloaded.get("a"), reloaded.get("c")) == ("1", "3")
+
+
+def test_batch_saves_the_cache_once(tmp_path, monkeypatch):
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"shard_{i}"
+        path.write_bytes(bytes([i]) * 1000)
+        paths.append(path)
+    cache = FileHashCache(path=tmp_path / "cache.json")
+    writes = []
+    monkeypatch.setattr(hashing.os, "replace", lambda *args: writes.append(args) or os.rename(*args))
+
+    # Hashes computed along with the manifests are cached too
+    result = HashingEngine(max_workers=4, cache=cache).hash_files(paths, manifests=True)
+    assert len(writes) == 1
+    assert [cache.get(hashing._stat_key(path)) for path in paths] == [digest for _, digest in result.hashes]
+    # Cache hits are neither read nor counted as hashed bytes
+    assert result.bytes_hashed == 8 * 1000
+    assert HashingEngine(max_workers=4, cache=cache).hash_files(paths).bytes_hashed == 0
+    assert len(writes) == 1
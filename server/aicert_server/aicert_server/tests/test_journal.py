@@ -0,0 +1,103 @@
+import hashlib
+import json
+
+import pytest
+
+from aicert_server import tpm
+from aicert_server.event_log import EventLog, INITIAL_PCR
+from aicert_server.journal import EventJournal, JournalError
+from aicert_server.tpm import QuoteCache
+
+
+class SoftwarePcrs:
+    """TPM backend keeping the PCR values in memory"""
+    name = "software"
+
+    def __init__(self):
+        self.pcrs = {}
+
+    def extend_pcr(self, pcr_index, hex_hash_value):
+        current = self.pcrs.get(pcr_index, INITIAL_PCR)
+        self.pcrs[pcr_index] = hashlib.sha256(bytes.fromhex(current + hex_hash_value)).hexdigest()
+
+    def read_pcr(self, pcr_index):
+        return self.pcrs.get(pcr_index, INITIAL_PCR)
+
+
+@pytest.fixture
+def pcrs(monkeypatch):
+    backend = SoftwarePcrs()
+    monkeypatch.setattr(tpm, "_tpm_backend", backend)
+    monkeypatch.setattr(tpm, "quote_cache", QuoteCache())
+    return backend
+
+
+def build(journal):
+    log = EventLog(journal=journal)
+    log.configuration_event({"base_model": "gpt2"}, "00" * 32)
+    log.finetune_timing(1.0)
+    log.outputs_event([("model.zip", "11" * 32)])
+    return log
+
+
+def test_torn_record_is_dropped(tmp_path):
+    journal = EventJournal(tmp_path / "journal")
+    journal.append({"pcr_index": 14, "event": "{}"})
+    with open(journal.path, "ab") as file:
+        file.write(b'{"pcr_index": 14, "ev')
+
+    assert EventJournal(journal.path).read() == [{"pcr_index": 14, "event": "{}"}]
+    assert journal.path.read_bytes().endswith(b"}\n")
+
+
+def test_recover_after_restart(tmp_path, pcrs):
+    log = build(EventJournal(tmp_path / "journal"))
+
+    recovered = EventLog(journal=EventJournal(tmp_path / "journal"))
+    assert recovered.recover() == 3
+    assert recovered.snapshot()[:2] == log.snapshot()[:2]
+    assert recovered.events_since(0) == log.events_since(0)
+    digest = json.loads(log.snapshot().event_log[0])["content"]["spec"]["content_digest"]
+    assert recovered.content(digest) == log.content(digest)
+
+
+def test_recover_drops_unextended_event(tmp_path, pcrs):
+    journal = EventJournal(tmp_path / "journal")
+    log = build(journal)
+    journaled = len(journal.read())
+    # Stopped after journaling an event but before extending its PCR
+    journal.append({"pcr_index": 14, "event": json.dumps({"event_type": "timing"})})
+
+    recovered = EventLog(journal=EventJournal(tmp_path / "journal"))
+    assert recovered.recover() == 3
+    assert recovered.snapshot()[:2] == log.snapshot()[:2]
+    assert len(EventJournal(tmp_path / "journal").read()) == journaled
+
+
+def test_recover_rejects_mismatching_journal(tmp_path, pcrs):
+    build(EventJournal(tmp_path / "journal"))
+    pcrs.extend_pcr(14, "22" * 32)
+
+    with pytest.raises(JournalError):
+        EventLog(journal=EventJournal(tmp_path / "journal")).recover()
+
+
+def test_recover_discards_journal_of_previous_boot(tmp_path, pcrs):
+    build(EventJournal(tmp_path / "journal"))
+    pcrs.pcrs.clear()
+
+    assert EventLog(journal=EventJournal(tmp_path / "journal")).recover() == 0
+    assert EventJournal(tmp_path / "journal").read() == []
+
+
+def test_simulation_mode_discards_journal_of_previous_boot(tmp_path):
+    journal = EventJournal(tmp_path / "journal")
+    log = EventLog(simulation_mode=True, journal=journal)
+    log.finetune_timing(1.0)
+
+    # Restart within the same boot
+    assert EventLog(simulation_mode=True, journal=EventJournal(tmp_path / "journal")).recover() == 1
+    rebooted = EventJournal(tmp_path / "journal")
+    rebooted.boot_id = "another-boot"
+    assert EventLog(simulation_mode=True, journal=rebooted).recover() == 0
+    assert EventJournal(tmp_path / "journal").read() == []
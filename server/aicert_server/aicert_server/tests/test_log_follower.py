@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+
+from aicert_server.log_follower import LogFollower
+
+
+def test_new_subscribers_get_the_tail_then_live_batches():
+    follower = LogFollower(tail_lines=2)
+    for line in ("a", "b", "c"):
+        follower.publish(line)
+
+    async def follow():
+        lines = follower.follow()
+        assert await lines.__anext__() == (2, ["b", "c"])
+        # A burst written from another thread is delivered in one batch
+        writer = threading.Thread(target=lambda: [follower.publish(line) for line in ("d", "e", "f")])
+        writer.start()
+        writer.join()
+        batch = await asyncio.wait_for(lines.__anext__(), 1)
+        await lines.aclose()
+        return batch
+
+    assert asyncio.run(follow()) == (5, ["d", "e", "f"])
+
+
+@pytest.mark.parametrize("spill", [True, False])
+def test_resume_after_the_ring_buffer_wrapped(spill, monkeypatch):
+    monkeypatch.setattr("aicert_server.log_follower.CHECKPOINT_INTERVAL", 4)
+    follower = LogFollower(ring_size=5, spill=spill)
+    for i in range(20):
+        follower.publish(f"line {i}")
+
+    # Lines that left the ring buffer are read back from disk, or skipped without spill file
+    start, lines = follower.read(3, max_lines=100)
+    if spill:
+        assert (start, lines) == (3, [f"line {i}" for i in range(3, 15)])
+        assert follower.read(15, max_lines=100) == (15, [f"line {i}" for i in range(15, 20)])
+    else:
+        assert (start, lines) == (15, [f"line {i}" for i in range(15, 20)])
+
+
+def test_resume_from_last_event_id():
+    follower = LogFollower(ring_size=3)
+    follower.publish("a\nb")
+    for line in ("c", "d", "e"):
+        follower.publish(line)
+
+    async def follow(since):
+        batches = []
+        async for last_line, lines in follower.follow(since):
+            batches.append((last_line, lines))
+            if last_line == follower.next_line - 1:
+                return batches
+
+    # Lines of a previous server run (beyond the last one) restart from the first line
+    assert asyncio.run(follow(1)) == [(1, ["b"]), (4, ["c", "d", "e"])]
+    assert asyncio.run(follow(42)) == [(1, ["a", "b"]), (4, ["c", "d", "e"])]
+
+
+def test_spill_file_is_started_over_when_full(monkeypatch):
+    monkeypatch.setattr("aicert_server.log_follower.CHECKPOINT_INTERVAL", 4)
+    # Each line is 8 bytes long with its terminator
+    follower = LogFollower(ring_size=5, spill_max_bytes=120)
+    for i in range(30):
+        follower.publish(f"line {i:02}")
+
+    # The first 15 lines were dropped with the first spill file
+    assert follower.read(0, max_lines=100) == (15, [f"line {i:02}" for i in range(15, 25)])
+    assert follower.read(17, max_lines=2) == (17, ["line 17", "line 18"])
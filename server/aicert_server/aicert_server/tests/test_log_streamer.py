@@ -0,0 +1,102 @@
+import gzip
+import json
+import time
+from unittest.mock import Mock
+
+from aicert_server import log_streamer
+from aicert_server.log_follower import LogFollower
+from aicert_server.log_streamer import JsonLinesLogWriter, LogLineSplitter, LogStreamer, record_matches
+
+
+def test_splitter_handles_chunk_boundaries():
+    splitter = LogLineSplitter()
+    lines = []
+    # "é" is split across chunks, as is the "\r\n" terminator
+    for chunk in (b"caf\xc3", b"\xa9\r", b"\nprogress 1\rprogress 2\r", b"\ndone\n", b"last"):
+        lines.extend(splitter.feed(chunk))
+    lines.extend(splitter.close())
+    assert lines == ["café", "progress 1", "progress 2", "done", "last"]
+
+
+def test_records_are_numbered_json_lines(tmp_path):
+    follower = LogFollower(spill=False)
+    writer = JsonLinesLogWriter(tmp_path / "build.log", follower=follower)
+    writer.write(['quote " and \\ backslash', "ünïcode"], "abc123")
+    writer.write(["oops"], "abc123", stream="stderr")
+    writer.write_eof()
+
+    records = [json.loads(line) for line in (tmp_path / "build.log").read_text().splitlines()]
+    assert [record["seq"] for record in records] == [0, 1, 2, 3]
+    assert records[0]["message"] == 'quote " and \\ backslash'
+    assert (records[2]["container"], records[2]["stream"]) == ("abc123", "stderr")
+    assert records[3]["eof"] is True
+    # Records are published to the follower as written
+    assert follower.read(0) == (0, (tmp_path / "build.log").read_text().splitlines())
+
+
+def test_buffered_records_are_flushed_periodically(tmp_path):
+    writer = JsonLinesLogWriter(tmp_path / "build.log", follower=None, flush_interval=0.05)
+    writer.write(["line"])
+    deadline = time.monotonic() + 5
+    while not (tmp_path / "build.log").read_text() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert json.loads((tmp_path / "build.log").read_text())["message"] == "line"
+
+
+def test_rotated_segments_are_compressed_and_expired(tmp_path):
+    writer = JsonLinesLogWriter(tmp_path / "build.log", follower=None, max_bytes=200, backup_count=2)
+    for i in range(20):
+        writer.write([f"line {i:02}" + "x" * 50])
+    writer.flush()
+
+    deadline = time.monotonic() + 5
+    while (
+        list(tmp_path.glob("build.log.*[0-9]")) or len(list(tmp_path.glob("build.log.*"))) != 2
+    ) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    segments = sorted(tmp_path.glob("build.log.*"), key=lambda segment: int(segment.name.split(".")[2]))
+    # Only the last two segments are kept
+    last = int(segments[-1].name.split(".")[2])
+    assert [segment.name for segment in segments] == [f"build.log.{last - 1}.gz", f"build.log.{last}.gz"]
+
+    # No record is lost between the last segment and the log file
+    lines = gzip.decompress(segments[-1].read_bytes()).decode().splitlines()
+    lines += (tmp_path / "build.log").read_text().splitlines()
+    seqs = [json.loads(line)["seq"] for line in lines]
+    assert seqs == list(range(seqs[0], 20))
+
+
+class FakeContainer:
+    short_id = "abc123"
+
+    def attach(self, **kwargs):
+        assert kwargs["demux"] and kwargs["stdout"] and kwargs["stderr"]
+        return iter([(b"step 1/2\nstep", None), (None, b"Warning: no GPU\n"), (b" 2/2\n", b"Traceback")])
+
+
+def test_streams_are_captured_separately(tmp_path, monkeypatch):
+    labels = []
+    monkeypatch.setattr(log_streamer.DOCKER_RUN_DURATION, "labels", lambda image: labels.append(image) or Mock())
+    follower = LogFollower(spill=False)
+    streamer = LogStreamer(tmp_path / "log_training.log", "training", image="axolotl:latest")
+    streamer.writer.follower = follower
+    streamer.write_stream(FakeContainer(), last_stream=True)
+
+    records = [json.loads(line) for line in (tmp_path / "log_training.log").read_text().splitlines()]
+    assert [(record.get("stream"), record.get("message")) for record in records] == [
+        ("stdout", "step 1/2"),
+        ("stderr", "Warning: no GPU"),
+        ("stdout", "step 2/2"),
+        ("stderr", "Traceback"),
+        (None, None),
+    ]
+    assert {record.get("phase") for record in records[:-1]} == {"training"}
+    # The run is timed under the image name used to start it
+    assert labels == ["axolotl:latest"]
+
+    # Subscribers may follow a single phase and stream, the end of the logs included
+    _, lines = follower.read(0)
+    assert [json.loads(line).get("message") for line in lines if record_matches(line, "training", "stderr")] == [
+        "Warning: no GPU", "Traceback", None,
+    ]
+    assert [line for line in lines if record_matches(line, "resource_fetch")] == lines[-1:]
@@ -0,0 +1,29 @@
+import pytest
+
+from aicert_server.metrics import tpm_operation, _NoopMetric, _metric
+
+prometheus_client = pytest.importorskip("prometheus_client")
+
+
+def sample(name, labels):
+    return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_tpm_operations_are_counted_by_outcome():
+    labels = {"operation": "quote", "backend": "test"}
+    before = sample("aicert_tpm_operations_total", {**labels, "outcome": "error"})
+    with pytest.raises(RuntimeError):
+        with tpm_operation("quote", "test"):
+            raise RuntimeError("TPM busy")
+    with tpm_operation("quote", "test"):
+        pass
+
+    assert sample("aicert_tpm_operations_total", {**labels, "outcome": "error"}) == before + 1
+    assert sample("aicert_tpm_operations_total", {**labels, "outcome": "success"}) >= 1
+    assert sample("aicert_tpm_operation_duration_seconds_count", labels) >= 2
+
+
+def test_metrics_are_noops_without_prometheus_client():
+    metric = _metric(None, "unused", "unused", ["label"])
+    assert isinstance(metric, _NoopMetric)
+    metric.labels("value").observe(1.0)
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from aicert_common.merkle import leaf_hash, root_from_proof
+from aicert_server.nonce_batch import NonceBatcher
+
+
+def test_concurrent_nonces_share_a_quote():
+    quoted = []
+    batcher = NonceBatcher(lambda root: quoted.append(root) or {"quote": root}, window=0.2)
+    nonces = [bytes([i]) * 32 for i in range(16)]
+
+    with ThreadPoolExecutor(max_workers=len(nonces)) as executor:
+        results = list(executor.map(batcher.submit, nonces))
+
+    assert len(quoted) == 1
+    for nonce, result in zip(nonces, results):
+        proof = result["nonce_proof"]
+        assert proof["count"] == len(nonces)
+        root = root_from_proof(leaf_hash(nonce), proof["index"], proof["count"], proof["path"])
+        assert root == result["attestation"]["quote"] == quoted[0]
+
+
+def test_full_batches_are_quoted_without_waiting():
+    quoted = []
+    batcher = NonceBatcher(lambda root: quoted.append(root), window=60, max_size=1)
+
+    batcher.submit(b"nonce")
+    batcher.submit(b"other nonce")
+    assert quoted == [leaf_hash(b"nonce"), leaf_hash(b"other nonce")]
+
+
+def test_errors_reach_every_requester():
+    def attest(root):
+        raise RuntimeError("TPM failure")
+
+    batcher = NonceBatcher(attest, window=0.1)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(batcher.submit, bytes([i])) for i in range(4)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result()
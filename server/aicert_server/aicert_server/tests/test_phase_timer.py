@@ -0,0 +1,39 @@
+import pytest
+
+from aicert_server.phase_timer import PhaseTimer, disk_usage
+
+
+def test_report_records_phases_and_totals():
+    timer = PhaseTimer()
+    with timer.phase("resource_fetch", "model") as phase:
+        phase.bytes = 10
+    with timer.phase("resource_fetch", "dataset") as phase:
+        phase.bytes = 5
+    with pytest.raises(RuntimeError):
+        with timer.phase("training"):
+            raise RuntimeError("out of memory")
+
+    report = timer.report()
+    assert [(p["name"], p["detail"]) for p in report["phases"]] == [
+        ("resource_fetch", "model"), ("resource_fetch", "dataset"), ("training", None)
+    ]
+    assert all(p["end"] >= p["start"] and p["duration"] >= 0 for p in report["phases"])
+    assert report["phases"][2]["error"] == "out of memory"
+    assert report["totals"]["resource_fetch"]["count"] == 2
+    assert report["totals"]["resource_fetch"]["bytes"] == 15
+
+
+def test_running_phases_are_reported():
+    timer = PhaseTimer()
+    with timer.phase("training"):
+        [running] = timer.report()["phases"]
+        assert running["end"] is None and running["duration"] is None
+
+
+def test_disk_usage(tmp_path):
+    (tmp_path / "a").write_bytes(b"x" * 3)
+    (tmp_path / "dir").mkdir()
+    (tmp_path / "dir" / "b").write_bytes(b"x" * 4)
+    assert disk_usage(tmp_path / "a") == 3
+    assert disk_usage(tmp_path) == 7
+    assert disk_usage(tmp_path / "missing") == 0
@@ -0,0 +1,51 @@
+from aicert_server.resource_cache import METADATA_FILE, ResourceCache
+
+REPO = "https://huggingface.co/codellama/CodeLlama-7b-hf"
+COMMIT = "7f22f0a5f7991355a2c3867923359ec4ed0b58bf"
+
+
+def _checkout(path, size):
+    (path / ".git").mkdir(parents=True)
+    (path / ".git" / "HEAD").write_text(COMMIT)
+    (path / "model.safetensors").write_bytes(b"\0" * size)
+    return path
+
+
+def test_materialize_cached_checkout(tmp_path):
+    cache = ResourceCache(tmp_path / "cache")
+    assert not cache.materialize(REPO, COMMIT, tmp_path / "workspace" / "model")
+
+    cache.store(REPO, COMMIT, _checkout(tmp_path / "fetched", 1000))
+    assert cache.materialize(REPO, COMMIT, tmp_path / "workspace" / "model")
+    assert (tmp_path / "workspace" / "model" / "model.safetensors").read_bytes() == b"\0" * 1000
+
+    # Writes to the materialised checkout do not reach the cache
+    (tmp_path / "workspace" / "model" / "model.safetensors").write_bytes(b"tampered")
+    assert cache.materialize(REPO, COMMIT, tmp_path / "other" / "model")
+    assert (tmp_path / "other" / "model" / "model.safetensors").read_bytes() == b"\0" * 1000
+
+
+def test_only_commit_hashes_are_cached(tmp_path):
+    cache = ResourceCache(tmp_path / "cache")
+    cache.store(REPO, "main", _checkout(tmp_path / "fetched", 10))
+    assert not list((tmp_path / "cache").glob(f"*/{METADATA_FILE}"))
+
+
+def test_size_based_eviction(tmp_path):
+    cache = ResourceCache(tmp_path / "cache", max_bytes=2500)
+    commits = [str(i) * 40 for i in range(3)]
+    for commit in commits:
+        cache.store(REPO, commit, _checkout(tmp_path / commit, 1000))
+
+    assert not cache.materialize(REPO, commits[0], tmp_path / "a")
+    assert cache.materialize(REPO, commits[1], tmp_path / "b")
+    assert cache.materialize(REPO, commits[2], tmp_path / "c")
+
+
+def test_evict_corrupted_entry(tmp_path):
+    cache = ResourceCache(tmp_path / "cache")
+    cache.store(REPO, COMMIT, _checkout(tmp_path / "fetched", 10))
+    cache.evict(REPO, COMMIT)
+
+    assert not cache.materialize(REPO, COMMIT, tmp_path / "workspace" / "model")
+    assert not list((tmp_path / "cache").iterdir())
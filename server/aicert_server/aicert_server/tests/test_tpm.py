@@ -0,0 +1,131 @@
+import hashlib
+import shutil
+import socket
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+
+from aicert_server import tpm
+from aicert_server.tpm import QuoteCache, TpmCliBackend, TpmEsapiBackend, _serialize_pcrs
+
+
+def test_serialize_pcrs_layout():
+    groups = [[bytes([pcr]) * 32 for pcr in range(start, start + 8)] for start in (0, 8, 16)]
+
+    serialized = _serialize_pcrs(list(range(24)), groups)
+
+    # TPML_PCR_SELECTION, UINT32 count, 3 TPML_DIGEST
+    assert len(serialized) == 132 + 4 + 3 * 532
+    assert serialized[:12] == bytes.fromhex("01000000" "0b00" "03" "ffffff00" "00")
+    assert serialized[132:136] == bytes.fromhex("03000000")
+    # Count of the second TPML_DIGEST, then its first TPM2B_DIGEST (PCR 8)
+    second = 136 + 532
+    assert serialized[second:second + 4] == bytes.fromhex("08000000")
+    assert serialized[second + 4:second + 6] == bytes.fromhex("2000")
+    assert serialized[second + 6:second + 38] == bytes([8]) * 32
+
+
+def test_der_length_ignores_nv_padding():
+    der = bytes.fromhex("3082010a") + bytes(266)
+
+    assert tpm._der_length(der + bytes(100)) == len(der)
+    assert tpm._der_length(bytes.fromhex("3003020101ff")) == 5
+    with pytest.raises(ValueError):
+        tpm._der_length(bytes(16))
+
+
+def test_invalid_cert_chain_is_reported(monkeypatch):
+    monkeypatch.setattr(tpm, "_cert_chain", None)
+    monkeypatch.setattr(tpm, "_cert_chain_error", None)
+    monkeypatch.setattr(tpm, "AZURE_CERTS_DIR", Path(tpm.__file__).parent / "Azure_TPM_certs")
+    monkeypatch.setattr(tpm, "tpm_nvread", lambda index: b"\xff" * 1024)
+
+    with pytest.raises(ValueError):
+        tpm.load_cert_chain()
+    status = tpm.cert_chain_status()
+    assert not status["ready"]
+    assert "Invalid AIK certificate chain" in status["error"]
+
+
+class FakeBackend:
+    name = "fake"
+
+    def __init__(self):
+        self.quotes = 0
+
+    def extend_pcr(self, pcr_index, hex_hash_value):
+        pass
+
+    def quote(self, qualifying_data=b""):
+        self.quotes += 1
+        return {"message": qualifying_data, "signature": bytes([self.quotes]), "pcr": b""}
+
+
+def test_quote_cache_is_invalidated_by_extends(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(tpm, "_tpm_backend", backend)
+    monkeypatch.setattr(tpm, "quote_cache", QuoteCache())
+
+    first = tpm.quote()
+    assert tpm.quote() is first
+    assert backend.quotes == 1
+
+    tpm.tpm_extend_pcr(tpm.PCR_FOR_MEASUREMENT, "00" * 32)
+    assert tpm.quote() is not first
+    assert backend.quotes == 2
+
+
+def test_nonce_bypasses_quote_cache(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(tpm, "_tpm_backend", backend)
+    monkeypatch.setattr(tpm, "quote_cache", QuoteCache())
+
+    tpm.quote()
+    assert tpm.quote(b"nonce")["message"] == b"nonce"
+    assert tpm.quote(b"nonce")["message"] == b"nonce"
+    assert backend.quotes == 3
+    # The nonce'd quotes did not replace the cached one
+    tpm.quote()
+    assert backend.quotes == 3
+
+
+@pytest.fixture
+def swtpm_tcti(tmp_path):
+    """A TPM simulator, skipped when swtpm is not installed"""
+    if shutil.which("swtpm") is None:
+        pytest.skip("swtpm is not installed")
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    # fmt:off
+    process = subprocess.Popen(["swtpm", "socket", "--tpm2",
+                                "--server", f"type=tcp,port={port}",
+                                "--ctrl", f"type=tcp,port={port + 1}",
+                                "--tpmstate", f"dir={tmp_path}",
+                                "--flags", "not-need-init,startup-clear"])
+    # fmt:on
+    time.sleep(0.5)
+    yield f"swtpm:host=localhost,port={port}"
+    process.terminate()
+    process.wait()
+
+
+def test_backends_agree_on_extend_and_read(swtpm_tcti):
+    if tpm.ESAPI is None:
+        pytest.skip("tpm2-pytss is not installed")
+    esapi = TpmEsapiBackend(swtpm_tcti)
+    pcr = 16
+    expected = esapi.read_pcr(pcr)
+    backends = [esapi]
+    if shutil.which("tpm2_pcrextend") is not None:
+        backends.append(TpmCliBackend(swtpm_tcti))
+
+    for i, backend in enumerate(backends * 2):
+        event = hashlib.sha256(f"event {i}".encode()).hexdigest()
+        backend.extend_pcr(pcr, event)
+        expected = hashlib.sha256(bytes.fromhex(expected) + bytes.fromhex(event)).hexdigest()
+        tpm_value = backends[-1 - i % len(backends)].read_pcr(pcr)
+        assert tpm_value == expected
+    esapi.close()
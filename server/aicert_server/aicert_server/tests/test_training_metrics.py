@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+from aicert_server import training_metrics as training_metrics_module
+from aicert_server.training_metrics import TrainingMetrics, throughput_factors
+
+OUTPUT = [
+    "Loading checkpoint shards:  50%|█████     | 1/2 [00:03<00:03,  3.10s/it]",
+    "  0%|          | 0/100 [00:00<?, ?it/s]",
+    "  1%|          | 1/100 [00:04<07:55,  4.80s/it]",
+    "  2%|▏         | 2/100 [00:08<07:00,  4.00s/it]",
+    "{'loss': 1.4821, 'grad_norm': 0.52, 'learning_rate': 2e-05, 'epoch': 0.02}",
+    # Evaluation loop
+    " 50%|█████     | 3/6 [00:01<00:01,  2.50it/s]",
+    "  3%|▎         | 3/100 [00:10<06:00,  0.50it/s]",
+    "{'loss': 1.2013, 'grad_norm': 0.47, 'learning_rate': 1.9e-05, 'epoch': 0.03}",
+    "{'train_runtime': 600.5, 'train_samples_per_second': 1.33, 'train_loss': 1.3, 'epoch': 0.03}",
+]
+
+
+def test_throughput_factors():
+    assert throughput_factors({"micro_batch_size": 2, "gradient_accumulation_steps": 4}) == (8, None)
+    assert throughput_factors({"micro_batch_size": 2, "sample_packing": True, "sequence_len": 4096}) == (2, 8192)
+
+
+def test_metrics_are_extracted_from_the_training_output():
+    metrics = TrainingMetrics()
+    metrics.reset(samples_per_step=8, tokens_per_step=8 * 4096)
+    for line in OUTPUT:
+        metrics.feed(line)
+
+    _, lines = metrics.follower.read(0)
+    points = [json.loads(line) for line in lines]
+    assert [(point["step"], point["loss"]) for point in points] == [
+        (1, None), (2, None), (2, 1.4821), (3, 1.4821), (3, 1.2013), (3, 1.2013),
+    ]
+    assert points[1]["samples_per_second_per_device"] == 8 / 4.0
+    assert points[3]["tokens_per_second_per_device"] == 0.5 * 8 * 4096
+
+    summary = metrics.summary()
+    assert summary["completed"]
+    assert (summary["step"], summary["total_steps"], summary["epoch"]) == (3, 100, 0.03)
+    assert (summary["loss"], summary["min_loss"]) == (1.2013, 1.2013)
+    assert summary["learning_rate"] == 1.9e-05
+    assert summary["samples_per_second_per_device"] == {"mean": (8 / 4.8 + 2 + 4) / 3, "min": 8 / 4.8, "max": 4}
+    assert summary["tokens_per_second_per_device"]["max"] == 4 * 4096
+    assert summary["train"] == {"train_runtime": 600.5, "train_samples_per_second": 1.33, "train_loss": 1.3}
+
+
+def test_interrupted_run_is_not_completed():
+    metrics = TrainingMetrics()
+    metrics.reset(samples_per_step=8)
+    for line in OUTPUT[:5]:
+        metrics.feed(line)
+
+    summary = metrics.summary()
+    assert not summary["completed"]
+    assert (summary["step"], summary["total_steps"], summary["train"]) == (2, 100, {})
+    # Tokens per second are unknown without sample packing
+    assert summary["tokens_per_second_per_device"] is None
+
+
+def test_subscribers_are_counted_apart_from_the_build_status(monkeypatch):
+    counts = {}
+
+    class Gauge:
+        def __init__(self, name):
+            self.name = name
+
+        def inc(self):
+            counts[self.name] = counts.get(self.name, 0) + 1
+
+        def dec(self):
+            counts[self.name] -= 1
+
+    monkeypatch.setattr(training_metrics_module, "TRAINING_METRICS_SUBSCRIBERS", Gauge("training_metrics"))
+    metrics = TrainingMetrics()
+    metrics.reset()
+    metrics.feed(OUTPUT[2])
+
+    async def follow():
+        points = metrics.follower.follow()
+        await points.__anext__()
+        assert counts == {"training_metrics": 1}
+        await points.aclose()
+
+    asyncio.run(follow())
+    assert counts == {"training_metrics": 0}
@@ -1,19 +1,71 @@
 #!/usr/bin/python3
 
-import json
+import logging
+import os
+import struct
 import tempfile
+import time
 import requests
 import hashlib
 import subprocess
-import subprocess
 import yaml
-import subprocess
-from typing import List, Dict, Any
+from cryptography import x509
+from pathlib import Path
+from contextlib import contextmanager
+from threading import Lock, RLock
+from typing import Callable, ContextManager, Iterator, List, Dict, Any, Optional, Tuple, TypeVar
+
+try:
+    from tpm2_pytss import (
+        ESAPI,
+        ESYS_TR,
+        TPM2_ALG,
+        TPML_DIGEST_VALUES,
+        TPML_PCR_SELECTION,
+        TPMS_PCR_SELECTION,
+        TPMT_HA,
+        TPMT_SIG_SCHEME,
+        TPMU_HA,
+    )
+except ImportError:
+    ESAPI = None
 
+from aicert_server.metrics import tpm_operation
+
+logger = logging.getLogger(__name__)
 
 PCR_FOR_MEASUREMENT = 14
 PCR_FOR_OUTPUT_MEASUREMENT = 8
 
+# "esapi" keeps a single in-process ESAPI context open for the lifetime of the server,
+# "cli" spawns a tpm2-tools process per operation,
+# "auto" uses the ESAPI backend when tpm2-pytss is installed and the TPM can be opened
+TPM_BACKEND = os.getenv("AICERT_TPM_BACKEND", "auto")
+# TCTI configuration string in the tpm2-tools format (e.g. "device:/dev/tpmrm0" or
+# "swtpm:host=localhost,port=2321"), shared by both backends; the TSS default is used if unset
+TPM_TCTI = os.getenv("AICERT_TPM_TCTI", os.getenv("TPM2TOOLS_TCTI"))
+
+AIK_PUB_INDEX = 0x81000003
+AIK_CERT_INDEX = 0x01C101D0
+AZURE_CERTS_DIR = Path("Azure_TPM_certs")
+ROOT_CERT_FILE = "Azure Virtual TPM Root Certificate Authority 2023.crt"
+INTERMEDIATE_CERT_FILE = "intermediate_ca.crt"
+QUOTED_PCRS = list(range(24))
+
+# Layout of the PCR values written by tpm2_quote --pcr (tpm2-tools "serialized" format):
+# the native TSS structures TPML_PCR_SELECTION, a UINT32 count and count TPML_DIGEST
+_PCR_SELECT_MAX = 4
+_PCR_SELECTIONS_MAX = 16
+_DIGESTS_MAX = 8
+_DIGEST_BUFFER_SIZE = 64
+_NV_READ_CHUNK_SIZE = 512
+# Qualifying data is a TPM2B_DATA, large enough for a hash algorithm and a 64 byte digest
+MAX_QUALIFYING_DATA_SIZE = 64
+# Wait between two checks for the end of a PCR update when taking an attested snapshot
+UPDATE_POLL_INTERVAL = 0.005
+
+T = TypeVar("T")
+
 
 def sha256_file(file_path: str) -> str:
     sha256_hash = hashlib.sha256()
@@ -23,10 +75,348 @@ def sha256_file(file_path: str) -> str:
     return sha256_hash.hexdigest()
 
 
+def _serialize_pcrs(pcrs: List[int], digest_groups: List[List[bytes]]) -> bytes:
+    """Serialize SHA256 PCR values in the format of tpm2_quote's --pcr output
+
+    Args:
+        pcrs (List[int]): quoted PCR indices
+        digest_groups (List[List[bytes]]): PCR values, grouped as returned
+            by successive TPM2_PCR_Read commands
+
+    Returns:
+        bytes: a TPML_PCR_SELECTION, a UINT32 count and count TPML_DIGEST,
+            laid out as in memory (little endian, with padding)
+    """
+    select = bytearray(_PCR_SELECT_MAX)
+    for pcr in pcrs:
+        select[pcr // 8] |= 1 << (pcr % 8)
+    # TPMS_PCR_SELECTION: UINT16 hash, UINT8 sizeofSelect, BYTE pcrSelect[4], 1 byte of padding
+    selection = struct.pack("<HB4sx", 0x000B, 3, bytes(select))
+    serialized = struct.pack("<I", 1) + selection + bytes(8 * (_PCR_SELECTIONS_MAX - 1))
+
+    serialized += struct.pack("<I", len(digest_groups))
+    for digests in digest_groups:
+        serialized += struct.pack("<I", len(digests))
+        for i in range(_DIGESTS_MAX):
+            digest = digests[i] if i < len(digests) else b""
+            # TPM2B_DIGEST: UINT16 size, BYTE buffer[sizeof(TPMU_HA)]
+            serialized += struct.pack("<H", len(digest)) + digest.ljust(_DIGEST_BUFFER_SIZE, b"\x00")
+    return serialized
+
+
+class TpmCliBackend:
+    """TPM operations performed by spawning tpm2-tools processes
+
+    Args:
+        tcti (str, optional): TCTI configuration string passed to tpm2-tools
+    """
+
+    name = "cli"
+
+    def __init__(self, tcti: Optional[str] = TPM_TCTI) -> None:
+        self.__env = {**os.environ, "TPM2TOOLS_TCTI": tcti} if tcti is not None else None
+
+    def __run(self, args: List[str], **kwargs) -> subprocess.CompletedProcess:
+        """Private method: run a tpm2-tools command"""
+        return subprocess.run(args, check=True, env=self.__env, **kwargs)
+
+    def nv_read(self, nv_index: int) -> bytes:
+        return self.__run(["tpm2_nvread", "-Co", hex(nv_index)], capture_output=True).stdout
+
+    def extend_pcr(self, pcr_index: int, hex_hash_value: str) -> None:
+        self.__run(["tpm2_pcrextend", f"{pcr_index}:sha256={hex_hash_value}"])
+
+    def read_pcr(self, pcr_index: int) -> str:
+        tpm2_pcrread = self.__run(
+            ["tpm2_pcrread", f"sha256:{pcr_index}"],
+            capture_output=True,
+            text=True,
+        )
+        pcrread_output = yaml.load(tpm2_pcrread.stdout, Loader=yaml.BaseLoader)
+        # The result we get from tpm2_pcrread is something in this format '0x31A6F553CC0F9FC156877E35D35CA63AD9514A67C1B231B73665127CD6867631'
+        # This format is not the same as the one output by python hashlib .hexdigest() function
+        # so we transform it so that it is in this format '31a6f553cc0f9fc156877e35d35ca63ad9514a67c1b231b73665127cd6867631'
+        return pcrread_output["sha256"][str(pcr_index)].lower().removeprefix("0x")
+
+    def quote(self, qualifying_data: bytes = b"") -> Dict[str, bytes]:
+        print("starting quote generation")
+        with (
+            tempfile.NamedTemporaryFile() as quote_msg_file,
+            tempfile.NamedTemporaryFile() as quote_sig_file,
+            tempfile.NamedTemporaryFile() as quote_pcr_file,
+        ):
+            # fmt:off
+            self.__run(["tpm2_quote", "--quiet",
+                        "--key-context", hex(AIK_PUB_INDEX),
+                        "--pcr-list", "sha256:" + ",".join(str(pcr) for pcr in QUOTED_PCRS),
+                        "--message" , quote_msg_file.name,
+                        "--signature", quote_sig_file.name,
+                        "--pcr", quote_pcr_file.name,
+                        "--hash-algorithm", "sha256",
+                        *(["--qualification", qualifying_data.hex()] if qualifying_data else [])])
+            # fmt:on
+
+            quote_msg = quote_msg_file.read()
+            quote_sig = quote_sig_file.read()
+            quote_pcr = quote_pcr_file.read()
+        print("finished quote generation")
+
+        return {"message": quote_msg, "signature": quote_sig, "pcr": quote_pcr}
+
+
+class TpmEsapiBackend:
+    """TPM operations performed in-process through a long-lived ESAPI context (tpm2-pytss)
+
+    The context, the AIK handle and its signing scheme are set up once, which
+    saves a process spawn, a TCTI connection and the handle loading on every
+    operation. ESAPI contexts are not thread-safe, so commands are serialized.
+
+    The quote is returned in the same formats as tpm2_quote's, so that clients
+    can verify it with tpm2_checkquote regardless of the backend.
+
+    Args:
+        tcti (str, optional): TCTI configuration string, in the tpm2-tools format
+    """
+
+    name = "esapi"
+
+    def __init__(self, tcti: Optional[str] = TPM_TCTI) -> None:
+        if ESAPI is None:
+            raise RuntimeError("The ESAPI TPM backend requires the tpm2-pytss package")
+        self.__lock = Lock()
+        self.__ectx = ESAPI(tcti)
+        self.__aik: Optional[ESYS_TR] = None
+        self.__aik_scheme: Optional[TPMT_SIG_SCHEME] = None
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__ectx.close()
+
+    def __load_aik(self) -> None:
+        """Private method: load the AIK handle and choose its signing scheme, like tpm2_quote does"""
+        if self.__aik is not None:
+            return
+        self.__aik = self.__ectx.tr_from_tpmpublic(AIK_PUB_INDEX)
+        public, _, _ = self.__ectx.read_public(self.__aik)
+        area = public.publicArea
+        if area.type == TPM2_ALG.RSA:
+            key_scheme, default_scheme = area.parameters.rsaDetail.scheme.scheme, TPM2_ALG.RSASSA
+        else:
+            key_scheme, default_scheme = area.parameters.eccDetail.scheme.scheme, TPM2_ALG.ECDSA
+        if key_scheme == TPM2_ALG.NULL:
+            scheme = TPMT_SIG_SCHEME(scheme=default_scheme)
+            scheme.details.any.hashAlg = TPM2_ALG.SHA256
+        else:
+            # Restricted keys can only sign with their own scheme
+            scheme = TPMT_SIG_SCHEME(scheme=TPM2_ALG.NULL)
+        self.__aik_scheme = scheme
+
+    def __read_pcrs(self, pcrs: List[int]) -> List[List[bytes]]:
+        """Private method: read SHA256 PCR values, grouped by TPM2_PCR_Read command
+
+        A TPM returns at most 8 digests per command, so the remaining selection
+        is read again until every PCR has been returned, as tpm2-tools does.
+        """
+        remaining = sorted(pcrs)
+        groups = []
+        while remaining:
+            selection = TPML_PCR_SELECTION([TPMS_PCR_SELECTION(hash=TPM2_ALG.SHA256, pcrs=remaining)])
+            _, _, digests = self.__ectx.pcr_read(selection)
+            values = [bytes(digest) for digest in digests.digests]
+            if not values:
+                raise RuntimeError(f"The TPM did not return the values of PCRs {remaining}")
+            groups.append(values)
+            # Digests are returned in ascending PCR order
+            remaining = remaining[len(values):]
+        return groups
+
+    def nv_read(self, nv_index: int) -> bytes:
+        with self.__lock:
+            handle = self.__ectx.tr_from_tpmpublic(nv_index)
+            try:
+                nv_public, _ = self.__ectx.nv_read_public(handle)
+                size = nv_public.nvPublic.dataSize
+                data = b""
+                while len(data) < size:
+                    chunk = self.__ectx.nv_read(
+                        handle,
+                        min(_NV_READ_CHUNK_SIZE, size - len(data)),
+                        offset=len(data),
+                        auth_handle=ESYS_TR.OWNER,
+                    )
+                    data += bytes(chunk)
+            finally:
+                self.__ectx.tr_close(handle)
+        return data
+
+    def extend_pcr(self, pcr_index: int, hex_hash_value: str) -> None:
+        digest = bytes.fromhex(hex_hash_value.removeprefix("0x"))
+        digests = TPML_DIGEST_VALUES([TPMT_HA(hashAlg=TPM2_ALG.SHA256, digest=TPMU_HA(sha256=digest))])
+        with self.__lock:
+            self.__ectx.pcr_extend(ESYS_TR(pcr_index), digests)
+
+    def read_pcr(self, pcr_index: int) -> str:
+        with self.__lock:
+            [[value]] = self.__read_pcrs([pcr_index])
+        return value.hex()
+
+    def quote(self, qualifying_data: bytes = b"") -> Dict[str, bytes]:
+        with self.__lock:
+            self.__load_aik()
+            selection = TPML_PCR_SELECTION([TPMS_PCR_SELECTION(hash=TPM2_ALG.SHA256, pcrs=QUOTED_PCRS)])
+            quoted, signature = self.__ectx.quote(self.__aik, selection, qualifying_data, in_scheme=self.__aik_scheme)
+            # As tpm2_quote, read the PCR values after the quote to send them along
+            digest_groups = self.__read_pcrs(QUOTED_PCRS)
+
+        return {
+            "message": bytes(quoted),
+            "signature": signature.marshal(),
+            "pcr": _serialize_pcrs(QUOTED_PCRS, digest_groups),
+        }
+
+
+class InstrumentedTpmBackend:
+    """Counts and times the operations of a TPM backend (see metrics)
+
+    Args:
+        backend: the TPM backend (TpmCliBackend or TpmEsapiBackend)
+    """
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+        self.name = backend.name
+
+    def nv_read(self, nv_index: int) -> bytes:
+        with tpm_operation("nv_read", self.name):
+            return self.backend.nv_read(nv_index)
+
+    def extend_pcr(self, pcr_index: int, hex_hash_value: str) -> None:
+        with tpm_operation("extend_pcr", self.name):
+            self.backend.extend_pcr(pcr_index, hex_hash_value)
+
+    def read_pcr(self, pcr_index: int) -> str:
+        with tpm_operation("read_pcr", self.name):
+            return self.backend.read_pcr(pcr_index)
+
+    def quote(self, qualifying_data: bytes = b"") -> Dict[str, bytes]:
+        with tpm_operation("quote", self.name):
+            return self.backend.quote(qualifying_data)
+
+
+class QuoteCache:
+    """Reuse the last signed quote as long as no PCR was extended since
+
+    PCR updates are tracked by a generation counter used as a sequence lock:
+    it is bumped when an update starts (becoming odd) and when it completes
+    (becoming even again). A quote produced while the generation stayed the
+    same even value covers exactly the extends of that generation, and only
+    such quotes are cached and served for it. Concurrent cache misses wait
+    for a single quote instead of each signing one.
+
+    Quotes with qualifying data (a verifier's nonce) are never cached.
+    """
+
+    def __init__(self) -> None:
+        self.__lock = Lock()
+        self.__quote_lock = Lock()
+        self.__update_lock = RLock()
+        self.__update_depth = 0
+        self.__generation = 0
+        self.__quote: Optional[Dict[str, bytes]] = None
+        self.__quote_generation = -1
+
+    @property
+    def generation(self) -> int:
+        return self.__generation
+
+    @contextmanager
+    def pcr_update(self) -> Iterator[None]:
+        """Context manager around PCR extends (and the state that records them)
+
+        Updates are serialized; nested updates count as a single one.
+        """
+        with self.__update_lock:
+            self.__update_depth += 1
+            if self.__update_depth == 1:
+                self.__generation += 1
+            try:
+                yield
+            finally:
+                self.__update_depth -= 1
+                if self.__update_depth == 0:
+                    self.__generation += 1
+
+    def __lookup(self, generation: int) -> Optional[Dict[str, bytes]]:
+        """Private method: the cached quote if it was produced in the given generation"""
+        with self.__lock:
+            return self.__quote if self.__quote_generation == generation else None
+
+    def get(self, make_quote: Callable[[], Dict[str, bytes]], generation: Optional[int] = None) -> Dict[str, bytes]:
+        """Returns a quote of the PCR values, produced with make_quote on a cache miss
+
+        Args:
+            make_quote (Callable[[], Dict[str, bytes]]): function that signs a new quote
+            generation (int, optional): generation observed by the caller, defaults to the current one
+        """
+        if generation is None:
+            generation = self.__generation
+        cached = self.__lookup(generation)
+        if cached is not None:
+            return cached
+        with self.__quote_lock:
+            cached = self.__lookup(generation)
+            if cached is not None:
+                return cached
+            new_quote = make_quote()
+            if generation % 2 == 0 and self.__generation == generation:
+                with self.__lock:
+                    self.__quote, self.__quote_generation = new_quote, generation
+            return new_quote
+
+
+def make_tpm_backend(name: str = TPM_BACKEND, tcti: Optional[str] = TPM_TCTI):
+    """Create a TPM backend
+
+    Args:
+        name (str): "esapi", "cli" or "auto"; "auto" falls back to the
+            tpm2-tools backend if the ESAPI one is unavailable
+        tcti (str, optional): TCTI configuration string
+
+    Returns:
+        TpmEsapiBackend | TpmCliBackend
+    """
+    if name == "cli":
+        return TpmCliBackend(tcti)
+    if name == "esapi":
+        return TpmEsapiBackend(tcti)
+    if name != "auto":
+        raise ValueError(f"Unknown TPM backend: {name}")
+    try:
+        return TpmEsapiBackend(tcti)
+    except Exception as e:
+        logger.warning(f"ESAPI TPM backend unavailable ({e}), falling back to tpm2-tools")
+        return TpmCliBackend(tcti)
+
+
+_tpm_backend = None
+_tpm_backend_lock = Lock()
+quote_cache = QuoteCache()
+_cert_chain: Optional[List[bytes]] = None
+_cert_chain_error: Optional[str] = None
+
+
+def tpm_backend():
+    """Returns the TPM backend of the server, created on first use"""
+    global _tpm_backend
+    with _tpm_backend_lock:
+        if _tpm_backend is None:
+            _tpm_backend = InstrumentedTpmBackend(make_tpm_backend())
+            logger.info(f"Using the {_tpm_backend.name} TPM backend")
+        return _tpm_backend
+
+
 def tpm_nvread(offset: str) -> bytes:
-    return subprocess.run(
-        ["tpm2_nvread", "-Co", offset], capture_output=True, check=True
-    ).stdout
+    return tpm_backend().nv_read(int(offset, 16))
 
 
 def tpm_extend_pcr(pcr_index: int, hex_hash_value: str) -> None:
@@ -39,10 +429,22 @@ def tpm_extend_pcr(pcr_index: int, hex_hash_value: str) -> None:
     >>> pcr_index = 15
     >>> tpm_extend_pcr(pcr_index, hex_hash_value)
     """
+    with quote_cache.pcr_update():
+        tpm_backend().extend_pcr(pcr_index, hex_hash_value)
 
-    subprocess.run(
-        ["tpm2_pcrextend", f"{pcr_index}:sha256={hex_hash_value}"], check=True
-    )
+
+def pcr_update() -> ContextManager[None]:
+    """Context manager that groups PCR extends with the recording of what they measure
+
+    Snapshots taken with attested_snapshot never observe the PCRs and the
+    recorded state in the middle of an update.
+    """
+    return quote_cache.pcr_update()
+
+
+def pcr_generation() -> int:
+    """Returns the PCR generation, bumped when PCR updates start and complete"""
+    return quote_cache.generation
 
 
 def tpm_read_pcr(pcr_index: int) -> str:
@@ -52,62 +454,110 @@ def tpm_read_pcr(pcr_index: int) -> str:
 
     >>> _ = tpm_read_pcr(15)
     """
-    tpm2_pcrread = subprocess.run(
-        ["tpm2_pcrread", f"sha256:{pcr_index}"],
-        capture_output=True,
-        check=True,
-        text=True,
-    )
-    pcrread_output = yaml.load(tpm2_pcrread.stdout, Loader=yaml.BaseLoader)
-    # The result we get from tpm2_pcrread is something in this format '0x31A6F553CC0F9FC156877E35D35CA63AD9514A67C1B231B73665127CD6867631'
-    # This format is not the same as the one output by python hashlib .hexdigest() function
-    # so we transform it so that it is in this format '31a6f553cc0f9fc156877e35d35ca63ad9514a67c1b231b73665127cd6867631'
-    return pcrread_output["sha256"][str(pcr_index)].lower().removeprefix("0x")
+    return tpm_backend().read_pcr(pcr_index)
 
 
-def cert_chain() -> List[bytes]:
-    root_cert = open("Azure_TPM_certs/Azure Virtual TPM Root Certificate Authority 2023.crt", "rb").read()
-    intermediate_cert = open("Azure_TPM_certs/intermediate_ca.crt", "rb").read()
-    
-    AIK_CERT_INDEX = "0x01C101D0"
-    cert = tpm_nvread(AIK_CERT_INDEX)
+def _der_length(data: bytes) -> int:
+    """Length of the DER encoded structure at the start of data (header included)
+
+    NV indices are often larger than the certificate they hold, so the AIK
+    certificate read from the TPM may be followed by padding.
+    """
+    if len(data) < 2 or data[0] != 0x30:
+        raise ValueError("not a DER encoded SEQUENCE")
+    if data[1] < 0x80:
+        return 2 + data[1]
+    size_of_length = data[1] & 0x7F
+    if not 0 < size_of_length <= 4 or len(data) < 2 + size_of_length:
+        raise ValueError("invalid DER length")
+    return 2 + size_of_length + int.from_bytes(data[2:2 + size_of_length], "big")
+
+
+def load_cert_chain() -> List[bytes]:
+    """Read the AIK certificate chain and check that every certificate is well-formed
+
+    The chain (AIK certificate read from the TPM's NV storage, then the Azure
+    intermediate and root CAs shipped with the server) does not change for the
+    lifetime of the VM, so it is loaded once and reused for every attestation.
+    The outcome is reported by cert_chain_status.
+
+    Returns:
+        List[bytes]: the AIK certificate (DER), the intermediate and root CAs (PEM)
+    """
+    global _cert_chain, _cert_chain_error
+    try:
+        root_cert = (AZURE_CERTS_DIR / ROOT_CERT_FILE).read_bytes()
+        intermediate_cert = (AZURE_CERTS_DIR / INTERMEDIATE_CERT_FILE).read_bytes()
+        cert = tpm_nvread(hex(AIK_CERT_INDEX))
 
-    cert_chain = [cert, intermediate_cert, root_cert]
-    
-    return cert_chain
+        aik_cert = x509.load_der_x509_certificate(cert[:_der_length(cert)])
+        intermediate = x509.load_pem_x509_certificate(intermediate_cert)
+        root = x509.load_pem_x509_certificate(root_cert)
+        if aik_cert.issuer != intermediate.subject or intermediate.issuer != root.subject:
+            raise ValueError("the certificates do not form a chain")
+    except Exception as e:
+        _cert_chain_error = f"Invalid AIK certificate chain: {e}"
+        logger.error(_cert_chain_error)
+        raise
+
+    _cert_chain, _cert_chain_error = [cert, intermediate_cert, root_cert], None
+    logger.info(f"Loaded the AIK certificate chain ({aik_cert.subject.rfc4514_string()})")
+    return _cert_chain
+
+
+def cert_chain_status() -> Dict[str, Any]:
+    """Return whether the certificate chain has been loaded and the loading error, if any"""
+    return {"ready": _cert_chain is not None, "error": _cert_chain_error}
+
+
+def cert_chain() -> List[bytes]:
+    """Returns the AIK certificate chain, loading it if it was not loaded at startup"""
+    if _cert_chain is not None:
+        return _cert_chain
+    return load_cert_chain()
 
 
 def test_cert_chain():
     cert_chain()
 
 
-def quote() -> Dict[str, bytes]:
+def quote(qualifying_data: Optional[bytes] = None) -> Dict[str, bytes]:
     """
     Produce a quote attesting all the PCRs from the SHA256 PCR bank
 
     Quote is signed using the AIK_PUB_INDEX key
 
+    Without qualifying data, the last quote is reused until a PCR is extended.
+    A verifier's nonce passed as qualifying data always yields a fresh quote.
+    """
+    if qualifying_data:
+        return tpm_backend().quote(qualifying_data)
+    return quote_cache.get(tpm_backend().quote)
+
+
+def attested_snapshot(read_state: Callable[[], T], qualifying_data: Optional[bytes] = None) -> Tuple[T, Dict[str, bytes]]:
+    """Read some measured state and a quote of the PCRs it was measured in, consistently
+
+    Does not block on PCR updates other than for the duration of an extend:
+    the state and the quote are read optimistically and read again if a PCR
+    update happened in the meantime.
+
+    Args:
+        read_state (Callable[[], T]): returns a snapshot of the state recorded in pcr_update sections
+        qualifying_data (Optional[bytes]): verifier's nonce to include in the quote
+
+    Returns:
+        Tuple[T, Dict[str, bytes]]: the state and the quote
     """
-    print("starting quote generation")
-    AIK_PUB_INDEX = "0x81000003"
-    with (
-        tempfile.NamedTemporaryFile() as quote_msg_file,
-        tempfile.NamedTemporaryFile() as quote_sig_file,
-        tempfile.NamedTemporaryFile() as quote_pcr_file,
-    ):
-        # fmt:off
-        subprocess.run(["tpm2_quote", "--quiet",
-                        "--key-context", AIK_PUB_INDEX, 
-                        "--pcr-list", "sha256:0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23", 
-                        "--message" , quote_msg_file.name, 
-                        "--signature", quote_sig_file.name, 
-                        "--pcr", quote_pcr_file.name, 
-                        "--hash-algorithm", "sha256"], check=True)
-        # fmt:on
-
-        quote_msg = quote_msg_file.read()
-        quote_sig = quote_sig_file.read()
-        quote_pcr = quote_pcr_file.read()
-    print("finished quote generation")
-
-    return {"message": quote_msg, "signature": quote_sig, "pcr": quote_pcr}
+    while True:
+        generation = quote_cache.generation
+        if generation % 2 == 1:
+            time.sleep(UPDATE_POLL_INTERVAL)
+            continue
+        state = read_state()
+        if qualifying_data:
+            signed_quote = tpm_backend().quote(qualifying_data)
+        else:
+            signed_quote = quote_cache.get(tpm_backend().quote, generation)
+        if quote_cache.generation == generation:
+            return state, signed_quote
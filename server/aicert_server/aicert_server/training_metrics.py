@@ -0,0 +1,171 @@
+import ast
+import json
+import re
+import time
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from aicert_server.log_follower import LogFollower
+from aicert_server.metrics import (
+    TRAINING_LEARNING_RATE,
+    TRAINING_LOSS,
+    TRAINING_METRICS_SUBSCRIBERS,
+    TRAINING_SAMPLES_PER_SECOND_PER_DEVICE,
+    TRAINING_STEP,
+    TRAINING_TOKENS_PER_SECOND_PER_DEVICE,
+)
+
+# Metrics logged by the HuggingFace Trainer (which axolotl uses), printed as a dict:
+# {'loss': 1.2345, 'learning_rate': 2e-05, 'epoch': 0.05} every logging_steps, and
+# {'train_runtime': ..., 'train_samples_per_second': ..., 'train_loss': ...} at the end
+_LOGGED_METRICS = re.compile(r"\{'[a-z_]+': .*\}")
+# Progress bar of the training loop, which has no description unlike the other bars:
+#  12%|█▏        | 30/250 [01:23<10:12,  2.78s/it]
+_PROGRESS_BAR = re.compile(r"^\s*\d+%\|[^|]*\|\s*(\d+)/(\d+) \[[^,\]]*,\s*([\d.]+)(it/s|s/it)")
+# Metrics followed over the training, as opposed to the final train_* metrics
+_STEP_METRICS = ("loss", "learning_rate", "grad_norm", "epoch")
+
+
+def throughput_factors(config: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    """Samples and tokens processed by a training step on each device, from an axolotl configuration
+
+    The training runs a data parallel process per GPU, which all take the same
+    steps: the throughput of the training is that of a device times the number
+    of GPUs. Tokens are only known with sample packing, where every sample is
+    sequence_len tokens long.
+
+    Returns:
+        Tuple[Optional[int], Optional[int]]: samples and tokens per step, None if unknown
+    """
+    try:
+        samples = int(config.get("micro_batch_size") or 1) * int(config.get("gradient_accumulation_steps") or 1)
+    except (TypeError, ValueError):
+        return None, None
+    tokens = samples * int(config["sequence_len"]) if config.get("sample_packing") and config.get("sequence_len") else None
+    return samples, tokens
+
+
+class TrainingMetrics:
+    """Extracts training metrics from the output of the training container, as it is written
+
+    Each time the training progresses or logs metrics, a point (step, total steps,
+    epoch, loss, learning rate, gradient norm, and the throughput in steps, samples
+    and tokens per second) is published to the follower and to the Prometheus
+    gauges. Samples and tokens per second are per device, estimated from the step
+    rate of the progress bar and the throughput factors (see throughput_factors).
+    """
+
+    def __init__(self) -> None:
+        self.__lock = Lock()
+        self.follower = LogFollower(tail_lines=1, spill=False, subscribers=TRAINING_METRICS_SUBSCRIBERS)
+        self.reset()
+
+    def reset(self, samples_per_step: Optional[int] = None, tokens_per_step: Optional[int] = None) -> None:
+        """Start following a new training run
+
+        Args:
+            samples_per_step (Optional[int]): samples processed by a training step, if known
+            tokens_per_step (Optional[int]): tokens processed by a training step, if known
+        """
+        with self.__lock:
+            self.__samples_per_step = samples_per_step
+            self.__tokens_per_step = tokens_per_step
+            self.__point: Dict[str, Any] = {
+                "time": None, "step": None, "total_steps": None, **{name: None for name in _STEP_METRICS},
+                "steps_per_second": None, "samples_per_second_per_device": None, "tokens_per_second_per_device": None,
+            }
+            self.__min_loss: Optional[float] = None
+            # Count, sum, min and max of the samples and tokens per second
+            self.__throughput: Dict[str, List[float]] = {
+                name: [0, 0.0, float("inf"), 0.0]
+                for name in ("samples_per_second_per_device", "tokens_per_second_per_device")
+            }
+            self.__train: Dict[str, Any] = {}
+
+    def feed(self, line: str) -> None:
+        """Parse a line of output of the training container (stdout or stderr)"""
+        progress = _PROGRESS_BAR.match(line)
+        if progress is not None:
+            step, total, rate, unit = progress.groups()
+            if float(rate) > 0:
+                self.__update_progress(int(step), int(total), float(rate) if unit == "it/s" else 1 / float(rate))
+            return
+        logged = _LOGGED_METRICS.search(line)
+        if logged is not None:
+            try:
+                values = ast.literal_eval(logged.group())
+            except (ValueError, SyntaxError):
+                return
+            if isinstance(values, dict):
+                self.__update_logged(values)
+
+    def __update_progress(self, step: int, total: int, steps_per_second: float) -> None:
+        """Private method: record a progress bar update"""
+        with self.__lock:
+            # Bars of other loops (e.g. evaluation) have another total
+            if self.__point["total_steps"] not in (None, total) or step == self.__point["step"]:
+                return
+            self.__point.update(step=step, total_steps=total, steps_per_second=steps_per_second)
+            for name, per_step in (
+                ("samples_per_second_per_device", self.__samples_per_step),
+                ("tokens_per_second_per_device", self.__tokens_per_step),
+            ):
+                if per_step is not None:
+                    value = steps_per_second * per_step
+                    self.__point[name] = value
+                    count, value_sum, low, high = self.__throughput[name]
+                    self.__throughput[name] = [count + 1, value_sum + value, min(low, value), max(high, value)]
+            self.__publish()
+
+    def __update_logged(self, values: Dict[str, Any]) -> None:
+        """Private method: record the metrics logged by the trainer"""
+        with self.__lock:
+            self.__train.update({name: value for name, value in values.items() if name.startswith("train_")})
+            step_metrics = {name: values[name] for name in _STEP_METRICS if name in values}
+            if not step_metrics:
+                return
+            self.__point.update(step_metrics)
+            if "loss" in step_metrics and (self.__min_loss is None or step_metrics["loss"] < self.__min_loss):
+                self.__min_loss = step_metrics["loss"]
+            self.__publish()
+
+    def __publish(self) -> None:
+        """Private method: publish the current point, the lock must be held"""
+        self.__point["time"] = time.time()
+        for gauge, name in (
+            (TRAINING_STEP, "step"),
+            (TRAINING_LOSS, "loss"),
+            (TRAINING_LEARNING_RATE, "learning_rate"),
+            (TRAINING_SAMPLES_PER_SECOND_PER_DEVICE, "samples_per_second_per_device"),
+            (TRAINING_TOKENS_PER_SECOND_PER_DEVICE, "tokens_per_second_per_device"),
+        ):
+            if self.__point[name] is not None:
+                gauge.set(self.__point[name])
+        self.follower.publish(json.dumps(self.__point))
+
+    def summary(self) -> Dict[str, Any]:
+        """Return a summary of the training run: last point, loss and throughput statistics and final metrics
+
+        Throughput statistics (mean, min and max) are None when the throughput is unknown.
+
+        The run is completed if the trainer logged its final metrics, the summary
+        only covers the steps that were run otherwise.
+        """
+        with self.__lock:
+            return {
+                "completed": "train_runtime" in self.__train,
+                "step": self.__point["step"],
+                "total_steps": self.__point["total_steps"],
+                "epoch": self.__point["epoch"],
+                "loss": self.__point["loss"],
+                "min_loss": self.__min_loss,
+                "learning_rate": self.__point["learning_rate"],
+                **{
+                    name: {"mean": value_sum / count, "min": low, "max": high} if count else None
+                    for name, (count, value_sum, low, high) in self.__throughput.items()
+                },
+                "train": dict(self.__train),
+            }
+
+
+training_metrics = TrainingMetrics()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Compare output archive codecs on a synthetic `lora-out` tree
+
+The tree mimics a LoRA finetune output: incompressible adapter weights
+and optimizer states, plus compressible JSON and tokenizer files.
+For each codec, the benchmark reports the wall time to write and measure
+the archive, and the archive size. The `legacy` row is the previous
+pipeline: single-threaded DEFLATE with `zipfile`, then a hash of the
+archive read back from disk.
+
+Usage:
+    python benchmarks/bench_archive_codecs.py --weights-mb 512 --checkpoints 2
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+from aicert_common.protocol import OutputCompression
+from aicert_server.archive import HashingArchiveWriter, zstandard
+from aicert_server.hashing import sha256_file
+
+
+def make_lora_out(workspace: Path, weights_mb: int, checkpoints: int) -> list:
+    """Create the synthetic tree and return the (path, arcname) list to archive"""
+    lora_out = workspace / "lora-out"
+    directories = [lora_out] + [lora_out / f"checkpoint-{i}" for i in range(1, checkpoints + 1)]
+    for directory in directories:
+        directory.mkdir(parents=True)
+        with open(directory / "adapter_model.safetensors", "wb") as f:
+            for _ in range(weights_mb):
+                f.write(os.urandom(1024 * 1024))
+        (directory / "adapter_config.json").write_text(json.dumps({"r": 32, "lora_alpha": 16}, indent=2))
+        (directory / "trainer_state.json").write_text(json.dumps({
+            "total_flos": 1.0,
+            "log_history": [{"step": i, "loss": 1.0 / (i + 1), "learning_rate": 2e-4} for i in range(20_000)],
+        }, indent=2))
+        (directory / "tokenizer.json").write_text(json.dumps({f"token_{i}": i for i in range(200_000)}))
+    return [
+        (path, str(path.relative_to(workspace)))
+        for path in sorted(lora_out.rglob("*"))
+        if path.is_file()
+    ]
+
+
+def legacy(files: list, archive_path: Path) -> None:
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for path, arcname in files:
+            zipf.write(path, arcname)
+    sha256_file(archive_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights-mb", type=int, default=256, help="size of each adapter weights file")
+    parser.add_argument("--checkpoints", type=int, default=2, help="number of checkpoint directories")
+    args = parser.parse_args()
+
+    codecs = {
+        "store": OutputCompression(codec="store"),
+        "deflate (1 thread)": OutputCompression(codec="deflate", threads=1),
+        "deflate (all cores)": OutputCompression(codec="deflate"),
+    }
+    if zstandard is not None:
+        codecs["zstd level 3 (all cores)"] = OutputCompression(codec="zstd", level=3)
+    else:
+        print("zstandard is not installed, skipping zstd")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workspace = Path(tmp)
+        files = make_lora_out(workspace, args.weights_mb, args.checkpoints)
+        input_size = sum(path.stat().st_size for path, _ in files)
+        print(f"{len(files)} files, {input_size / 1e6:.0f} MB, {os.cpu_count()} CPUs\n")
+        print(f"{'codec':<28}{'wall time (s)':>15}{'size (MB)':>12}{'ratio':>8}")
+
+        runs = [("legacy zipfile + re-hash", lambda path: legacy(files, path))]
+        for name, compression in codecs.items():
+            def run(path, compression=compression):
+                with HashingArchiveWriter(path, compression) as archive:
+                    archive.write_all(files)
+            runs.append((name, run))
+
+        for name, run in runs:
+            archive_path = workspace / "outputs.zip"
+            start = time.perf_counter()
+            run(archive_path)
+            elapsed = time.perf_counter() - start
+            size = archive_path.stat().st_size
+            print(f"{name:<28}{elapsed:>15.2f}{size / 1e6:>12.1f}{input_size / size:>8.2f}")
+            archive_path.unlink()
+
+
+if __name__ == "__main__":
+    main()
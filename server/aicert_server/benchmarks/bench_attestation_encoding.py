@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Compare the size and the encode/decode time of attestations in JSON, CBOR and MessagePack
+
+The attestation is synthetic but has the layout served by /attestation: an event
+log of the given number of input resource events, an outputs event, a quote of
+the size of a 24 PCR tpm2_quote output and a two certificate chain.
+
+Usage:
+    python benchmarks/bench_attestation_encoding.py --events 10000 --iterations 20
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import time
+
+from aicert_common.encoding import MEDIA_TYPES, decode_attestation, encode_attestation
+
+# Message + signature + serialized PCRs of a quote of the 24 SHA-256 PCRs
+QUOTE_SIZE = 145 + 262 + 132 + 4 + 532
+
+
+def synthetic_attestation(events: int) -> dict:
+    event_log = [
+        json.dumps(
+            {
+                "event_type": "input_resource",
+                "content": {
+                    "spec": {"resource_proto": {"resource_type": "file", "path": f"dataset/part-{i:06d}.jsonl"}},
+                    "resolved": {"hash": hashlib.sha256(str(i).encode()).hexdigest()},
+                },
+            }
+        )
+        for i in range(events)
+    ]
+    outputs = json.dumps(
+        {
+            "event_type": "outputs",
+            "content": [{"spec": {"path": "model.safetensors"}, "resolved": {"hash": "00" * 32}}],
+        }
+    )
+    return {
+        "ca_cert": "",
+        "event_log": event_log,
+        "output_event_log": [outputs],
+        "remote_attestation": {
+            "quote": os.urandom(QUOTE_SIZE),
+            "cert_chain": [os.urandom(1400), os.urandom(1500)],
+        },
+    }
+
+
+def measure(operation, iterations: int) -> float:
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10000, help="number of events in the event log")
+    parser.add_argument("--iterations", type=int, default=20, help="number of runs of each operation")
+    args = parser.parse_args()
+
+    attestation = synthetic_attestation(args.events)
+
+    print(f"{'encoding':<22}{'size (KiB)':>12}{'encode (ms)':>14}{'decode (ms)':>14}")
+    for media_type in MEDIA_TYPES:
+        payload = encode_attestation(attestation, media_type)
+        encode = measure(lambda: encode_attestation(attestation, media_type), args.iterations)
+        decode = measure(lambda: decode_attestation(payload, media_type), args.iterations)
+        print(f"{media_type:<22}{len(payload) / 1024:>12.1f}{encode * 1e3:>14.2f}{decode * 1e3:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
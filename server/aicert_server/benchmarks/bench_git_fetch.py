@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Compare the full and fast model/dataset fetch modes against a local git+LFS remote
+
+A stand-in for a Hugging Face repository is created locally: a bare repository
+whose history contains several versions of LFS-tracked weights and of a regular
+file. Both fetch modes then check out an older, pinned commit, as the server does.
+
+For each mode, the benchmark reports the wall time and the bytes transferred,
+measured as the size of the git object and LFS stores of the resulting checkout
+(with a local remote, every stored byte went through the transport).
+
+Requires git and git-lfs (git-lfs transfers to file:// remotes natively).
+
+Usage:
+    python benchmarks/bench_git_fetch.py --weights-mb 64 --commits 5
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from aicert_server.git_fetch import full_fetch_cmd, fast_fetch_cmd
+
+
+def git(*args, cwd: Path, env: dict) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, env=env, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def make_remote(root: Path, weights_mb: int, commits: int, env: dict) -> tuple:
+    """Create the stand-in remote and return its url and the pinned commit"""
+    remote = root / "remote.git"
+    git("init", "--quiet", "--bare", str(remote), cwd=root, env=env)
+    git("config", "uploadpack.allowAnySHA1InWant", "true", cwd=remote, env=env)
+
+    work = root / "upstream"
+    git("init", "--quiet", str(work), cwd=root, env=env)
+    git("lfs", "install", "--local", cwd=work, env=env)
+    git("lfs", "track", "*.safetensors", cwd=work, env=env)
+    git("remote", "add", "origin", f"file://{remote}", cwd=work, env=env)
+
+    history = []
+    for i in range(commits):
+        with open(work / "model.safetensors", "wb") as f:
+            for _ in range(weights_mb):
+                f.write(os.urandom(1024 * 1024))
+        with open(work / "README.md", "a") as f:
+            f.write(f"revision {i}\n" * 10_000)
+        git("add", ".", cwd=work, env=env)
+        git("commit", "--quiet", "-m", f"revision {i}", cwd=work, env=env)
+        history.append(git("rev-parse", "HEAD", cwd=work, env=env))
+    git("push", "--quiet", "origin", "HEAD:main", cwd=work, env=env)
+    git("symbolic-ref", "HEAD", "refs/heads/main", cwd=remote, env=env)
+
+    # Pin a commit in the middle of the history, as a finetune of an older revision would
+    return f"file://{remote}", history[len(history) // 2]
+
+
+def store_size(checkout: Path) -> int:
+    return sum(
+        (Path(root) / file).lstat().st_size
+        for root, _, files in os.walk(checkout / ".git")
+        for file in files
+        if "objects" in Path(root).parts
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights-mb", type=int, default=64, help="size of each version of the weights")
+    parser.add_argument("--commits", type=int, default=5, help="number of commits in the remote history")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        # Isolate the git configuration written by `git lfs install`
+        env = {
+            **os.environ,
+            "HOME": str(root),
+            "GIT_AUTHOR_NAME": "aicert", "GIT_AUTHOR_EMAIL": "aicert@localhost",
+            "GIT_COMMITTER_NAME": "aicert", "GIT_COMMITTER_EMAIL": "aicert@localhost",
+        }
+        url, commit = make_remote(root, args.weights_mb, args.commits, env)
+        print(f"remote: {args.commits} commits of {args.weights_mb} MB weights, pinned {commit}\n")
+        print(f"{'mode':<8}{'wall time (s)':>15}{'transferred (MB)':>18}")
+
+        for mode, make_cmd in [("full", full_fetch_cmd), ("fast", fast_fetch_cmd)]:
+            workspace = root / f"workspace-{mode}"
+            workspace.mkdir()
+            cmd, cmd_env = make_cmd(url, commit, "model")
+            start = time.perf_counter()
+            subprocess.run(
+                str(cmd), shell=True, cwd=workspace, check=True, capture_output=True,
+                env={**env, **dict(var.split("=", 1) for var in cmd_env)},
+            )
+            elapsed = time.perf_counter() - start
+            checkout = workspace / "model"
+            assert git("rev-parse", "HEAD", cwd=checkout, env=env) == commit
+            print(f"{mode:<8}{elapsed:>15.2f}{store_size(checkout) / 1e6:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
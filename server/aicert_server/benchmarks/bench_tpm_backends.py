@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Compare the latency of PCR extends and quotes with the tpm2-tools and ESAPI TPM backends
+
+Each operation is run the given number of times with both backends, against
+the TPM selected by the TCTI (the TSS default when unset). Extends target a
+debug PCR (16) so that the measured PCRs are left untouched. Quotes require the
+AIK at its persistent handle, as on the runners; use --skip-quote otherwise.
+
+Requires tpm2-tools and tpm2-pytss.
+
+Usage:
+    python benchmarks/bench_tpm_backends.py --iterations 50 --tcti swtpm:port=2321
+"""
+
+import argparse
+import statistics
+import time
+
+from aicert_server.tpm import TpmCliBackend, TpmEsapiBackend
+
+DEBUG_PCR = 16
+
+
+def measure(operation, iterations: int) -> list:
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50, help="number of runs of each operation")
+    parser.add_argument("--tcti", default=None, help="TCTI configuration string, in the tpm2-tools format")
+    parser.add_argument("--skip-quote", action="store_true", help="only measure PCR extends")
+    args = parser.parse_args()
+
+    backends = [TpmCliBackend(args.tcti), TpmEsapiBackend(args.tcti)]
+    operations = [("extend", lambda backend: backend.extend_pcr(DEBUG_PCR, "00" * 32))]
+    if not args.skip_quote:
+        operations.append(("quote", lambda backend: backend.quote()))
+
+    print(f"{'operation':<12}{'backend':<10}{'median (ms)':>14}{'p95 (ms)':>12}")
+    for name, operation in operations:
+        for backend in backends:
+            latencies = sorted(measure(lambda: operation(backend), args.iterations))
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            print(f"{name:<12}{backend.name:<10}{statistics.median(latencies) * 1e3:>14.2f}{p95 * 1e3:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Chunked Merkle trees for output files
+
+Output files are split into fixed-size chunks. Each chunk is a leaf
+of a binary Merkle tree whose root is recorded in the outputs event
+(and therefore extended into the output PCR). Any chunk can then be
+verified on its own against the list of leaves, which is itself
+verified against the root.
+
+Leaves and inner nodes are hashed with distinct prefixes (as in RFC 6962)
+so that an inner node can never be passed off as a chunk. On levels
+with an odd number of nodes, the last node is promoted as is.
+
+The same trees commit to batches of verifier nonces (see inclusion_proof).
+"""
+
+import hashlib
+from typing import List, Optional, Sequence
+
+MERKLE_CHUNK_SIZE = 4 * 1024 * 1024
+
+_LEAF_PREFIX = b"\x00"
+_NODE_PREFIX = b"\x01"
+
+
+def leaf_hash(chunk: bytes) -> bytes:
+    """Returns the hash of a chunk as a Merkle leaf"""
+    hash = hashlib.sha256(_LEAF_PREFIX)
+    hash.update(chunk)
+    return hash.digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    """Returns the hash of an inner Merkle node"""
+    return hashlib.sha256(_NODE_PREFIX + left + right).digest()
+
+
+def merkle_root(leaves: Sequence[bytes]) -> bytes:
+    """Returns the root of the Merkle tree built over the given leaves
+
+    The root of an empty file (no leaves) is the leaf hash of an empty chunk.
+
+    >>> merkle_root([leaf_hash(b"a")]) == leaf_hash(b"a")
+    True
+    >>> merkle_root([leaf_hash(b"a"), leaf_hash(b"b")]) == node_hash(leaf_hash(b"a"), leaf_hash(b"b"))
+    True
+    """
+    level: List[bytes] = list(leaves) or [leaf_hash(b"")]
+    while len(level) > 1:
+        level = [
+            node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ]
+    return level[0]
+
+
+def merkle_levels(leaves: Sequence[bytes]) -> List[List[bytes]]:
+    """Returns all the levels of the Merkle tree, from the leaves up to the root"""
+    levels: List[List[bytes]] = [list(leaves) or [leaf_hash(b"")]]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([
+            node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ])
+    return levels
+
+
+def inclusion_proof(leaves: Sequence[bytes], index: int, levels: Optional[List[List[bytes]]] = None) -> List[bytes]:
+    """Returns the sibling hashes needed to recompute the root from the leaf at index
+
+    Siblings are listed from the leaf level up; levels where the node
+    is promoted have no sibling. The levels of the tree (see merkle_levels)
+    can be passed to build many proofs over the same leaves.
+    """
+    if levels is None:
+        levels = merkle_levels(leaves)
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(level[sibling])
+        index //= 2
+    return proof
+
+
+def root_from_proof(leaf: bytes, index: int, count: int, proof: Sequence[bytes]) -> bytes:
+    """Returns the root of a tree of count leaves given a leaf, its index and its inclusion proof
+
+    >>> leaves = [leaf_hash(bytes([i])) for i in range(5)]
+    >>> all(
+    ...     root_from_proof(leaves[i], i, 5, inclusion_proof(leaves, i)) == merkle_root(leaves)
+    ...     for i in range(5)
+    ... )
+    True
+    """
+    if not 0 <= index < count:
+        raise ValueError(f"Leaf index {index} out of range for {count} leaves")
+    node = leaf
+    siblings = iter(proof)
+    while count > 1:
+        if index ^ 1 < count:
+            sibling = next(siblings, None)
+            if sibling is None:
+                raise ValueError("Inclusion proof is too short")
+            node = node_hash(sibling, node) if index & 1 else node_hash(node, sibling)
+        index //= 2
+        count = (count + 1) // 2
+    if next(siblings, None) is not None:
+        raise ValueError("Inclusion proof is too long")
+    return node
+
+
+def chunk_count(size: int, chunk_size: int = MERKLE_CHUNK_SIZE) -> int:
+    """Returns the number of chunks (leaves) of a file of the given size"""
+    return (size + chunk_size - 1) // chunk_size
+
+
+class ChunkHasher:
+    """Incrementally compute the Merkle leaves of a stream of bytes
+
+    Args:
+        chunk_size (int): size of each chunk
+    """
+
+    def __init__(self, chunk_size: int = MERKLE_CHUNK_SIZE) -> None:
+        self.chunk_size = chunk_size
+        self.leaves: List[bytes] = []
+        self.size = 0
+        self.__buffer = bytearray()
+
+    def update(self, data: bytes) -> None:
+        """Feed more bytes of the stream"""
+        self.size += len(data)
+        self.__buffer += data
+        if len(self.__buffer) >= self.chunk_size:
+            view = memoryview(self.__buffer)
+            full = len(self.__buffer) - len(self.__buffer) % self.chunk_size
+            for offset in range(0, full, self.chunk_size):
+                self.leaves.append(leaf_hash(view[offset:offset + self.chunk_size]))
+            view.release()
+            del self.__buffer[:full]
+
+    def finalize(self) -> List[bytes]:
+        """Hash the last partial chunk and return all the leaves"""
+        if self.__buffer:
+            self.leaves.append(leaf_hash(bytes(self.__buffer)))
+            self.__buffer.clear()
+        return self.leaves
+
+    def root(self) -> bytes:
+        """Returns the Merkle root of the stream (call after `finalize`)"""
+        return merkle_root(self.leaves)
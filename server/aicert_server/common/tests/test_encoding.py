@@ -0,0 +1,68 @@
+import base64
+
+import pytest
+
+from aicert_common.encoding import (
+    CBOR_MEDIA_TYPE,
+    JSON_MEDIA_TYPE,
+    MEDIA_TYPES,
+    MSGPACK_MEDIA_TYPE,
+    decode_attestation,
+    detect_media_type,
+    encode_attestation,
+    negotiate_media_type,
+)
+
+ATTESTATION = {
+    "ca_cert": "",
+    "event_log": ['{"event_type": "build_request"}'],
+    "output_event_log": [],
+    "remote_attestation": {"quote": bytes(range(256)), "cert_chain": [b"\x30\x82", b"\x00"]},
+}
+
+
+@pytest.mark.parametrize("media_type", [CBOR_MEDIA_TYPE, MSGPACK_MEDIA_TYPE])
+def test_binary_encodings_keep_raw_bytes(media_type):
+    payload = encode_attestation(ATTESTATION, media_type)
+    assert detect_media_type(payload) == media_type
+    assert decode_attestation(payload) == ATTESTATION
+
+
+def test_json_encoding_uses_base64_objects():
+    payload = encode_attestation(ATTESTATION, JSON_MEDIA_TYPE)
+    assert detect_media_type(payload) == JSON_MEDIA_TYPE
+    decoded = decode_attestation(payload)
+    quote = decoded["remote_attestation"]["quote"]
+    assert base64.b64decode(quote["base64"]) == ATTESTATION["remote_attestation"]["quote"]
+    assert decoded["event_log"] == ATTESTATION["event_log"]
+
+
+def test_cbor_encoding_is_canonical():
+    reordered = dict(reversed(list(ATTESTATION.items())))
+    assert encode_attestation(reordered, CBOR_MEDIA_TYPE) == encode_attestation(ATTESTATION, CBOR_MEDIA_TYPE)
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        (None, JSON_MEDIA_TYPE),
+        ("*/*", JSON_MEDIA_TYPE),
+        ("application/cbor", CBOR_MEDIA_TYPE),
+        ("application/x-msgpack", MSGPACK_MEDIA_TYPE),
+        ("application/json;q=0.5, application/cbor", CBOR_MEDIA_TYPE),
+        ("application/cbor;q=0.2, application/msgpack;q=0.8", MSGPACK_MEDIA_TYPE),
+        ("text/html, application/json", JSON_MEDIA_TYPE),
+        ("text/html", None),
+        ("application/cbor;q=0", None),
+    ],
+)
+def test_negotiate_media_type(accept, expected):
+    assert negotiate_media_type(accept) == expected
+
+
+def test_unsupported_media_type():
+    with pytest.raises(ValueError):
+        encode_attestation(ATTESTATION, "text/html")
+    with pytest.raises(ValueError):
+        detect_media_type(b"<html>")
+    assert set(MEDIA_TYPES) == {JSON_MEDIA_TYPE, CBOR_MEDIA_TYPE, MSGPACK_MEDIA_TYPE}
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from aicert_common.merkle import (
+    ChunkHasher,
+    chunk_count,
+    inclusion_proof,
+    leaf_hash,
+    merkle_root,
+    node_hash,
+    root_from_proof,
+)
+
+
+def test_merkle_root_odd_levels():
+    leaves = [leaf_hash(bytes([i])) for i in range(3)]
+    assert merkle_root(leaves) == node_hash(node_hash(leaves[0], leaves[1]), leaves[2])
+
+
+def test_chunk_hasher_is_independent_of_write_sizes():
+    data = os.urandom(10_000)
+    expected = [leaf_hash(data[i:i + 1024]) for i in range(0, len(data), 1024)]
+
+    for write_size in (1, 100, 1024, 4096, 10_000):
+        chunks = ChunkHasher(chunk_size=1024)
+        for i in range(0, len(data), write_size):
+            chunks.update(data[i:i + write_size])
+        assert chunks.finalize() == expected
+        assert chunks.size == len(data)
+        assert len(chunks.leaves) == chunk_count(len(data), 1024)
+        assert chunks.root() == merkle_root(expected)
+
+
+def test_empty_stream():
+    chunks = ChunkHasher()
+    assert chunks.finalize() == []
+    assert chunks.root() == leaf_hash(b"")
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 7, 8, 13])
+def test_inclusion_proofs(count):
+    leaves = [leaf_hash(os.urandom(32)) for _ in range(count)]
+    root = merkle_root(leaves)
+
+    for index, leaf in enumerate(leaves):
+        proof = inclusion_proof(leaves, index)
+        assert root_from_proof(leaf, index, count, proof) == root
+        if count > 1:
+            with pytest.raises(ValueError):
+                root_from_proof(leaf, index, count, proof[:-1])
+            # The proof does not hold for another leaf
+            assert root_from_proof(leaves[index - 1], index, count, proof) != root